@@ -0,0 +1,106 @@
+"""
+Synthetic Spring Boot repository generator
+
+Builds a repository as a ``{path: content}`` dictionary, ready to be served
+by StubBitbucketServer. Every service gets an ``application.yml`` under
+``depth`` levels of group directories; a share of them are multi-document
+files with profile overrides, and non-YAML files are mixed in so listing
+has something to filter out. The same arguments and seed always produce the
+same corpus.
+"""
+
+import random
+from typing import Dict, List
+
+INFRASTRUCTURE = ['datasource', 'redis', 'kafka', 'rabbitmq']
+PROFILES = ['dev', 'staging', 'prod']
+
+
+def service_document(name: str, port: int, peers: List[str], infrastructure: List[str], padding: int,
+                     rng: random.Random) -> str:
+    """Main document of a service: identity, dependencies, infrastructure and ``padding`` extra settings"""
+    lines = [
+        'spring:',
+        '  application:',
+        f'    name: {name}',
+        f'    version: 1.{rng.randint(0, 20)}.{rng.randint(0, 9)}',
+        '  server:',
+        f'    port: ${{SERVER_PORT:{port}}}',
+        '  profiles:',
+        '    active: default',
+    ]
+    if 'datasource' in infrastructure:
+        lines += [
+            '  datasource:',
+            '    primary:',
+            f'      url: jdbc:postgresql://db.internal:5432/{name.replace("-", "_")}',
+            '      username: ${DB_USERNAME:app}',
+            '      driver-class-name: org.postgresql.Driver',
+        ]
+    if 'redis' in infrastructure:
+        lines += ['  redis:', '    host: ${REDIS_HOST:redis.internal}', '    port: 6379']
+    if 'kafka' in infrastructure:
+        lines += ['  kafka:', '    bootstrap-servers: kafka-1.internal:9092,kafka-2.internal:9092',
+                  '    consumer:', f'      group-id: {name}']
+    if 'rabbitmq' in infrastructure:
+        lines += ['  rabbitmq:', '    host: rabbitmq.internal', '    port: 5672']
+    lines += ['  app:', '    external-services:']
+    lines += [f'      {peer}: http://{peer}.internal:8080' for peer in peers] or ['      {}']
+    if 'kafka' in infrastructure:
+        lines += ['    kafka-topics:', f'      {name}-events: {name}.events.v1']
+    if padding:
+        lines += ['settings:']
+        lines += [f'  setting-{index:04d}: value-{rng.getrandbits(32):08x}' for index in range(padding)]
+    return '\n'.join(lines) + '\n'
+
+
+def profile_document(profile: str, port: int) -> str:
+    """Profile override appended to multi-document files"""
+    return (
+        'spring:\n'
+        '  config:\n'
+        '    activate:\n'
+        f'      on-profile: {profile}\n'
+        '  server:\n'
+        f'    port: {port}\n'
+        'logging:\n'
+        '  level:\n'
+        f'    root: {"DEBUG" if profile == "dev" else "INFO"}\n'
+    )
+
+
+def generate_corpus(files: int = 200, depth: int = 2, padding: int = 20, multi_doc_ratio: float = 0.2,
+                    other_files: float = 0.5, seed: int = 0) -> Dict[str, str]:
+    """
+    Generate a synthetic repository of Spring Boot services.
+
+    Args:
+        files (int): Number of YAML files (one service each)
+        depth (int): Group directories above each service directory
+        padding (int): Extra settings per file, to scale file size (about 40 bytes each)
+        multi_doc_ratio (float): Share of files with one to three profile documents appended
+        other_files (float): Non-YAML files per YAML file (README.md, pom.xml), which listing skips
+        seed (int): Random seed
+
+    Returns:
+        Dict[str, str]: File contents by repository path
+    """
+    rng = random.Random(seed)
+    names = [f'svc-{index:05d}' for index in range(files)]
+    corpus = {}
+    for index, name in enumerate(names):
+        groups = '/'.join(f'group-{(index // 10 ** (level + 1)) % 10}' for level in reversed(range(depth)))
+        directory = f'{groups}/{name}' if groups else name
+        port = 8000 + index % 1000
+        peers = rng.sample(names[:index], min(index, rng.randint(0, 3)))
+        infrastructure = rng.sample(INFRASTRUCTURE, rng.randint(0, len(INFRASTRUCTURE)))
+        content = service_document(name, port, peers, infrastructure, padding, rng)
+        if rng.random() < multi_doc_ratio:
+            profiles = rng.sample(PROFILES, rng.randint(1, len(PROFILES)))
+            content += ''.join('---\n' + profile_document(profile, port + 1) for profile in profiles)
+        corpus[f'{directory}/src/main/resources/application.yml'] = content
+        if rng.random() < other_files:
+            corpus[f'{directory}/README.md'] = f'# {name}\n'
+        if rng.random() < other_files:
+            corpus[f'{directory}/pom.xml'] = f'<project><artifactId>{name}</artifactId></project>\n'
+    return corpus
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the repository parse pipeline
+
+Generates a synthetic repository (see corpus.py), serves it from a local
+Bitbucket stand-in and times each stage on its own:
+
+- listing: walking the ``/src`` tree for YAML files
+- fetch: downloading every YAML file
+- parse: composing the YAML documents of every file
+- extract: running the service extractor over the parsed documents
+- persist: storing the files and services of an already parsed repository
+- catalog: rendering every page of the service catalog endpoint
+- render: JSON encoding of the whole catalog with file details, by the
+  configured renderer and by REST framework's stock JSONRenderer
+
+Each benchmark runs ``--repeat`` times after one warm-up run and the results
+are written to a JSON file; pass an earlier file with ``--compare`` to print
+the change in median time per benchmark.
+
+    python benchmarks/run.py --files 500 --latency 0.005 --output before.json
+    python benchmarks/run.py --files 500 --latency 0.005 --compare before.json
+
+The database is a throwaway test database, so the configured one is never touched.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yaml_parser_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework.settings import api_settings  # noqa: E402
+
+from benchmarks.corpus import generate_corpus  # noqa: E402
+from yaml_parser import json_backend, yaml_backend  # noqa: E402
+from yaml_parser.bitbucket_reader import BitbucketYAMLReader  # noqa: E402
+from yaml_parser.bitbucket_stub import StubBitbucketServer  # noqa: E402
+from yaml_parser.models import Repository, Service, YAMLFile  # noqa: E402
+from yaml_parser.parse_cache import content_digest, parse_cache  # noqa: E402
+from yaml_parser.repository_parser import RepositoryParser  # noqa: E402
+from yaml_parser.serializers import ServiceCatalogSerializer  # noqa: E402
+from yaml_parser.service_extractor import SpringBootServiceExtractor  # noqa: E402
+
+BENCHMARKS = ['listing', 'fetch', 'parse', 'extract', 'persist', 'catalog', 'render']
+
+
+def measure(function: Callable[[], Any], repeat: int, setup: Optional[Callable[[], None]] = None) -> List[float]:
+    """Run ``function`` once to warm up, then ``repeat`` times, returning the timed durations in seconds"""
+    timings = []
+    for run in range(repeat + 1):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        if run:
+            timings.append(elapsed)
+    return timings
+
+
+def summarize(timings: List[float], items: int, unit: str, **extra: Any) -> Dict[str, Any]:
+    median = statistics.median(timings)
+    return {
+        'items': items,
+        'unit': unit,
+        'runs': [round(timing, 6) for timing in timings],
+        'min_seconds': round(min(timings), 6),
+        'median_seconds': round(median, 6),
+        'mean_seconds': round(statistics.mean(timings), 6),
+        'items_per_second': round(items / median, 2) if median > 0 else None,
+        **extra,
+    }
+
+
+class PipelineBenchmarks:
+    """
+    The benchmarks of one corpus, sharing the outputs of earlier stages
+    """
+
+    def __init__(self, corpus: Dict[str, str], stub: StubBitbucketServer, repeat: int,
+                 concurrency: int, listing_concurrency: int):
+        self.corpus = corpus
+        self.repeat = repeat
+        self.concurrency = concurrency
+        self.listing_concurrency = listing_concurrency
+        self.reader = BitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+        self.repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        self.extractor = SpringBootServiceExtractor()
+        self.paths = [path for path in sorted(corpus) if BitbucketYAMLReader.is_yaml_path(path)]
+        self.fetched = [(path, corpus[path]) for path in self.paths]
+        self.documents = [list(yaml_backend.DocumentStream(content)) for _, content in self.fetched]
+
+    def listing(self) -> Dict[str, Any]:
+        found = []
+        timings = measure(lambda: found.append(self.reader.list_yaml_files(max_workers=self.listing_concurrency)),
+                          self.repeat)
+        if sorted(found[-1]) != self.paths:
+            raise RuntimeError(f'Listing found {len(found[-1])} YAML files, expected {len(self.paths)}')
+        return summarize(timings, len(self.paths), 'files')
+
+    def fetch(self) -> Dict[str, Any]:
+        timings = measure(lambda: self.reader.get_files_content(self.paths, max_workers=self.concurrency),
+                          self.repeat)
+        size = sum(len(content.encode()) for _, content in self.fetched)
+        return summarize(timings, len(self.paths), 'files', bytes=size)
+
+    def parse(self) -> Dict[str, Any]:
+        def parse_all():
+            for _, content in self.fetched:
+                list(yaml_backend.DocumentStream(content))
+
+        timings = measure(parse_all, self.repeat)
+        return summarize(timings, len(self.fetched), 'files', backend=yaml_backend.DEFAULT_BACKEND,
+                         documents=sum(len(documents) for documents in self.documents))
+
+    def extract(self) -> Dict[str, Any]:
+        def extract_all():
+            for documents in self.documents:
+                self.extractor.extract_from_documents(documents)
+
+        timings = measure(extract_all, self.repeat)
+        return summarize(timings, len(self.documents), 'files')
+
+    def persist(self) -> Dict[str, Any]:
+        results = [(documents, self.extractor.extract_from_documents(documents)) for documents in self.documents]
+
+        def reset():
+            # Start from an empty repository with every file already parsed, so only storage is timed
+            YAMLFile.objects.filter(repository=self.repository).delete()
+            for (_, content), result in zip(self.fetched, results):
+                parse_cache.set(content_digest(content), *result)
+
+        def store():
+            RepositoryParser(self.repository, self.reader, write_batch_size=settings.PARSE_WRITE_BATCH_SIZE
+                             ).process_files(self.fetched)
+
+        parse_cache.max_entries = max(parse_cache.max_entries, len(self.fetched))
+        timings = measure(store, self.repeat, setup=reset)
+        services = Service.objects.filter(yaml_file__repository=self.repository).count()
+        return summarize(timings, len(self.fetched), 'files', services=services)
+
+    def store(self):
+        """Store the corpus unless an earlier benchmark already did"""
+        if not YAMLFile.objects.filter(repository=self.repository).exists():
+            RepositoryParser(self.repository, self.reader).process_files(self.fetched)
+
+    def catalog(self) -> Dict[str, Any]:
+        self.store()
+        client = Client()
+        services = []
+
+        def render_all():
+            url = '/api/service-catalog/?page_size=1000'
+            services.clear()
+            while url:
+                page = client.get(url).json()
+                services.extend(page['services'])
+                url = page['next']
+
+        # Rendered pages are cached by ETag; clear them so every run serializes
+        timings = measure(render_all, self.repeat, setup=cache.clear)
+        return summarize(timings, len(services), 'services')
+
+    def render(self) -> Dict[str, Any]:
+        self.store()
+        services = Service.objects.order_by('service_name', 'id').select_related(
+            'yaml_file__repository').prefetch_related('yaml_file__documents')
+        fields = ServiceCatalogSerializer.default_fields + ['yaml_file_info']
+        data = ServiceCatalogSerializer(services, many=True, fields=fields).data
+        renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+
+        timings = measure(lambda: renderer.render(data), self.repeat)
+        baseline = measure(lambda: JSONRenderer().render(data), self.repeat)
+        return summarize(timings, len(data), 'services', renderer=type(renderer).__name__,
+                         bytes=len(renderer.render(data)),
+                         json_renderer_median_seconds=round(statistics.median(baseline), 6))
+
+
+def run(options: argparse.Namespace) -> Dict[str, Any]:
+    corpus = generate_corpus(files=options.files, depth=options.depth, padding=options.padding,
+                             multi_doc_ratio=options.multi_doc_ratio, seed=options.seed)
+    selected = options.only.split(',') if options.only else BENCHMARKS
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(sorted(unknown))} (choose from {', '.join(BENCHMARKS)})")
+
+    setup_test_environment()
+    database = connection.creation.create_test_db(verbosity=0)
+    results = {}
+    try:
+        with StubBitbucketServer(corpus, latency=options.latency, pagelen=options.pagelen) as stub:
+            benchmarks = PipelineBenchmarks(corpus, stub, options.repeat, options.concurrency,
+                                            options.listing_concurrency)
+            for name in BENCHMARKS:
+                if name in selected:
+                    results[name] = getattr(benchmarks, name)()
+                    print(f"{name:>8}: {results[name]['median_seconds']:.4f}s median, "
+                          f"{results[name]['items_per_second']} {results[name]['unit']}/s")
+                    if 'json_renderer_median_seconds' in results[name]:
+                        print(f"{'':>8}  {results[name]['json_renderer_median_seconds']:.4f}s median with JSONRenderer")
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+        teardown_test_environment()
+
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'django': django.get_version(),
+            'yaml_backend': yaml_backend.DEFAULT_BACKEND,
+            'json_backend': json_backend.DEFAULT_BACKEND,
+            'database': connection.vendor,
+        },
+        'parameters': {
+            'files': options.files, 'depth': options.depth, 'padding': options.padding,
+            'multi_doc_ratio': options.multi_doc_ratio, 'seed': options.seed, 'latency': options.latency,
+            'pagelen': options.pagelen, 'concurrency': options.concurrency,
+            'listing_concurrency': options.listing_concurrency, 'repeat': options.repeat,
+        },
+        'corpus': {
+            'files': len(corpus),
+            'yaml_files': sum(BitbucketYAMLReader.is_yaml_path(path) for path in corpus),
+            'bytes': sum(len(content.encode()) for content in corpus.values()),
+        },
+        'benchmarks': results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print the median time of each benchmark against the baseline report"""
+    if baseline.get('parameters') != report['parameters']:
+        print('Warning: the baseline was run with different parameters')
+    for name, result in report['benchmarks'].items():
+        before = baseline.get('benchmarks', {}).get(name)
+        if not before:
+            continue
+        change = result['median_seconds'] / before['median_seconds'] - 1 if before['median_seconds'] else 0
+        print(f"{name:>8}: {before['median_seconds']:.4f}s -> {result['median_seconds']:.4f}s ({change:+.1%})")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=200, help="YAML files in the synthetic repository")
+    parser.add_argument('--depth', type=int, default=2, help="Group directories above each service")
+    parser.add_argument('--padding', type=int, default=20, help="Extra settings per file (scales file size)")
+    parser.add_argument('--multi-doc-ratio', type=float, default=0.2, help="Share of multi-document files")
+    parser.add_argument('--seed', type=int, default=0, help="Corpus random seed")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the stub server waits per request")
+    parser.add_argument('--pagelen', type=int, default=100, help="Entries per listing page")
+    parser.add_argument('--concurrency', type=int, default=settings.BITBUCKET_FETCH_CONCURRENCY,
+                        help="File downloads in flight")
+    parser.add_argument('--listing-concurrency', type=int, default=settings.BITBUCKET_LISTING_CONCURRENCY,
+                        help="Listing requests in flight")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--only', help=f"Comma-separated benchmarks to run ({','.join(BENCHMARKS)})")
+    parser.add_argument('--output', help="JSON results file (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', help="Earlier JSON results file to compare against")
+    options = parser.parse_args(argv)
+
+    report = run(options)
+    output = options.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"Results written to {output}")
+
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as baseline_file:
+            compare(report, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
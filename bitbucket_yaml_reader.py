@@ -6,6 +6,7 @@ This script authenticates with Bitbucket using an access token and reads YAML fi
 from a specified repository, then parses them using PyYAML.
 """
 
+import logging
 import requests
 import yaml
 import json
@@ -13,6 +14,11 @@ import os
 from typing import Dict, Any, List
 from urllib.parse import urljoin
 
+from yaml_parser.http_client import get_client
+from yaml_parser.yaml_backend import parse_yaml
+
+logger = logging.getLogger(__name__)
+
 
 class BitbucketYAMLReader:
     def __init__(self, access_token: str, workspace: str, repository: str):
@@ -32,6 +38,7 @@ class BitbucketYAMLReader:
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json",
         }
+        self.client = get_client(access_token)
 
     def get_file_content(self, file_path: str) -> str:
         """
@@ -46,11 +53,11 @@ class BitbucketYAMLReader:
         url = f"{self.base_url}/repositories/{self.workspace}/{self.repository}/src/main/{file_path}"
 
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.client.get(url, headers=self.headers)
             response.raise_for_status()
             return response.text
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching file {file_path}: {e}")
+            logger.warning("Error fetching file %s: %s", file_path, e)
             return None
 
     def list_yaml_files(self) -> List[str]:
@@ -65,7 +72,7 @@ class BitbucketYAMLReader:
         )
 
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.client.get(url, headers=self.headers)
             response.raise_for_status()
             data = response.json()
 
@@ -78,7 +85,7 @@ class BitbucketYAMLReader:
 
             return yaml_files
         except requests.exceptions.RequestException as e:
-            print(f"Error listing files: {e}")
+            logger.warning("Error listing files: %s", e)
             return []
 
     def parse_yaml_content(self, content: str) -> Dict[str, Any]:
@@ -92,20 +99,11 @@ class BitbucketYAMLReader:
             Dict[str, Any]: Parsed YAML data
         """
         try:
-            # Try to parse as single document first
-            return yaml.safe_load(content)
+            # Single pass over single- and multi-document streams, with libyaml when available
+            return parse_yaml(content)[0]
         except yaml.YAMLError as e:
-            # If single document fails, try multi-document
-            try:
-                documents = list(yaml.safe_load_all(content))
-                if len(documents) == 1:
-                    return documents[0]
-                else:
-                    # Return a dictionary with numbered documents
-                    return {f"document_{i+1}": doc for i, doc in enumerate(documents)}
-            except yaml.YAMLError as e2:
-                print(f"Error parsing YAML (both single and multi-document): {e2}")
-                return None
+            logger.warning("Error parsing YAML: %s", e)
+            return None
 
     def read_and_parse_yaml(self, file_path: str) -> Dict[str, Any]:
         """
@@ -0,0 +1,294 @@
+"""
+Multi-repository parse batches
+
+A batch parses many repositories as one operation, e.g. every repository of
+a Bitbucket workspace. Each repository is parsed by a ParseJob of the batch,
+``repository_concurrency`` at a time, and all of their Bitbucket requests
+share one FairScheduler: a global budget of requests in flight and requests
+per second, handed out round-robin between the repositories waiting for it
+so a large repository cannot starve the others.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .bitbucket_reader import RateLimiter, list_workspace_repositories
+from .jobs import get_executor, run_in_thread
+from .models import ParseBatch, ParseJob, Repository
+from .repository_parser import save_repository
+
+
+class FairScheduler:
+    """
+    Round-robin allocation of a shared request budget between repositories
+    """
+
+    def __init__(self, concurrency: int, rate_limit: Optional[float] = None):
+        """
+        Args:
+            concurrency (int): Maximum number of requests in flight across all repositories
+            rate_limit (float): Maximum requests per second across all repositories (None disables)
+        """
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting: Dict[str, deque] = {}
+        # Repositories with waiting requests, in the order they get their next slot
+        self._turns: deque = deque()
+        self._granted = set()
+        self.max_in_flight = 0
+        self.requests = Counter()
+
+    def acquire(self, key: str):
+        """Block until the repository ``key`` may send a request"""
+        ticket = object()
+        with self._condition:
+            queue = self._waiting.get(key)
+            if queue is None:
+                queue = self._waiting[key] = deque()
+                self._turns.append(key)
+            queue.append(ticket)
+            self._grant()
+            while ticket not in self._granted:
+                self._condition.wait()
+            self._granted.discard(ticket)
+        if self.limiter:
+            self.limiter.acquire()
+
+    def release(self, key: str):
+        """Return the slot of a finished request"""
+        with self._condition:
+            self._in_flight -= 1
+            self._grant()
+
+    @contextmanager
+    def slot(self, key: str):
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def _grant(self):
+        """Hand free slots to waiting repositories, one request per repository per turn"""
+        granted = False
+        while self._in_flight < self.concurrency and self._turns:
+            key = self._turns.popleft()
+            queue = self._waiting[key]
+            self._granted.add(queue.popleft())
+            if queue:
+                self._turns.append(key)
+            else:
+                del self._waiting[key]
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            self.requests[key] += 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def client_for(self, client, key: str) -> 'ScheduledClient':
+        """Wrap a repository's HTTP client so its requests draw from this scheduler"""
+        return ScheduledClient(client, self, key)
+
+
+class ScheduledClient:
+    """
+    BitbucketHTTPClient stand-in whose requests wait for a FairScheduler slot
+
+    Every attempt, retries included, waits for its own slot (and rate limit),
+    and no slot is held while the client backs off between attempts.
+    """
+
+    def __init__(self, client, scheduler: FairScheduler, key: str):
+        self.client = client
+        self.scheduler = scheduler
+        self.key = key
+
+    def get(self, url: str, **kwargs):
+        return self.client.get(url, attempt_slot=lambda: self.scheduler.slot(self.key), **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        return self.client.stats()
+
+
+def batch_options(concurrency: Optional[int] = None, rate_limit: Optional[float] = None,
+                  repository_concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Resolve batch options against the configured limits, which callers may only lower.
+
+    Args:
+        concurrency (int): Requests in flight across the batch (at most PARSE_BATCH_CONCURRENCY)
+        rate_limit (float): Requests per second across the batch (at most BITBUCKET_RATE_LIMIT when set)
+        repository_concurrency (int): Repositories parsed at once (at most PARSE_BATCH_REPOSITORY_CONCURRENCY)
+
+    Returns:
+        Dict[str, Any]: Options stored on the ParseBatch
+    """
+    def lower(value, limit):
+        return max(1, min(int(value), limit)) if value else limit
+
+    configured_rate = settings.BITBUCKET_RATE_LIMIT or None
+    if rate_limit:
+        rate_limit = min(float(rate_limit), configured_rate) if configured_rate else float(rate_limit)
+    return {
+        'concurrency': lower(concurrency, settings.PARSE_BATCH_CONCURRENCY),
+        'rate_limit': rate_limit or configured_rate,
+        'repository_concurrency': lower(repository_concurrency, settings.PARSE_BATCH_REPOSITORY_CONCURRENCY),
+    }
+
+
+def batch_repositories(entries: Optional[Iterable[Dict[str, Any]]] = None, workspace: Optional[str] = None,
+                       access_token: Optional[str] = None) -> List[Repository]:
+    """
+    Create or update the repositories of a batch.
+
+    Args:
+        entries: Dictionaries with ``workspace``, ``repository`` and ``access_token``
+        workspace (str): Workspace whose repositories are all added, listed with ``access_token``
+        access_token (str): Token for ``workspace``, also the default token of entries without one
+
+    Returns:
+        List[Repository]: The repositories, without duplicates
+
+    Raises:
+        ValueError: If an entry is incomplete, nothing was requested or the workspace cannot be listed
+    """
+    targets: List[Tuple[str, str, str]] = []
+    for entry in entries or []:
+        if not isinstance(entry, dict):
+            raise ValueError(f'Repository entries must be objects: {entry!r}')
+        target = (entry.get('workspace') or workspace, entry.get('repository'),
+                  entry.get('access_token') or access_token)
+        if not all(target):
+            raise ValueError(f'Repository entries need workspace, repository and access_token: {entry!r}')
+        targets.append(target)
+
+    if workspace and not entries:
+        if not access_token:
+            raise ValueError('Missing required field: access_token')
+        slugs = list_workspace_repositories(access_token, workspace, base_url=settings.BITBUCKET_API_URL)
+        if slugs is None:
+            raise ValueError(f'Could not list the repositories of workspace {workspace}')
+        targets.extend((workspace, slug, access_token) for slug in slugs)
+
+    if not targets:
+        raise ValueError('Provide a list of repositories or a workspace and access_token')
+
+    # The last entry for a repository decides its access token
+    tokens = {(target[0], target[1]): target[2] for target in targets}
+    return [save_repository(*key, token) for key, token in tokens.items()]
+
+
+def create_parse_batch(repositories: List[Repository], job_options: Dict[str, Any],
+                       options: Dict[str, Any], enqueue: bool = True) -> ParseBatch:
+    """
+    Create a queued batch with one parse job per repository.
+
+    Args:
+        repositories (List[Repository]): Repositories to parse
+        job_options (Dict[str, Any]): Parse options of every job (max_depth, include, exclude, full)
+        options (Dict[str, Any]): Batch options (see batch_options)
+        enqueue (bool): Hand the batch to the 'thread' runner when PARSE_JOB_RUNNER is 'thread'
+
+    Returns:
+        ParseBatch: The queued batch
+    """
+    with transaction.atomic():
+        batch = ParseBatch.objects.create(options=options)
+        ParseJob.objects.bulk_create([
+            ParseJob(repository=repository, batch=batch, options=job_options) for repository in repositories
+        ])
+    if enqueue and settings.PARSE_JOB_RUNNER == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(run_batch_in_thread, batch.pk))
+    return batch
+
+
+def claim_batch(batch_id: int) -> bool:
+    """Atomically move a queued batch to running; False if another runner got it first"""
+    return ParseBatch.objects.filter(pk=batch_id, status=ParseBatch.STATUS_QUEUED).update(
+        status=ParseBatch.STATUS_RUNNING,
+        started_at=timezone.now()
+    ) == 1
+
+
+def claim_next_batch() -> Optional[int]:
+    """Claim the oldest queued batch, returning its id, or None if there is none"""
+    queued = ParseBatch.objects.filter(status=ParseBatch.STATUS_QUEUED).order_by('created_at', 'pk')
+    for batch_id in queued.values_list('pk', flat=True)[:10]:
+        if claim_batch(batch_id):
+            return batch_id
+    return None
+
+
+def run_batch_in_thread(batch_id: int, claimed: bool = False):
+    """Run a batch on a pool thread, releasing the thread's database connection afterwards"""
+    close_old_connections()
+    try:
+        run_parse_batch(batch_id, claimed=claimed)
+    finally:
+        close_old_connections()
+
+
+def run_parse_batch(batch_id: int, claimed: bool = False) -> ParseBatch:
+    """
+    Parse every repository of a batch under the batch's shared request budget.
+
+    Args:
+        batch_id (int): Batch to run
+        claimed (bool): True if the caller already moved the batch to running
+
+    Returns:
+        ParseBatch: The batch in its final state (unchanged if it was not queued)
+    """
+    if not claimed and not claim_batch(batch_id):
+        return ParseBatch.objects.get(pk=batch_id)
+
+    batch = ParseBatch.objects.get(pk=batch_id)
+    options = batch.options or {}
+    scheduler = FairScheduler(options.get('concurrency') or settings.PARSE_BATCH_CONCURRENCY,
+                              options.get('rate_limit'))
+    job_ids = list(batch.jobs.filter(status=ParseJob.STATUS_QUEUED).order_by('pk').values_list('pk', flat=True))
+    started = time.monotonic()
+    try:
+        workers = options.get('repository_concurrency') or settings.PARSE_BATCH_REPOSITORY_CONCURRENCY
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='parse-batch') as executor:
+            for future in [executor.submit(run_in_thread, job_id, scheduler=scheduler) for job_id in job_ids]:
+                future.result()
+        batch.result = batch_result(batch, scheduler, time.monotonic() - started)
+        batch.status = ParseBatch.STATUS_SUCCEEDED
+    except Exception as e:
+        batch.status = ParseBatch.STATUS_FAILED
+        batch.error = f'Error parsing batch: {str(e)}'
+    batch.finished_at = timezone.now()
+    batch.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return batch
+
+
+def batch_result(batch: ParseBatch, scheduler: FairScheduler, elapsed: float) -> Dict[str, Any]:
+    """Aggregate the outcome and throughput of a finished batch"""
+    jobs = list(batch.jobs.only('status', 'processed_files', 'result'))
+    processed_files = sum(job.processed_files for job in jobs)
+    requests = sum(scheduler.requests.values())
+    return {
+        'repositories': len(jobs),
+        'succeeded': sum(job.status == ParseJob.STATUS_SUCCEEDED for job in jobs),
+        'failed': sum(job.status == ParseJob.STATUS_FAILED for job in jobs),
+        'processed_files': processed_files,
+        'services_extracted': sum(len((job.result or {}).get('services', [])) for job in jobs),
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(processed_files / elapsed, 2) if elapsed > 0 else None,
+        'requests': requests,
+        'requests_per_second': round(requests / elapsed, 2) if elapsed > 0 else None,
+        'max_in_flight': scheduler.max_in_flight,
+        'requests_per_repository': dict(scheduler.requests),
+    }
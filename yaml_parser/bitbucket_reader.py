@@ -6,15 +6,127 @@ This module provides functionality to authenticate with Bitbucket using an acces
 and read YAML files from a specified repository, then parse them using PyYAML.
 """
 
+import asyncio
+import logging
 import requests
 import yaml
 import json
 import os
-from typing import Dict, Any, List
-from urllib.parse import urljoin
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from .http_client import get_client
+from .metrics import FETCHED_BYTES, STAGE_SECONDS
+from .yaml_backend import DocumentStream, parse_yaml
+
+DEFAULT_BASE_URL = "https://api.bitbucket.org/2.0"
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting how many requests are started per second.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        Args:
+            rate (float): Sustained number of requests allowed per second
+            burst (int): Number of requests that may start back to back (defaults to rate)
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be started."""
+        wait = self._take()
+        while wait:
+            time.sleep(wait)
+            wait = self._take()
+
+    async def aacquire(self):
+        """Wait without blocking the event loop until a request may be started."""
+        wait = self._take()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self._take()
+
+    def _take(self) -> float:
+        """Take a token if one is available, else return the seconds until the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+_host_limiters: Dict[Tuple[str, float], RateLimiter] = {}
+_host_limiters_lock = threading.Lock()
+
+
+def get_host_rate_limiter(url: str, rate: float) -> RateLimiter:
+    """
+    Return the rate limiter shared by every reader talking to the host of ``url``.
+
+    Args:
+        url (str): Any URL on the host to limit
+        rate (float): Requests per second allowed against that host
+
+    Returns:
+        RateLimiter: Limiter shared process-wide for this host and rate
+    """
+    key = (urlparse(url).netloc, float(rate))
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(key)
+        if limiter is None:
+            limiter = _host_limiters[key] = RateLimiter(rate)
+        return limiter
+
+
+def list_workspace_repositories(access_token: str, workspace: str,
+                                base_url: Optional[str] = None) -> Optional[List[str]]:
+    """
+    List the slugs of every repository in a Bitbucket workspace, following pagination.
+
+    Args:
+        access_token (str): Bitbucket access token with read access to the workspace
+        workspace (str): Bitbucket workspace name
+        base_url (str): Bitbucket API root (defaults to api.bitbucket.org)
+
+    Returns:
+        Optional[List[str]]: Repository slugs, or None if the workspace could not be listed
+    """
+    client = get_client(access_token)
+    slugs = []
+    url = f"{(base_url or DEFAULT_BASE_URL).rstrip('/')}/repositories/{workspace}?pagelen=100"
+    while url:
+        try:
+            response = client.get(url)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error listing repositories of %s: %s", workspace, e)
+            return None
+        slugs.extend(item['slug'] for item in data.get('values', []) if item.get('slug'))
+        url = data.get('next')
+    return slugs
+
 
 class BitbucketYAMLReader:
-    def __init__(self, access_token: str, workspace: str, repository: str):
+    def __init__(self, access_token: str, workspace: str, repository: str, base_url: Optional[str] = None,
+                 branch: str = 'main'):
         """
         Initialize the Bitbucket YAML reader.
         
@@ -22,15 +134,23 @@ class BitbucketYAMLReader:
             access_token (str): Bitbucket access token
             workspace (str): Bitbucket workspace name
             repository (str): Repository name
+            base_url (str): Bitbucket API root, e.g. a local stub server (defaults to api.bitbucket.org)
+            branch (str): Branch to read files from
         """
         self.access_token = access_token
         self.workspace = workspace
         self.repository = repository
-        self.base_url = "https://api.bitbucket.org/2.0"
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.branch = branch
+        # Revision files are read at; pinned to a commit hash for consistent snapshots
+        self.ref = branch
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
+        self.client = get_client(access_token)
+        # Listing pages that could not be fetched during the last tree walk, whose files went unlisted
+        self.listing_errors = 0
     
     def get_file_content(self, file_path: str) -> str:
         """
@@ -42,57 +162,229 @@ class BitbucketYAMLReader:
         Returns:
             str: File content
         """
-        url = f"{self.base_url}/repositories/{self.workspace}/{self.repository}/src/main/{file_path}"
+        url = f"{self._repository_url()}/src/{self.ref}/{file_path}"
         
         try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
+            with STAGE_SECONDS.time(stage='fetch'):
+                response = self.client.get(url, headers=self.headers)
+                response.raise_for_status()
+            FETCHED_BYTES.inc(len(response.content))
             return response.text
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching file {file_path}: {e}")
+            logger.warning("Error fetching file %s: %s", file_path, e)
             return None
-    
-    def list_yaml_files(self) -> List[str]:
+
+    def get_files_content(self, file_paths: Iterable[str], max_workers: int = 8,
+                          rate_limit: Optional[float] = None) -> List[Tuple[str, Optional[str]]]:
+        """
+        Fetch several files concurrently using a bounded worker pool.
+        
+        Args:
+            file_paths (Iterable[str]): Paths of the files in the repository
+            max_workers (int): Maximum number of requests in flight at once
+            rate_limit (float): Maximum requests per second against the API host (None disables)
+            
+        Returns:
+            List[Tuple[str, Optional[str]]]: (file_path, content) pairs in the order the paths were given;
+            content is None when the file could not be fetched
+        """
+        return list(self.iter_files_content(file_paths, max_workers, rate_limit))
+
+    def iter_files_content(self, file_paths: Iterable[str], max_workers: int = 8,
+                           rate_limit: Optional[float] = None) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        Fetch several files concurrently and yield each one as soon as it and all earlier paths are done.
+        
+        Args:
+            file_paths (Iterable[str]): Paths of the files in the repository; may be a lazy iterator
+            max_workers (int): Maximum number of requests in flight at once
+            rate_limit (float): Maximum requests per second against the API host (None disables)
+            
+        Yields:
+            Tuple[str, Optional[str]]: (file_path, content) pairs in the order the paths were given
+        """
+        limiter = get_host_rate_limiter(self.base_url, rate_limit) if rate_limit else None
+
+        def fetch(file_path: str) -> Tuple[str, Optional[str]]:
+            if limiter:
+                limiter.acquire()
+            return file_path, self.get_file_content(file_path)
+
+        max_workers = max(1, max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Keep a bounded window of requests ahead of the consumer, so paths are
+            # pulled from a lazy listing only as fast as they can be fetched
+            pending = deque()
+            for file_path in file_paths:
+                pending.append(executor.submit(fetch, file_path))
+                if len(pending) >= max_workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def list_yaml_files(self, max_depth: Optional[int] = None, include: Optional[List[str]] = None,
+                        exclude: Optional[List[str]] = None, max_workers: int = 4) -> List[str]:
         """
         List all YAML files in the repository.
         
+        Args:
+            max_depth (int): Deepest directory level to descend into (None for unlimited)
+            include (List[str]): Glob patterns a file path must match to be listed
+            exclude (List[str]): Glob patterns for files and directories to skip
+            max_workers (int): Maximum number of listing requests in flight at once
+            
         Returns:
             List[str]: List of YAML file paths
         """
-        url = f"{self.base_url}/repositories/{self.workspace}/{self.repository}/src/main/"
+        yaml_files = list(self.iter_yaml_files(max_depth, include, exclude, max_workers))
+        logger.debug("YAML files found: %s", yaml_files)
+        return yaml_files
+
+    def iter_yaml_files(self, max_depth: Optional[int] = None, include: Optional[List[str]] = None,
+                        exclude: Optional[List[str]] = None, max_workers: int = 4) -> Iterator[str]:
+        """
+        Walk the repository tree and yield YAML file paths as soon as they are found.
         
-        try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            print(f"Debug: Found {len(data.get('values', []))} files in repository")
+        Every listing page is fetched on a worker pool: ``next`` links and
+        ``commit_directory`` entries are queued as soon as a page arrives, so
+        sibling directories and later pages are explored concurrently.
+        
+        Args:
+            max_depth (int): Deepest directory level to descend into, 0 being the root (None for unlimited)
+            include (List[str]): Glob patterns a file path must match to be listed
+            exclude (List[str]): Glob patterns for files and directories to skip
+            max_workers (int): Maximum number of listing requests in flight at once
             
-            yaml_files = []
-            all_files = []
+        Yields:
+            str: YAML file paths, in discovery order
+        """
+        exclude = exclude or []
+        self.listing_errors = 0
+
+        def fetch_page(url: str) -> Optional[Dict[str, Any]]:
+            with STAGE_SECONDS.time(stage='listing'):
+                return self._get_json(url)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            pending = {executor.submit(fetch_page, self._src_url()): 0}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    depth = pending.pop(future)
+                    data = future.result()
+                    if data is None:
+                        self.listing_errors += 1
+                        continue
+                    if data.get('next'):
+                        pending[executor.submit(fetch_page, data['next'])] = depth
+
+                    for item in data.get('values', []):
+                        path = item.get('path', '')
+                        if any(fnmatch(path, pattern) for pattern in exclude):
+                            continue
+                        if item.get('type') == 'commit_directory':
+                            if max_depth is None or depth < max_depth:
+                                pending[executor.submit(fetch_page, self._src_url(path))] = depth + 1
+                        elif item.get('type') == 'commit_file' and self.is_yaml_path(path):
+                            if include and not any(fnmatch(path, pattern) for pattern in include):
+                                continue
+                            logger.debug("Found YAML file: %s", path)
+                            yield path
+
+    @staticmethod
+    def is_yaml_path(file_path: str) -> bool:
+        """
+        Check whether a repository path looks like a YAML configuration file.
+        
+        Args:
+            file_path (str): Path to the file in the repository
             
-            for item in data.get('values', []):
-                if item['type'] == 'commit_file':
-                    file_path = item['path']
-                    all_files.append(file_path)
-                    
-                    # Check for YAML files with various extensions
-                    if (file_path.endswith(('.yml', '.yaml')) or 
-                        file_path.endswith(('.yml', '.yaml')) or
-                        'application.yml' in file_path.lower() or
-                        'application.yaml' in file_path.lower() or
-                        'config.yml' in file_path.lower() or
-                        'config.yaml' in file_path.lower()):
-                        yaml_files.append(file_path)
-                        print(f"Debug: Found YAML file: {file_path}")
+        Returns:
+            bool: True for YAML files
+        """
+        lowered = file_path.lower()
+        return (file_path.endswith(('.yml', '.yaml')) or
+                'application.yml' in lowered or
+                'application.yaml' in lowered or
+                'config.yml' in lowered or
+                'config.yaml' in lowered)
+
+    @staticmethod
+    def path_selected(file_path: str, max_depth: Optional[int] = None, include: Optional[List[str]] = None,
+                      exclude: Optional[List[str]] = None) -> bool:
+        """
+        Apply the tree walk filters to a single path, e.g. one reported by a diff.
+        
+        Args:
+            file_path (str): Path to the file in the repository
+            max_depth (int): Deepest directory level allowed, 0 being the root (None for unlimited)
+            include (List[str]): Glob patterns the path must match
+            exclude (List[str]): Glob patterns for the path or any of its directories
             
-            print(f"Debug: All files found: {all_files}")
-            print(f"Debug: YAML files found: {yaml_files}")
+        Returns:
+            bool: True if the tree walk would have yielded this path
+        """
+        if not BitbucketYAMLReader.is_yaml_path(file_path):
+            return False
+        parts = file_path.split('/')
+        if max_depth is not None and len(parts) - 1 > max_depth:
+            return False
+        prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+        if exclude and any(fnmatch(prefix, pattern) for prefix in prefixes for pattern in exclude):
+            return False
+        return not include or any(fnmatch(file_path, pattern) for pattern in include)
+
+    def get_head_commit(self) -> Optional[str]:
+        """
+        Get the hash of the latest commit on the reader's branch.
+        
+        Returns:
+            Optional[str]: Commit hash, or None if it could not be resolved
+        """
+        data = self._get_json(f"{self._repository_url()}/refs/branches/{self.branch}")
+        if data:
+            return data.get('target', {}).get('hash')
+        return None
+
+    def get_diffstat(self, since: str, until: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        List the files changed between two commits, following pagination.
+        
+        Args:
+            since (str): Hash of the older commit
+            until (str): Hash of the newer commit
             
-            return yaml_files
+        Returns:
+            Optional[List[Dict[str, Any]]]: Diffstat entries with ``status``, ``old`` and ``new``,
+            or None if the diff could not be retrieved (e.g. history was rewritten)
+        """
+        entries = []
+        url = f"{self._repository_url()}/diffstat/{until}..{since}"
+        while url:
+            data = self._get_json(url)
+            if data is None:
+                return None
+            entries.extend(data.get('values', []))
+            url = data.get('next')
+        return entries
+
+    def _get_json(self, url: str) -> Optional[Dict[str, Any]]:
+        """Fetch a JSON API resource, returning None on request errors."""
+        try:
+            response = self.client.get(url, headers=self.headers)
+            response.raise_for_status()
+            return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error listing files: {e}")
-            return []
+            logger.warning("Error requesting %s: %s", url, e)
+            return None
+
+    def _repository_url(self) -> str:
+        return f"{self.base_url}/repositories/{self.workspace}/{self.repository}"
+
+    def _src_url(self, path: str = '') -> str:
+        """Build the ``/src`` URL of a repository directory at the reader's revision."""
+        url = f"{self._repository_url()}/src/{self.ref}/"
+        return f"{url}{path.strip('/')}/" if path else url
     
     def parse_yaml_content(self, content: str) -> Dict[str, Any]:
         """
@@ -104,22 +396,39 @@ class BitbucketYAMLReader:
         Returns:
             Dict[str, Any]: Parsed YAML data
         """
+        return self.parse_yaml(content)[0]
+
+    def parse_yaml(self, content: str) -> Tuple[Any, Optional[str]]:
+        """
+        Parse YAML content in a single pass, with libyaml when available.
+        
+        Args:
+            content (str): YAML content as string
+            
+        Returns:
+            Tuple[Any, Optional[str]]: Parsed YAML data (multi-document streams as
+            ``document_N`` keys) and the backend that parsed it, or (None, None) if
+            the content is not valid YAML
+        """
         try:
-            # Try to parse as single document first
-            return yaml.safe_load(content)
+            return parse_yaml(content)
         except yaml.YAMLError as e:
-            # If single document fails, try multi-document
-            try:
-                documents = list(yaml.safe_load_all(content))
-                if len(documents) == 1:
-                    return documents[0]
-                else:
-                    # Return a dictionary with numbered documents
-                    return {f"document_{i+1}": doc for i, doc in enumerate(documents)}
-            except yaml.YAMLError as e2:
-                print(f"Error parsing YAML (both single and multi-document): {e2}")
-                return None
+            logger.warning("Error parsing YAML: %s", e)
+            return None, None
     
+    def yaml_documents(self, content: str) -> DocumentStream:
+        """
+        Stream the documents of YAML content one at a time.
+        
+        Args:
+            content (str): YAML content as string
+            
+        Returns:
+            DocumentStream: Iterable of parsed documents; raises yaml.YAMLError while
+            iterating if the content is not valid YAML
+        """
+        return DocumentStream(content)
+
     def read_and_parse_yaml(self, file_path: str) -> Dict[str, Any]:
         """
         Read and parse a YAML file from the repository.
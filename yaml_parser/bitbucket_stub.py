@@ -0,0 +1,136 @@
+"""
+Local Bitbucket API stand-in for tests and benchmarks
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubBitbucketServer:
+    """
+    Local stand-in for the Bitbucket API endpoints used by the readers
+
+    Serves the ``/src`` listings and raw file contents of the repositories in
+    ``repositories`` (workspace ``ws``, branch ``main``), the workspace
+    repository listing, the head commit of ``main`` and a fixed diffstat.
+    Every request sleeps ``latency`` seconds first and listings are paged
+    ``pagelen`` entries at a time, as on Bitbucket.
+
+    Use it as a context manager; ``base_url`` is the API root to give readers.
+    """
+
+    def __init__(self, files, latency=0.0, pagelen=10):
+        self.files = files
+        # Repositories of the 'ws' workspace by slug; 'repo' serves ``files``
+        self.repositories = {'repo': files}
+        self.latency = latency
+        self.pagelen = pagelen
+        # Statuses returned for a path before it is served normally
+        self.failures = {}
+        # Head of the main branch (None answers 404) and the diffstat served for any range
+        self.commit = None
+        self.diffstat = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this, keep-alive
+            # responses stall on delayed ACKs and every request takes ~40ms
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.latency)
+                    stub.handle(self)
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def listing(self, files, slug, directory, page):
+        prefix = f"{directory}/" if directory else ''
+        entries = {}
+        for path in files:
+            if path.startswith(prefix):
+                head, sep, _ = path[len(prefix):].partition('/')
+                if sep:
+                    entries[prefix + head] = 'commit_directory'
+                else:
+                    entries[path] = 'commit_file'
+        if not entries and directory:
+            return None
+        items = sorted(entries.items())
+        start = (page - 1) * self.pagelen
+        data = {'values': [{'type': kind, 'path': path} for path, kind in items[start:start + self.pagelen]]}
+        if start + self.pagelen < len(items):
+            data['next'] = f"{self.base_url}/repositories/ws/{slug}/src/main/{prefix}?page={page + 1}"
+        return data
+
+    def workspace_listing(self, page):
+        slugs = sorted(self.repositories)
+        start = (page - 1) * self.pagelen
+        data = {'values': [{'slug': slug, 'full_name': f'ws/{slug}'} for slug in slugs[start:start + self.pagelen]]}
+        if start + self.pagelen < len(slugs):
+            data['next'] = f"{self.base_url}/repositories/ws?page={page + 1}"
+        return data
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        _, workspace, slug, route = (url.path.split('/', 4) + [''] * 5)[1:5]
+        files = self.repositories.get(slug) if workspace == 'ws' else None
+        if files is None:
+            files, route = {}, ''
+        page = int(parse_qs(url.query).get('page', ['1'])[0])
+        path = route.split('/', 2)[2] if route.startswith('src/') and route.count('/') >= 2 else None
+        if self.failures.get(path):
+            request.send_response(self.failures[path].pop(0))
+            request.send_header('Retry-After', '0')
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        body, content_type = None, 'application/json'
+        if url.path.rstrip('/') == '/repositories/ws':
+            body = json.dumps(self.workspace_listing(page))
+        elif route == 'refs/branches/main' and self.commit:
+            body = json.dumps({'name': 'main', 'target': {'hash': self.commit}})
+        elif route.startswith('diffstat/'):
+            body = json.dumps({'values': self.diffstat})
+        elif path in files:
+            body, content_type = files[path], 'text/plain'
+        elif path is not None and (path == '' or path.endswith('/')):
+            data = self.listing(files, slug, path.rstrip('/'), page)
+            if data is not None:
+                body = json.dumps(data)
+        if body is None:
+            request.send_response(404)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        payload = body.encode()
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
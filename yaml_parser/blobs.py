@@ -0,0 +1,72 @@
+"""
+Compression of stored file content
+
+Raw YAML content is kept once per distinct content in ContentBlob rows,
+keyed by its SHA-256 digest and compressed with zstd when the
+``zstandard`` package is installed and zlib otherwise. Every blob records
+its codec, so blobs written with either one stay readable.
+"""
+
+import hashlib
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zlib from the standard library is used instead
+    zstandard = None
+
+ZSTD = 'zstd'
+ZLIB = 'zlib'
+
+# Codec used for new blobs
+DEFAULT_CODEC = ZSTD if zstandard is not None else ZLIB
+
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+# zstandard compressors are not thread-safe; keep one per thread
+_local = threading.local()
+
+
+def content_digest(content: str) -> str:
+    """Return the hex SHA-256 digest of a file's content"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def compress(content: str, codec: str = DEFAULT_CODEC) -> bytes:
+    """
+    Compress file content.
+
+    Args:
+        content (str): Raw file content
+        codec (str): ZSTD or ZLIB
+
+    Returns:
+        bytes: The compressed UTF-8 encoded content
+    """
+    data = content.encode('utf-8')
+    if codec == ZSTD:
+        compressor = getattr(_local, 'compressor', None)
+        if compressor is None:
+            compressor = _local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return compressor.compress(data)
+    if codec == ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise ValueError(f"Unknown content codec {codec!r}")
+
+
+def decompress(data: bytes, codec: str) -> str:
+    """
+    Restore content compressed with ``compress``.
+
+    Raises:
+        ValueError: If the codec is unknown, or is zstd and ``zstandard`` is not installed
+    """
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("Content was compressed with zstd; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(bytes(data)).decode('utf-8')
+    if codec == ZLIB:
+        return zlib.decompress(bytes(data)).decode('utf-8')
+    raise ValueError(f"Unknown content codec {codec!r}")
@@ -0,0 +1,94 @@
+"""
+Versioned response caching for read endpoints
+
+Every repository has a generation counter that is incremented whenever its
+files or services change (parses, extractions) and list endpoints derive
+their version from the (id, generation) pairs of all repositories, so
+creating or deleting a repository changes it too. The version, together
+with the request path and query string, forms the response ETag:
+
+- a request whose ``If-None-Match`` matches gets ``304 Not Modified``
+  without touching the serialized data;
+- otherwise the rendered body is looked up in the Django cache under the
+  ETag and only rebuilt on a miss.
+
+Stale cache entries are never read again once the version moves on and
+simply expire after ``RESPONSE_CACHE_TIMEOUT`` seconds.
+"""
+
+import hashlib
+from typing import Any, Callable, Union
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+from .metrics import RESPONSE_CACHE, STAGE_SECONDS
+from .models import Repository
+from .renderers import render_json
+
+
+def bump_generation(repository: Union[Repository, int]):
+    """Mark a repository's files and services as changed"""
+    repository_id = repository.pk if isinstance(repository, Repository) else repository
+    Repository.objects.filter(pk=repository_id).update(generation=F('generation') + 1)
+
+
+def catalog_version() -> str:
+    """Version of data spanning every repository"""
+    pairs = Repository.objects.order_by('pk').values_list('pk', 'generation')
+    return hashlib.sha1(repr(list(pairs)).encode()).hexdigest()
+
+
+def repository_version(repository: Repository) -> str:
+    """Version of one repository's data, from the instance as loaded for the request"""
+    return f'{repository.pk}.{repository.generation}'
+
+
+def make_etag(request, version: str) -> str:
+    digest = hashlib.sha1(f'{version}|{request.get_full_path()}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags or etag.strip('"') in etags
+
+
+def cached_response(request, version: str, build: Callable[[], Any]) -> HttpResponse:
+    """
+    Serve a read endpoint from its ETag, the response cache, or by building it.
+
+    Args:
+        request: The incoming request
+        version (str): Version of the data behind the response (catalog_version or repository_version)
+        build (Callable): Returns the response data when it is not cached
+
+    Returns:
+        HttpResponse: 304 if the client's copy is current, else the JSON body with its ETag
+    """
+    etag = make_etag(request, version)
+    if etag_matches(request, etag):
+        RESPONSE_CACHE.inc(result='not_modified')
+        response = HttpResponseNotModified()
+    else:
+        key = f'response:{etag}'
+        body = cache.get(key)
+        if body is None:
+            RESPONSE_CACHE.inc(result='miss')
+            with STAGE_SECONDS.time(stage='serialize'):
+                body = render_json(build())
+            cache.set(key, body, settings.RESPONSE_CACHE_TIMEOUT)
+        else:
+            RESPONSE_CACHE.inc(result='hit')
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Clients may keep the body but must revalidate it on every use
+    patch_cache_control(response, no_cache=True)
+    return response
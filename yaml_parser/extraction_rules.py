@@ -0,0 +1,197 @@
+"""
+Declarative service extraction rules
+
+Each rule maps a dotted path in a YAML document to a service field, e.g.
+``spring.application.name`` to ``service_name``. A ``*`` segment matches any
+key at that level and makes the matched key available to the rule's item
+template as ``{key}`` (the matched value is ``{value}``).
+
+All rules are compiled once into a path trie, so filling every field takes a
+single traversal of each document that only descends into keys some rule
+can still match.
+
+Rule specs are plain dictionaries so extra rules can come from settings or a
+YAML file::
+
+    - field: dependent_infrastructure
+      path: spring.data.mongodb
+      item: {type: mongodb, details: '{value}'}
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import yaml
+
+# Fields holding the first value found; every other field collects a list
+SCALAR_FIELDS = ('service_name', 'version', 'port', 'protocol')
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {'field': 'service_name', 'path': 'spring.application.name'},
+    {'field': 'version', 'path': 'spring.application.version'},
+    {'field': 'port', 'path': 'spring.server.port', 'transform': 'port_number'},
+    {'field': 'protocol', 'path': 'spring.server.ssl', 'value': 'https'},
+    {'field': 'profiles', 'path': 'spring.profiles.active'},
+    {'field': 'dependent_services', 'path': 'spring.app.external-services.*',
+     'item': {'name': '{key}', 'details': '{value}'}},
+    {'field': 'dependent_services', 'path': 'spring.app.kafka-topics.*',
+     'item': {'name': '{key}', 'type': 'kafka-topic', 'details': '{value}'}},
+    {'field': 'dependent_services', 'path': 'spring.app.queues.*',
+     'item': {'name': '{key}', 'type': 'queue', 'details': '{value}'}},
+    {'field': 'dependent_infrastructure', 'path': 'spring.datasource.*', 'require': 'mapping',
+     'item': {'type': '{key}', 'details': '{value}'}},
+    {'field': 'dependent_infrastructure', 'path': 'spring.redis', 'item': {'type': 'redis', 'details': '{value}'}},
+    {'field': 'dependent_infrastructure', 'path': 'spring.rabbitmq', 'item': {'type': 'rabbitmq', 'details': '{value}'}},
+    {'field': 'dependent_infrastructure', 'path': 'spring.kafka', 'item': {'type': 'kafka', 'details': '{value}'}},
+    {'field': 'dependent_infrastructure', 'path': 'spring.activemq', 'item': {'type': 'activemq', 'details': '{value}'}},
+]
+
+
+def port_number(value: Any) -> Any:
+    """Extract a port number from values like 8080 or "${SERVER_PORT:8080}", keeping the raw value otherwise"""
+    if isinstance(value, (int, str)):
+        port_str = str(value)
+        env_match = re.search(r'\$\{.*?:(\d+)\}', port_str)
+        if env_match:
+            return env_match.group(1)
+        number_match = re.search(r'\d+', port_str)
+        if number_match:
+            return number_match.group()
+    return value
+
+
+TRANSFORMS = {
+    'port_number': port_number,
+}
+
+
+class ExtractionRule:
+    """A single compiled rule"""
+
+    def __init__(self, spec: Dict[str, Any], order: int):
+        """
+        Args:
+            spec (Dict[str, Any]): Rule specification with ``field`` and ``path``, and optionally
+                ``item`` (template for list entries), ``value`` (constant recorded on a match),
+                ``require`` ('mapping' to only match dictionaries) and ``transform`` (a TRANSFORMS name)
+            order (int): Position of the rule; results of a field are ordered by rule, then document order
+        """
+        if not spec.get('field') or not spec.get('path'):
+            raise ValueError(f"Extraction rule needs a 'field' and a 'path': {spec!r}")
+        if spec.get('transform') and spec['transform'] not in TRANSFORMS:
+            raise ValueError(f"Unknown extraction rule transform {spec['transform']!r}")
+        self.field = spec['field']
+        self.path = spec['path'].split('.')
+        self.item = spec.get('item')
+        self.constant = spec.get('value')
+        self.require = spec.get('require')
+        self.transform = TRANSFORMS.get(spec.get('transform'))
+        self.order = order
+
+    def emit(self, key: Any, value: Any) -> Any:
+        """Build the result of a match, or None if the matched value is not acceptable"""
+        if self.require == 'mapping' and not isinstance(value, dict):
+            return None
+        if self.constant is not None:
+            return self.constant
+        if self.transform:
+            value = self.transform(value)
+        if self.item is None:
+            return value
+        return {name: self.render(template, key, value) for name, template in self.item.items()}
+
+    @staticmethod
+    def render(template: Any, key: Any, value: Any) -> Any:
+        if template == '{key}':
+            return key
+        if template == '{value}':
+            return value
+        return template
+
+
+class _TrieNode:
+    __slots__ = ('children', 'wildcard', 'rules')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.wildcard: Optional['_TrieNode'] = None
+        self.rules: List[ExtractionRule] = []
+
+
+class RuleEngine:
+    """
+    Extraction rules compiled into a path trie
+    """
+
+    def __init__(self, specs: Iterable[Dict[str, Any]]):
+        self.rules = [ExtractionRule(spec, order) for order, spec in enumerate(specs)]
+        self.root = _TrieNode()
+        for rule in self.rules:
+            node = self.root
+            for segment in rule.path:
+                if segment == '*':
+                    node.wildcard = node.wildcard or _TrieNode()
+                    node = node.wildcard
+                else:
+                    node = node.children.setdefault(segment, _TrieNode())
+            node.rules.append(rule)
+
+    def match(self, document: Any) -> Dict[str, List[Any]]:
+        """
+        Run every rule over one document in a single traversal.
+
+        Args:
+            document: Parsed YAML document; non-mapping documents match nothing
+
+        Returns:
+            Dict[str, List[Any]]: Matches per field, ordered by rule and then by position in the document
+        """
+        matches: Dict[int, List[Any]] = {}
+        if isinstance(document, dict):
+            self._walk(document, self.root, matches)
+
+        fields: Dict[str, List[Any]] = {}
+        for rule in self.rules:
+            if rule.order in matches:
+                fields.setdefault(rule.field, []).extend(matches[rule.order])
+        return fields
+
+    def _walk(self, mapping: Dict[Any, Any], node: _TrieNode, matches: Dict[int, List[Any]]):
+        for key, value in mapping.items():
+            child = node.children.get(key if isinstance(key, str) else str(key))
+            for target in (child, node.wildcard):
+                if target is None:
+                    continue
+                for rule in target.rules:
+                    result = rule.emit(key, value)
+                    if result is not None:
+                        matches.setdefault(rule.order, []).append(result)
+                if isinstance(value, dict) and (target.children or target.wildcard):
+                    self._walk(value, target, matches)
+
+
+def load_rules_file(path: str) -> List[Dict[str, Any]]:
+    """Load a YAML list of rule specifications"""
+    with open(path, encoding='utf-8') as rules_file:
+        specs = yaml.safe_load(rules_file) or []
+    if not isinstance(specs, list):
+        raise ValueError(f"{path} must contain a list of extraction rules")
+    return specs
+
+
+def configured_rules() -> List[Dict[str, Any]]:
+    """
+    Extra rules from the Django settings ``SERVICE_EXTRACTION_RULES`` (a list of specs)
+    and ``SERVICE_EXTRACTION_RULES_FILE`` (a YAML file), when Django is configured.
+    """
+    try:
+        from django.conf import settings
+    except ImportError:
+        return []
+    if not settings.configured:
+        return []
+    specs = list(getattr(settings, 'SERVICE_EXTRACTION_RULES', []))
+    path = getattr(settings, 'SERVICE_EXTRACTION_RULES_FILE', None)
+    if path:
+        specs.extend(load_rules_file(path))
+    return specs
@@ -0,0 +1,372 @@
+"""
+Pooled HTTP clients for the Bitbucket API
+
+Every reader created for the same access token shares one ``requests.Session``
+so TCP/TLS connections are kept alive and reused across calls and threads.
+Async readers likewise share one ``httpx.AsyncClient`` per access token and
+event loop. Shared clients are kept per token digest, up to MAX_CLIENTS of
+the most recently used. Throttling (429) and transient server errors (5xx) are retried
+with jittered exponential backoff, honouring ``Retry-After`` when the server
+sends it.
+"""
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import nullcontext
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, ContextManager, Dict, Optional, Set
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import HTTP_REQUESTS
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryPolicy:
+    """
+    Backoff and request counters shared by the sync and async clients
+    """
+
+    def __init__(self, max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 timeout: float = 30.0):
+        """
+        Args:
+            max_retries (int): Retries after the first attempt for 429/5xx and connection errors
+            backoff_base (float): Backoff ceiling in seconds for the first retry, doubled on each retry
+            backoff_max (float): Upper bound in seconds for any single wait, including Retry-After
+            timeout (float): Connect/read timeout in seconds for each attempt
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+        self._failures = 0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given zero-based retry attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def retry_after(self, response) -> Optional[float]:
+        """Seconds to wait according to the ``Retry-After`` header, or None if absent or invalid."""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(self.backoff_max, max(0.0, delay))
+
+    def request_counts(self) -> Dict[str, int]:
+        """Attempts sent, retries and requests that gave up."""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "retries": self._retries,
+                "failures": self._failures,
+            }
+
+
+class BitbucketHTTPClient(RetryPolicy):
+    def __init__(self, access_token: str, pool_maxsize: int = 32, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, timeout: float = 30.0):
+        """
+        Initialize the pooled HTTP client.
+
+        Args:
+            access_token (str): Bitbucket access token sent with every request
+            pool_maxsize (int): Keep-alive connections kept per host
+            max_retries (int): Retries after the first attempt for 429/5xx and connection errors
+            backoff_base (float): Backoff ceiling in seconds for the first retry, doubled on each retry
+            backoff_max (float): Upper bound in seconds for any single wait, including Retry-After
+            timeout (float): Connect/read timeout in seconds for each attempt
+        """
+        super().__init__(max_retries, backoff_base, backoff_max, timeout)
+
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, attempt_slot: Optional[Callable[[], ContextManager]] = None,
+            **kwargs) -> requests.Response:
+        """
+        Send a GET request, retrying throttled and transient failures.
+
+        Args:
+            url (str): Absolute URL to fetch
+            attempt_slot (Callable): Returns a context manager held around each attempt but not
+                the backoff waits between them, e.g. a FairScheduler slot
+            **kwargs: Extra arguments passed to ``requests.Session.get``
+
+        Returns:
+            requests.Response: The final response; callers still decide how to treat error statuses
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempt_slot = attempt_slot or nullcontext
+        attempt = 0
+        while True:
+            with self._lock:
+                self._requests += 1
+            try:
+                with attempt_slot():
+                    response = self.session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                HTTP_REQUESTS.inc(status='error')
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                delay = self.backoff_delay(attempt)
+            else:
+                HTTP_REQUESTS.inc(status=str(response.status_code))
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+                response.close()
+
+            with self._lock:
+                self._retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return request counters for this client.
+
+        Returns:
+            Dict[str, int]: Attempts sent, retries, requests that gave up, and
+            connections opened versus reused from the keep-alive pool
+        """
+        opened = reused = 0
+        for adapter in set(self.session.adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                reused += max(0, pool.num_requests - pool.num_connections)
+        return {
+            **self.request_counts(),
+            "connections_opened": opened,
+            "connections_reused": reused,
+        }
+
+    def close(self):
+        """Close every pooled connection."""
+        self.session.close()
+
+
+class AsyncBitbucketHTTPClient(RetryPolicy):
+    """
+    asyncio counterpart of BitbucketHTTPClient built on ``httpx.AsyncClient``
+
+    Backoff waits with ``asyncio.sleep`` so other requests on the event loop
+    proceed meanwhile. A client is bound to the event loop it was created on.
+    """
+
+    def __init__(self, access_token: str, pool_maxsize: int = 32, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, timeout: float = 30.0):
+        """
+        Initialize the pooled async HTTP client.
+
+        Args:
+            access_token (str): Bitbucket access token sent with every request
+            pool_maxsize (int): Connections opened and kept alive across all hosts
+            max_retries (int): See BitbucketHTTPClient
+            backoff_base (float): See BitbucketHTTPClient
+            backoff_max (float): See BitbucketHTTPClient
+            timeout (float): See BitbucketHTTPClient
+        """
+        super().__init__(max_retries, backoff_base, backoff_max, timeout)
+        self.session = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {access_token}"},
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+            timeout=timeout,
+        )
+        # Calls to get() not yet returned, checked before closing an evicted client
+        self.in_flight = 0
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a GET request, retrying throttled and transient failures.
+
+        Args:
+            url (str): Absolute URL to fetch
+            **kwargs: Extra arguments passed to ``httpx.AsyncClient.get``
+
+        Returns:
+            httpx.Response: The final response; callers still decide how to treat error statuses
+        """
+        self.in_flight += 1
+        try:
+            return await self._get(url, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+    async def _get(self, url: str, **kwargs) -> httpx.Response:
+        attempt = 0
+        while True:
+            with self._lock:
+                self._requests += 1
+            try:
+                response = await self.session.get(url, **kwargs)
+            except httpx.TransportError:
+                HTTP_REQUESTS.inc(status='error')
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                delay = self.backoff_delay(attempt)
+            else:
+                HTTP_REQUESTS.inc(status=str(response.status_code))
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+                await response.aclose()
+
+            with self._lock:
+                self._retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        """Return request counters for this client (see RetryPolicy.request_counts)."""
+        return self.request_counts()
+
+    async def aclose(self):
+        """Close every pooled connection."""
+        await self.session.aclose()
+
+    async def aclose_when_idle(self, poll_interval: float = 0.1):
+        """Close every pooled connection once no request is in flight."""
+        while self.in_flight:
+            await asyncio.sleep(poll_interval)
+        await self.aclose()
+
+
+# Shared clients are keyed by a digest of their access token, so the tokens
+# themselves are not kept as keys, and only the most recently used are kept
+MAX_CLIENTS = 64
+
+_clients: "OrderedDict[str, BitbucketHTTPClient]" = OrderedDict()
+_clients_lock = threading.Lock()
+# Counters of evicted sync and async clients, kept for get_client_stats
+_evicted_stats: Dict[str, int] = {}
+# Tasks closing evicted async clients
+_closing: Set[asyncio.Task] = set()
+
+
+def _token_key(access_token: str) -> str:
+    """Return the key shared clients are stored under for an access token."""
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+
+def get_client(access_token: str, **options: Any) -> BitbucketHTTPClient:
+    """
+    Return the shared client for an access token, creating it on first use.
+
+    Once MAX_CLIENTS clients exist, the least recently used one is closed and
+    dropped; readers still holding it keep working on fresh connections.
+
+    Args:
+        access_token (str): Bitbucket access token
+        **options: BitbucketHTTPClient arguments, only used when the client is created
+
+    Returns:
+        BitbucketHTTPClient: Client shared by every reader using this token
+    """
+    key = _token_key(access_token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        client = _clients[key] = BitbucketHTTPClient(access_token, **options)
+        evicted = []
+        while len(_clients) > MAX_CLIENTS:
+            evicted.append(_clients.popitem(last=False)[1])
+        for old in evicted:
+            for name, value in old.stats().items():
+                _evicted_stats[name] = _evicted_stats.get(name, 0) + value
+    for old in evicted:
+        old.close()
+    return client
+
+
+# Async clients per event loop, dropped together with their loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, OrderedDict[str, AsyncBitbucketHTTPClient]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def get_async_client(access_token: str, **options: Any) -> AsyncBitbucketHTTPClient:
+    """
+    Return the async client shared on the running event loop for an access token.
+
+    Must be called from a coroutine; connections cannot move between event loops,
+    so each loop (e.g. each ASGI worker) keeps its own pool. Each loop keeps at
+    most MAX_CLIENTS clients. The least recently used one is dropped and closed
+    on the loop once its requests in flight have finished; its counters still
+    count towards get_client_stats, like those of evicted sync clients.
+
+    Args:
+        access_token (str): Bitbucket access token
+        **options: AsyncBitbucketHTTPClient arguments, only used when the client is created
+
+    Returns:
+        AsyncBitbucketHTTPClient: Client shared by every async reader using this token on this loop
+    """
+    loop = asyncio.get_running_loop()
+    key = _token_key(access_token)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, OrderedDict())
+        client = clients.get(key)
+        if client is not None:
+            clients.move_to_end(key)
+            return client
+        client = clients[key] = AsyncBitbucketHTTPClient(access_token, **options)
+        evicted = []
+        while len(clients) > MAX_CLIENTS:
+            evicted.append(clients.popitem(last=False)[1])
+        for old in evicted:
+            for name, value in old.stats().items():
+                _evicted_stats[name] = _evicted_stats.get(name, 0) + value
+    for old in evicted:
+        task = loop.create_task(old.aclose_when_idle())
+        # The loop only keeps weak references to its tasks
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    return client
+
+
+def get_client_stats() -> Dict[str, int]:
+    """Sum the counters of every shared client, including evicted ones."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        for loop_clients in list(_async_clients.values()):
+            clients.extend(loop_clients.values())
+        totals = dict(_evicted_stats)
+    for client in clients:
+        for name, value in client.stats().items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
@@ -0,0 +1,258 @@
+"""
+Background repository parse jobs
+
+Parse requests are stored as ParseJob rows and executed outside the HTTP
+request, either on an in-process thread pool (``PARSE_JOB_RUNNER = 'thread'``)
+or by one or more ``manage.py run_parse_worker`` processes
+(``PARSE_JOB_RUNNER = 'worker'``). Jobs are claimed with a conditional
+UPDATE, so a job is only ever run once whichever runner picks it up.
+
+Deletions of repositories too large to delete within a request are stored
+as RepositoryDeletion rows and run the same way. A failed deletion is
+retried by requesting the deletion again.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Type
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .bitbucket_reader import BitbucketYAMLReader
+from .models import ParseJob, Repository, RepositoryDeletion
+from .repository_parser import RepositoryParser, delete_repository, summary_message
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 0.5
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide thread pool used by the 'thread' runner"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PARSE_JOB_WORKERS,
+                                           thread_name_prefix='parse-job')
+        return _executor
+
+
+def enqueue_parse_job(repository: Repository, options: Dict[str, Any]) -> ParseJob:
+    """
+    Create a queued parse job and hand it to the configured runner.
+
+    Args:
+        repository (Repository): Repository to parse
+        options (Dict[str, Any]): Parse options from the request
+
+    Returns:
+        ParseJob: The queued job
+    """
+    job = ParseJob.objects.create(repository=repository, options=options)
+    if settings.PARSE_JOB_RUNNER == 'thread':
+        # Submit once the row is committed so the pool thread can see it
+        transaction.on_commit(lambda: get_executor().submit(run_in_thread, job.pk))
+    return job
+
+
+def enqueue_repository_deletion(repository: Repository) -> RepositoryDeletion:
+    """
+    Create a queued deletion of a repository and hand it to the configured runner.
+
+    Args:
+        repository (Repository): Repository to delete
+
+    Returns:
+        RepositoryDeletion: The queued deletion, or the one already queued or running for the repository
+    """
+    pending = repository.deletions.filter(
+        status__in=[RepositoryDeletion.STATUS_QUEUED, RepositoryDeletion.STATUS_RUNNING]).first()
+    if pending:
+        return pending
+    deletion = RepositoryDeletion.objects.create(repository=repository,
+                                                 repository_name=f"{repository.workspace}/{repository.repository}")
+    if settings.PARSE_JOB_RUNNER == 'thread':
+        # Submit once the row is committed so the pool thread can see it
+        transaction.on_commit(lambda: get_executor().submit(run_deletion_in_thread, deletion.pk))
+    return deletion
+
+
+def run_deletion_in_thread(deletion_id: int, claimed: bool = False):
+    """Run a deletion on a pool thread, releasing the thread's database connection afterwards"""
+    close_old_connections()
+    try:
+        run_repository_deletion(deletion_id, claimed=claimed)
+    finally:
+        close_old_connections()
+
+
+def claim_deletion(deletion_id: int) -> bool:
+    """Atomically move a queued deletion to running; False if another runner got it first"""
+    return RepositoryDeletion.objects.filter(pk=deletion_id, status=RepositoryDeletion.STATUS_QUEUED).update(
+        status=RepositoryDeletion.STATUS_RUNNING,
+        started_at=timezone.now()
+    ) == 1
+
+
+def claim_next_deletion() -> Optional[int]:
+    """Claim the oldest queued deletion, returning its id, or None if there is none"""
+    queued = RepositoryDeletion.objects.filter(status=RepositoryDeletion.STATUS_QUEUED).order_by('created_at', 'pk')
+    for deletion_id in queued.values_list('pk', flat=True)[:10]:
+        if claim_deletion(deletion_id):
+            return deletion_id
+    return None
+
+
+def run_repository_deletion(deletion_id: int, claimed: bool = False) -> RepositoryDeletion:
+    """
+    Execute a repository deletion and record its outcome.
+
+    Args:
+        deletion_id (int): Deletion to run
+        claimed (bool): True if the caller already moved the deletion to running
+
+    Returns:
+        RepositoryDeletion: The deletion in its final state (unchanged if it was not queued)
+    """
+    if not claimed and not claim_deletion(deletion_id):
+        return RepositoryDeletion.objects.get(pk=deletion_id)
+
+    deletion = RepositoryDeletion.objects.get(pk=deletion_id)
+    try:
+        # Repositories deleted in the meantime leave nothing to delete
+        deletion.deleted_items = (delete_repository(deletion.repository_id) if deletion.repository_id
+                                  else {'repository': 0, 'yaml_files': 0, 'services': 0})
+        deletion.status = RepositoryDeletion.STATUS_SUCCEEDED
+    except Exception as e:
+        logger.exception("Error deleting repository %s", deletion.repository_name)
+        deletion.status = RepositoryDeletion.STATUS_FAILED
+        deletion.error = f'Error deleting repository: {str(e)}'
+    deletion.finished_at = timezone.now()
+    deletion.save(update_fields=['status', 'deleted_items', 'error', 'finished_at'])
+    return deletion
+
+
+def build_parser(repository: Repository, options: Dict[str, Any], progress=None,
+                 reader_class: Type[BitbucketYAMLReader] = BitbucketYAMLReader, streaming: bool = False):
+    """
+    Create the reader and parser for a repository from request options.
+
+    Args:
+        repository (Repository): Repository to parse
+        options (Dict[str, Any]): Parse options (concurrency, max_depth, include, exclude)
+        progress (Callable): Optional per-file progress callback for RepositoryParser
+        reader_class (Type[BitbucketYAMLReader]): Reader to create, e.g. AsyncBitbucketYAMLReader for aparse
+        streaming (bool): Process and store each file on its own as soon as it is fetched, so
+            iter_parse yields every file on arrival and only once its rows are written
+
+    Returns:
+        RepositoryParser: Parser ready to run
+    """
+    reader = reader_class(repository.access_token, repository.workspace, repository.repository,
+                          base_url=settings.BITBUCKET_API_URL)
+    return RepositoryParser(
+        repository,
+        reader,
+        concurrency=options.get('concurrency') or settings.BITBUCKET_FETCH_CONCURRENCY,
+        rate_limit=settings.BITBUCKET_RATE_LIMIT,
+        listing_concurrency=settings.BITBUCKET_LISTING_CONCURRENCY,
+        max_depth=options.get('max_depth', settings.BITBUCKET_TREE_MAX_DEPTH),
+        include=options.get('include'),
+        exclude=options.get('exclude'),
+        batch_size=1 if streaming else settings.PARSE_BATCH_SIZE,
+        write_batch_size=1 if streaming else settings.PARSE_WRITE_BATCH_SIZE,
+        parse_workers=settings.PARSE_WORKERS,
+        parse_chunk_size=settings.PARSE_CHUNK_SIZE,
+        spool_documents=settings.PARSE_SPOOL_DOCUMENTS,
+        progress=progress
+    )
+
+
+def run_in_thread(job_id: int, claimed: bool = False, scheduler=None):
+    """Run a job on a pool thread, releasing the thread's database connection afterwards"""
+    close_old_connections()
+    try:
+        run_parse_job(job_id, claimed=claimed, scheduler=scheduler)
+    finally:
+        close_old_connections()
+
+
+def claim_job(job_id: int) -> bool:
+    """Atomically move a queued job to running; False if another runner got it first"""
+    return ParseJob.objects.filter(pk=job_id, status=ParseJob.STATUS_QUEUED).update(
+        status=ParseJob.STATUS_RUNNING,
+        started_at=timezone.now()
+    ) == 1
+
+
+def claim_next_job() -> Optional[int]:
+    """Claim the oldest queued job, returning its id, or None if the queue is empty"""
+    # Jobs of a batch are run by their batch
+    queued = ParseJob.objects.filter(status=ParseJob.STATUS_QUEUED, batch__isnull=True).order_by('created_at', 'pk')
+    for job_id in queued.values_list('pk', flat=True)[:10]:
+        if claim_job(job_id):
+            return job_id
+    return None
+
+
+def run_parse_job(job_id: int, claimed: bool = False, scheduler=None) -> ParseJob:
+    """
+    Execute a parse job and record its progress and outcome.
+
+    Args:
+        job_id (int): Job to run
+        claimed (bool): True if the caller already moved the job to running
+        scheduler (FairScheduler): Request budget shared with the other jobs of a batch
+
+    Returns:
+        ParseJob: The job in its final state (unchanged if it was not queued)
+    """
+    if not claimed and not claim_job(job_id):
+        return ParseJob.objects.get(pk=job_id)
+
+    job = ParseJob.objects.select_related('repository').get(pk=job_id)
+    repository = job.repository
+    options = job.options or {}
+    last_write = 0.0
+
+    def report_progress(processed: int, total: Optional[int]):
+        nonlocal last_write
+        now = time.monotonic()
+        if now - last_write >= PROGRESS_INTERVAL:
+            last_write = now
+            ParseJob.objects.filter(pk=job_id).update(processed_files=processed, total_files=total)
+
+    parser = None
+    try:
+        parser = build_parser(repository, options, progress=report_progress)
+        if scheduler:
+            parser.reader.client = scheduler.client_for(parser.reader.client, str(repository))
+        result = parser.parse(full=bool(options.get('full')))
+        # Parsed content is already stored on the files; keep the job result small
+        for parsed_file in result['files']:
+            parsed_file.pop('parsed_data', None)
+        job.result = {
+            'message': summary_message(result),
+            'repository_id': repository.id,
+            **result,
+            'http_stats': parser.reader.client.stats()
+        }
+        job.status = ParseJob.STATUS_SUCCEEDED
+        job.total_files = parser.total_files
+    except Exception as e:
+        logger.exception("Error parsing repository %s", repository)
+        job.status = ParseJob.STATUS_FAILED
+        job.error = f'Error parsing repository: {str(e)}'
+    if parser:
+        job.processed_files = parser.processed_files
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'processed_files', 'total_files', 'finished_at'])
+    return job
@@ -0,0 +1,79 @@
+"""
+JSON encoding backends
+
+Uses ``orjson`` when it is installed and the standard library ``json``
+module otherwise. Every model JSONField encodes and decodes through
+ORJSONEncoder and ORJSONDecoder, which defer to the standard library when
+orjson is missing or cannot handle a value (integers beyond 64 bits, for
+example); the REST framework renderer and parser built on orjson are in
+renderers.py.
+
+Non-finite floats (YAML ``.inf`` and ``.nan``) are stored as null whichever
+backend writes them, since JSON has no token for them and database JSON
+checks reject the NaN and Infinity tokens json would write. The decoder
+still reads those tokens, and integers beyond 64 bits, with json. Apart
+from that, the backends only differ in orjson writing non-ASCII characters
+unescaped.
+"""
+
+import json
+import math
+import re
+
+try:
+    import orjson
+except ImportError:  # the standard library json module is used instead
+    orjson = None
+
+ORJSON = 'orjson'
+STDLIB = 'json'
+
+# Backend used by the JSONField encoder and, when settings select them, the API renderer and parser
+DEFAULT_BACKEND = ORJSON if orjson is not None else STDLIB
+
+if orjson is not None:
+    # YAML mappings may have int, float, bool or null keys, which json writes as strings
+    DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+    # Datetimes are handed to REST framework's encoder, which shortens them to milliseconds
+    RENDER_OPTIONS = DUMPS_OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME
+else:
+    DUMPS_OPTIONS = RENDER_OPTIONS = 0
+
+# orjson reads integers beyond 64 bits as floats, losing precision; leave any
+# run of 20 or more digits (rarely found in strings either) to json
+_LONG_INTEGER = re.compile(r'\d{20}')
+
+
+def _finite(value):
+    """Copy of ``value`` with NaN and infinite floats replaced by None, as orjson writes them"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+
+class ORJSONEncoder(json.JSONEncoder):
+    """JSONField encoder writing with orjson, falling back to json for values orjson rejects"""
+
+    def encode(self, o):
+        if orjson is not None:
+            try:
+                return orjson.dumps(o, default=self.default, option=DUMPS_OPTIONS).decode('utf-8')
+            except orjson.JSONEncodeError:
+                pass
+        return super().encode(_finite(o))
+
+
+class ORJSONDecoder(json.JSONDecoder):
+    """JSONField decoder reading with orjson, falling back to json for what orjson rejects"""
+
+    def decode(self, s, *args, **kwargs):
+        if orjson is not None and not _LONG_INTEGER.search(s):
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass
+        return super().decode(s, *args, **kwargs)
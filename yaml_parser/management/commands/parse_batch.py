@@ -0,0 +1,70 @@
+import yaml
+from django.core.management.base import BaseCommand, CommandError
+
+from yaml_parser.batch import batch_options, batch_repositories, create_parse_batch, run_parse_batch
+from yaml_parser.serializers import BatchOptionsSerializer
+
+
+class Command(BaseCommand):
+    help = "Parse many repositories, or every repository of a workspace, under one shared request budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workspace', help="Workspace of the repositories; parses all of them unless "
+                                                "--repository or --repositories-file is given")
+        parser.add_argument('--access-token', help="Bitbucket access token for the workspace")
+        parser.add_argument('--repository', action='append', default=[], help="Repository slug (repeatable)")
+        parser.add_argument('--repositories-file', help="YAML or JSON list of entries with workspace, "
+                                                        "repository and access_token")
+        parser.add_argument('--concurrency', type=int, help="Requests in flight across all repositories")
+        parser.add_argument('--rate-limit', type=float, help="Requests per second across all repositories")
+        parser.add_argument('--repository-concurrency', type=int, help="Repositories parsed at once")
+        parser.add_argument('--max-depth', type=int, help="Deepest directory level to scan")
+        parser.add_argument('--include', action='append', help="Glob pattern of paths to scan (repeatable)")
+        parser.add_argument('--exclude', action='append', help="Glob pattern of paths to skip (repeatable)")
+        parser.add_argument('--full', action='store_true', help="Re-parse every file")
+        parser.add_argument('--queue', action='store_true', help="Queue the batch for run_parse_worker "
+                                                                 "instead of running it now")
+
+    def handle(self, *args, **options):
+        budget = BatchOptionsSerializer(data={name: options[name] for name in
+                                              ('concurrency', 'rate_limit', 'repository_concurrency')})
+        if not budget.is_valid():
+            raise CommandError(budget.first_error())
+
+        entries = [{'repository': slug} for slug in options['repository']]
+        if options['repositories_file']:
+            with open(options['repositories_file'], encoding='utf-8') as entries_file:
+                entries.extend(yaml.safe_load(entries_file) or [])
+
+        try:
+            repositories = batch_repositories(entries, workspace=options['workspace'],
+                                              access_token=options['access_token'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        batch = create_parse_batch(
+            repositories,
+            {'max_depth': options['max_depth'], 'include': options['include'], 'exclude': options['exclude'],
+             'full': options['full']},
+            batch_options(budget.validated_data['concurrency'], budget.validated_data['rate_limit'],
+                          budget.validated_data['repository_concurrency']),
+            enqueue=False
+        )
+        if options['queue']:
+            self.stdout.write(f"Queued parse batch {batch.id} of {len(repositories)} repositories")
+            return
+
+        self.stdout.write(f"Parsing {len(repositories)} repositories as batch {batch.id}")
+        batch = run_parse_batch(batch.id)
+        if batch.status != batch.STATUS_SUCCEEDED:
+            raise CommandError(batch.error)
+
+        for job in batch.jobs.select_related('repository').order_by('pk'):
+            outcome = job.result['message'] if job.result else job.error
+            self.stdout.write(f"{job.repository}: {job.status} - {outcome}")
+        result = batch.result
+        self.stdout.write(self.style.SUCCESS(
+            f"Parsed {result['processed_files']} files from {result['succeeded']}/{result['repositories']} "
+            f"repositories in {result['elapsed_seconds']}s ({result['files_per_second']} files/s, "
+            f"{result['requests_per_second']} requests/s), extracted {result['services_extracted']} services"
+        ))
@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.core.management.base import BaseCommand
+
+from yaml_parser.batch import claim_next_batch, run_batch_in_thread
+from yaml_parser.jobs import claim_next_deletion, claim_next_job, run_deletion_in_thread, run_in_thread
+
+
+class Command(BaseCommand):
+    help = "Run queued repository parse jobs, batches and deletions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Number of jobs run at once")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        self.stdout.write(f"Parse worker started with {workers} workers")
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parse-worker') as executor:
+            running = set()
+            while True:
+                while len(running) < workers:
+                    job_id = claim_next_job()
+                    if job_id is not None:
+                        self.stdout.write(f"Running parse job {job_id}")
+                        running.add(executor.submit(run_in_thread, job_id, True))
+                        continue
+                    batch_id = claim_next_batch()
+                    if batch_id is not None:
+                        self.stdout.write(f"Running parse batch {batch_id}")
+                        running.add(executor.submit(run_batch_in_thread, batch_id, True))
+                        continue
+                    deletion_id = claim_next_deletion()
+                    if deletion_id is None:
+                        break
+                    self.stdout.write(f"Running repository deletion {deletion_id}")
+                    running.add(executor.submit(run_deletion_in_thread, deletion_id, True))
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
@@ -0,0 +1,212 @@
+"""
+Process-wide parse metrics in the Prometheus text exposition format
+
+A minimal, dependency-free take on counters and histograms: metrics are
+registered once at import time, updated from any thread, and rendered by the
+``/metrics`` endpoint. Every metric is prefixed with ``yamlforge_``.
+
+Metrics are kept per process; with several server processes each one is
+scraped (or aggregated) separately, as with any Prometheus client.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, from a fast cache lookup to a slow Bitbucket round trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base class holding the name, help text and label names of a metric"""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}'] + self.samples()
+
+
+class Counter(Metric):
+    """Monotonically increasing count, e.g. requests or bytes"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._labels(key)} {_format_value(value)}' for key, value in values]
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. durations, in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Per label set: observations per bucket, sum, count
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall-clock duration of the block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            values = self._values.get(self._key(labels))
+        return values[2] if values else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, observed in zip(self.buckets, counts):
+                cumulative += observed
+                lines.append(f'{self.name}_bucket{self._labels(key, ("le", _format_value(bound)))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{self._labels(key)} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    """Value computed when the metrics are rendered, e.g. a ratio of two counters"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Optional[float]]):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def samples(self) -> List[str]:
+        value = self.function()
+        return [] if value is None else [f'{self.name} {_format_value(value)}']
+
+
+class Registry:
+    """Metrics rendered together"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def ratio(counter: Counter, label: str, hits: Sequence[str], lookups: Sequence[str]) -> Callable[[], Optional[float]]:
+    """Share of the ``lookups`` values of a counter's label that are ``hits`` values (None before any lookup)"""
+    def compute() -> Optional[float]:
+        total = sum(counter.value(**{label: value}) for value in lookups)
+        return sum(counter.value(**{label: value}) for value in hits) / total if total else None
+    return compute
+
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'yamlforge_stage_duration_seconds',
+    'Time spent in each parse pipeline stage (listing, fetch, parse, extract, db_write, serialize)',
+    ['stage']
+))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'yamlforge_bitbucket_requests_total',
+    'Bitbucket API request attempts by response status ("error" for connection failures)',
+    ['status']
+))
+FETCHED_BYTES = REGISTRY.register(Counter(
+    'yamlforge_fetched_bytes_total',
+    'Bytes of YAML file content downloaded from Bitbucket'
+))
+PROCESSED_FILES = REGISTRY.register(Counter(
+    'yamlforge_processed_files_total',
+    'YAML files parsed and stored'
+))
+PARSE_CACHE = REGISTRY.register(Counter(
+    'yamlforge_parse_cache_requests_total',
+    'Parse cache lookups by result (hit or miss)',
+    ['result']
+))
+RESPONSE_CACHE = REGISTRY.register(Counter(
+    'yamlforge_response_cache_requests_total',
+    'Cached read endpoint requests by result (not_modified, hit or miss)',
+    ['result']
+))
+REGISTRY.register(Gauge(
+    'yamlforge_parse_cache_hit_ratio',
+    'Share of parse cache lookups that were hits',
+    ratio(PARSE_CACHE, 'result', ['hit'], ['hit', 'miss'])
+))
+REGISTRY.register(Gauge(
+    'yamlforge_response_cache_hit_ratio',
+    'Share of cached endpoint requests answered without building the response',
+    ratio(RESPONSE_CACHE, 'result', ['hit', 'not_modified'], ['hit', 'not_modified', 'miss'])
+))
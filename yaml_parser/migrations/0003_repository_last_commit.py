@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0002_service"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="last_commit",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Last commit parsed into this repository",
+                max_length=64,
+            ),
+        ),
+    ]
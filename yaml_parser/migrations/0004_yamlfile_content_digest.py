@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:01
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_content_digests(apps, schema_editor):
+    YAMLFile = apps.get_model("yaml_parser", "YAMLFile")
+    for yaml_file in YAMLFile.objects.only("id", "content").iterator():
+        digest = hashlib.sha256(yaml_file.content.encode("utf-8")).hexdigest()
+        YAMLFile.objects.filter(pk=yaml_file.pk).update(content_digest=digest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0003_repository_last_commit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="yamlfile",
+            name="content_digest",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default="",
+                help_text="SHA-256 of the content",
+                max_length=64,
+            ),
+        ),
+        migrations.RunPython(fill_content_digests, migrations.RunPython.noop),
+    ]
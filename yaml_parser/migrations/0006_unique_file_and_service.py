@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:05
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    # Keep the newest row of each duplicate group so the constraints can be added
+    YAMLFile = apps.get_model("yaml_parser", "YAMLFile")
+    Service = apps.get_model("yaml_parser", "Service")
+    duplicate_files = (
+        YAMLFile.objects.values("repository_id", "file_path")
+        .annotate(rows=Count("id"), keep=Max("id"))
+        .filter(rows__gt=1)
+    )
+    for group in duplicate_files:
+        YAMLFile.objects.filter(
+            repository_id=group["repository_id"], file_path=group["file_path"]
+        ).exclude(id=group["keep"]).delete()
+    duplicate_services = (
+        Service.objects.values("yaml_file_id", "service_name")
+        .annotate(rows=Count("id"), keep=Max("id"))
+        .filter(rows__gt=1)
+    )
+    for group in duplicate_services:
+        Service.objects.filter(
+            yaml_file_id=group["yaml_file_id"], service_name=group["service_name"]
+        ).exclude(id=group["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0005_parsejob"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="service",
+            constraint=models.UniqueConstraint(
+                fields=("yaml_file", "service_name"),
+                name="unique_yaml_file_service_name",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="yamlfile",
+            constraint=models.UniqueConstraint(
+                fields=("repository", "file_path"), name="unique_repository_file_path"
+            ),
+        ),
+    ]
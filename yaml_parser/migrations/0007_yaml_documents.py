@@ -0,0 +1,94 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_multi_document_files(apps, schema_editor):
+    YAMLFile = apps.get_model("yaml_parser", "YAMLFile")
+    YAMLDocument = apps.get_model("yaml_parser", "YAMLDocument")
+    for yaml_file in YAMLFile.objects.only("id", "parsed_data").iterator():
+        data = yaml_file.parsed_data
+        keys = (
+            [key for key in data if key.startswith("document_")]
+            if isinstance(data, dict)
+            else []
+        )
+        # Only dictionaries made entirely of document_N keys came from multi-document files
+        if len(keys) > 1 and len(keys) == len(data):
+            YAMLDocument.objects.bulk_create(
+                YAMLDocument(
+                    yaml_file_id=yaml_file.pk, index=index, parsed_data=data[key]
+                )
+                for index, key in enumerate(keys)
+            )
+            YAMLFile.objects.filter(pk=yaml_file.pk).update(
+                parsed_data=None, document_count=len(keys)
+            )
+        elif data is not None:
+            YAMLFile.objects.filter(pk=yaml_file.pk).update(document_count=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0006_unique_file_and_service"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="yamlfile",
+            name="document_count",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Number of YAML documents in the file"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="yamlfile",
+            name="parsed_data",
+            field=models.JSONField(
+                blank=True,
+                help_text="Parsed content of single-document files",
+                null=True,
+            ),
+        ),
+        migrations.CreateModel(
+            name="YAMLDocument",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "index",
+                    models.PositiveIntegerField(
+                        help_text="Zero-based position of the document in the file"
+                    ),
+                ),
+                ("parsed_data", models.JSONField(blank=True, null=True)),
+                (
+                    "yaml_file",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="documents",
+                        to="yaml_parser.yamlfile",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["index"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="yamldocument",
+            constraint=models.UniqueConstraint(
+                fields=("yaml_file", "index"), name="unique_yaml_file_document_index"
+            ),
+        ),
+        migrations.RunPython(split_multi_document_files, migrations.RunPython.noop),
+    ]
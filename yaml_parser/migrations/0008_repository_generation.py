@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0007_yaml_documents"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="generation",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Incremented whenever the repository's files or services change",
+            ),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0008_repository_generation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ParseBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "options",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        help_text="Batch options (concurrency, rate_limit, repository_concurrency)",
+                    ),
+                ),
+                (
+                    "result",
+                    models.JSONField(
+                        blank=True,
+                        help_text="Aggregate throughput once finished",
+                        null=True,
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name_plural": "Parse batches",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="parsejob",
+            name="batch",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Batch the job is run by, instead of a job runner of its own",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="jobs",
+                to="yaml_parser.parsebatch",
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0009_parse_batch"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="service",
+            options={"verbose_name_plural": "Services"},
+        ),
+        migrations.AlterModelOptions(
+            name="yamldocument",
+            options={"ordering": ["yaml_file", "index"]},
+        ),
+        migrations.AlterField(
+            model_name="service",
+            name="yaml_file",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="services",
+                to="yaml_parser.yamlfile",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="yamldocument",
+            name="yaml_file",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="documents",
+                to="yaml_parser.yamlfile",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="yamlfile",
+            name="repository",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="yaml_files",
+                to="yaml_parser.repository",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="repository",
+            index=models.Index(
+                fields=["workspace", "repository"], name="repository_workspace_slug_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="service",
+            index=models.Index(
+                fields=["service_name", "id"], name="service_name_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,152 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:05
+
+import hashlib
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BATCH_SIZE = 500
+
+# Frozen copies of the content helpers in yaml_parser.blobs as of this
+# migration. Blobs are written with zlib, which needs no optional package
+# and which every later codec setting can still read.
+CODEC = "zlib"
+ZLIB_LEVEL = 6
+
+
+def content_digest(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compress(content):
+    return zlib.compress(content.encode("utf-8"), ZLIB_LEVEL)
+
+
+def decompress(data, codec):
+    if codec == "zlib":
+        return zlib.decompress(bytes(data)).decode("utf-8")
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(bytes(data)).decode("utf-8")
+    raise ValueError(f"Cannot decompress content stored with codec {codec!r}")
+
+
+def move_content_to_blobs(apps, schema_editor):
+    ContentBlob = apps.get_model("yaml_parser", "ContentBlob")
+    YAMLFile = apps.get_model("yaml_parser", "YAMLFile")
+    files = YAMLFile.objects.only("id", "content", "content_digest").order_by("pk")
+    last_pk = 0
+    while True:
+        batch = list(files.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        blobs = {}
+        for yaml_file in batch:
+            yaml_file.content_digest = yaml_file.content_digest or content_digest(
+                yaml_file.content
+            )
+            blobs.setdefault(
+                yaml_file.content_digest,
+                ContentBlob(
+                    digest=yaml_file.content_digest,
+                    codec=CODEC,
+                    data=compress(yaml_file.content),
+                    size=len(yaml_file.content.encode("utf-8")),
+                ),
+            )
+        ContentBlob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+        YAMLFile.objects.bulk_update(batch, ["content_digest"])
+        last_pk = batch[-1].pk
+
+
+def restore_content(apps, schema_editor):
+    ContentBlob = apps.get_model("yaml_parser", "ContentBlob")
+    YAMLFile = apps.get_model("yaml_parser", "YAMLFile")
+    files = YAMLFile.objects.only("id", "content_digest").order_by("pk")
+    last_pk = 0
+    while True:
+        batch = list(files.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        blobs = ContentBlob.objects.in_bulk(
+            {yaml_file.content_digest for yaml_file in batch}
+        )
+        for yaml_file in batch:
+            blob = blobs[yaml_file.content_digest]
+            yaml_file.content = decompress(blob.data, blob.codec)
+        YAMLFile.objects.bulk_update(batch, ["content"])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0010_catalog_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentBlob",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(
+                        help_text="SHA-256 of the content",
+                        max_length=64,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "codec",
+                    models.CharField(
+                        help_text="Compression of the data (zstd or zlib)",
+                        max_length=10,
+                    ),
+                ),
+                ("data", models.BinaryField()),
+                (
+                    "size",
+                    models.PositiveIntegerField(
+                        help_text="Length of the uncompressed content in bytes"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+        migrations.RunPython(move_content_to_blobs, restore_content),
+        # Gives the column a default, so unapplying the removal can add it back
+        migrations.AlterField(
+            model_name="yamlfile",
+            name="content",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.RemoveField(
+            model_name="yamlfile",
+            name="content",
+        ),
+        migrations.AlterField(
+            model_name="yamlfile",
+            name="content_digest",
+            field=models.ForeignKey(
+                db_column="content_digest",
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="yaml_files",
+                to="yaml_parser.contentblob",
+            ),
+        ),
+        migrations.RenameField(
+            model_name="yamlfile",
+            old_name="content_digest",
+            new_name="blob",
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:40
+
+from django.db import migrations, models
+import yaml_parser.json_backend
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0011_content_blobs"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="parsebatch",
+            name="options",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                default=dict,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="Batch options (concurrency, rate_limit, repository_concurrency)",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="parsebatch",
+            name="result",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="Aggregate throughput once finished",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="parsejob",
+            name="options",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                default=dict,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="Parse options (concurrency, include, exclude, max_depth, full)",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="parsejob",
+            name="result",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="service",
+            name="additional_data",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="Additional service data",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="service",
+            name="dependent_infrastructure",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="List of dependent infrastructure",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="service",
+            name="dependent_services",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="List of dependent services",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="yamldocument",
+            name="parsed_data",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="yamlfile",
+            name="parsed_data",
+            field=models.JSONField(
+                blank=True,
+                decoder=yaml_parser.json_backend.ORJSONDecoder,
+                encoder=yaml_parser.json_backend.ORJSONEncoder,
+                help_text="Parsed content of single-document files",
+                null=True,
+            ),
+        ),
+    ]
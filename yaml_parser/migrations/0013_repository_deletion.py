@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-17 07:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import yaml_parser.json_backend
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("yaml_parser", "0012_json_field_codecs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RepositoryDeletion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("repository_name", models.CharField(max_length=511)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "deleted_items",
+                    models.JSONField(
+                        blank=True,
+                        decoder=yaml_parser.json_backend.ORJSONDecoder,
+                        encoder=yaml_parser.json_backend.ORJSONEncoder,
+                        null=True,
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "repository",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="deletions",
+                        to="yaml_parser.repository",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
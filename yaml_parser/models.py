@@ -1,46 +1,236 @@
 from django.db import models
 from django.utils import timezone
 
+from .blobs import DEFAULT_CODEC, compress, content_digest, decompress
+from .json_backend import ORJSONDecoder, ORJSONEncoder
+
 class Repository(models.Model):
     """Model to store repository information"""
     workspace = models.CharField(max_length=100)
     repository = models.CharField(max_length=100)
     access_token = models.CharField(max_length=500)
+    last_commit = models.CharField(max_length=64, blank=True, default='', help_text="Last commit parsed into this repository")
+    generation = models.PositiveIntegerField(default=0, help_text="Incremented whenever the repository's files or services change")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Repositories"
+        indexes = [
+            models.Index(fields=['workspace', 'repository'], name='repository_workspace_slug_idx'),
+        ]
 
     def __str__(self):
         return f"{self.workspace}/{self.repository}"
 
+class ContentBlob(models.Model):
+    """Model to store the raw content shared by every YAML file with the same content, compressed"""
+    digest = models.CharField(max_length=64, primary_key=True, help_text="SHA-256 of the content")
+    codec = models.CharField(max_length=10, help_text="Compression of the data (zstd or zlib)")
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Length of the uncompressed content in bytes")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.digest
+
+    @classmethod
+    def for_content(cls, content: str, digest: str = None) -> 'ContentBlob':
+        """Unsaved blob holding ``content``, compressed with the default codec"""
+        return cls(digest=digest or content_digest(content), codec=DEFAULT_CODEC, data=compress(content),
+                   size=len(content.encode('utf-8')))
+
+    @property
+    def text(self) -> str:
+        return decompress(self.data, self.codec)
+
 class YAMLFile(models.Model):
     """Model to store YAML file information"""
-    repository = models.ForeignKey(Repository, on_delete=models.CASCADE, related_name='yaml_files')
+    # Looked up through unique_repository_file_path, which leads with the repository
+    repository = models.ForeignKey(Repository, on_delete=models.CASCADE, related_name='yaml_files', db_index=False)
     file_path = models.CharField(max_length=255)
-    content = models.TextField()
-    parsed_data = models.JSONField(null=True, blank=True)
+    # Raw content, kept apart so only requests that ask for it load it
+    blob = models.ForeignKey(ContentBlob, on_delete=models.PROTECT, related_name='yaml_files', db_column='content_digest')
+    parsed_data = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True, help_text="Parsed content of single-document files")
+    document_count = models.PositiveIntegerField(default=0, help_text="Number of YAML documents in the file")
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['repository', 'file_path'], name='unique_repository_file_path'),
+        ]
+
     def __str__(self):
         return f"{self.repository} - {self.file_path}"
 
+    @property
+    def content(self):
+        """Raw file content, loaded from its blob on first use"""
+        return self.blob.text
+
+    @property
+    def has_parsed_data(self):
+        return bool(self.parsed_data) or self.document_count > 1
+
+    def parsed_documents(self):
+        """Parsed documents of the file; multi-document files keep theirs in YAMLDocument rows"""
+        if self.document_count > 1:
+            return [document.parsed_data for document in self.documents.all()]
+        return [] if self.parsed_data is None else [self.parsed_data]
+
+    def assembled_parsed_data(self):
+        """Parsed content as one value, with ``document_N`` keys for multi-document files"""
+        if self.document_count > 1:
+            return {f"document_{document.index + 1}": document.parsed_data for document in self.documents.all()}
+        return self.parsed_data
+
+class YAMLDocument(models.Model):
+    """Model to store one document of a multi-document YAML file"""
+    # Looked up through unique_yaml_file_document_index, which leads with the file
+    yaml_file = models.ForeignKey(YAMLFile, on_delete=models.CASCADE, related_name='documents', db_index=False)
+    index = models.PositiveIntegerField(help_text="Zero-based position of the document in the file")
+    parsed_data = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True)
+
+    class Meta:
+        # Index order, so documents prefetched for many files come back without a sort
+        ordering = ['yaml_file', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['yaml_file', 'index'], name='unique_yaml_file_document_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.yaml_file.file_path} #{self.index + 1}"
+
 class Service(models.Model):
     """Model to store extracted service information from YAML files"""
-    yaml_file = models.ForeignKey(YAMLFile, on_delete=models.CASCADE, related_name='services')
+    # Looked up through unique_yaml_file_service_name, which leads with the file
+    yaml_file = models.ForeignKey(YAMLFile, on_delete=models.CASCADE, related_name='services', db_index=False)
     service_name = models.CharField(max_length=255)
-    dependent_services = models.JSONField(null=True, blank=True, help_text="List of dependent services")
-    dependent_infrastructure = models.JSONField(null=True, blank=True, help_text="List of dependent infrastructure")
+    dependent_services = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True, help_text="List of dependent services")
+    dependent_infrastructure = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True, help_text="List of dependent infrastructure")
     port = models.CharField(max_length=10, null=True, blank=True)
     protocol = models.CharField(max_length=20, null=True, blank=True)
-    additional_data = models.JSONField(null=True, blank=True, help_text="Additional service data")
+    additional_data = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True, help_text="Additional service data")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Services"
-        ordering = ['service_name']
+        constraints = [
+            models.UniqueConstraint(fields=['yaml_file', 'service_name'], name='unique_yaml_file_service_name'),
+        ]
+        indexes = [
+            # Catalog order (and its cursor) and lookups by name
+            models.Index(fields=['service_name', 'id'], name='service_name_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.service_name} - {self.yaml_file.file_path}"
+
+class ParseBatch(models.Model):
+    """Model to track a batch of repositories parsed together under one request budget"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    options = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, default=dict, blank=True, help_text="Batch options (concurrency, rate_limit, repository_concurrency)")
+    result = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True, help_text="Aggregate throughput once finished")
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = "Parse batches"
+
+    def __str__(self):
+        return f"Batch {self.pk} - {self.status}"
+
+    @property
+    def elapsed_seconds(self):
+        if not self.started_at:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+class ParseJob(models.Model):
+    """Model to track background repository parse jobs"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    repository = models.ForeignKey(Repository, on_delete=models.CASCADE, related_name='parse_jobs')
+    batch = models.ForeignKey(ParseBatch, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs',
+                              help_text="Batch the job is run by, instead of a job runner of its own")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    options = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, default=dict, blank=True, help_text="Parse options (concurrency, include, exclude, max_depth, full)")
+    processed_files = models.PositiveIntegerField(default=0)
+    total_files = models.PositiveIntegerField(null=True, blank=True, help_text="Unknown until the repository listing is complete")
+    result = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.repository} - {self.status}"
+
+    @property
+    def elapsed_seconds(self):
+        if not self.started_at:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+    @property
+    def files_per_second(self):
+        elapsed = self.elapsed_seconds
+        if not elapsed:
+            return None
+        return round(self.processed_files / elapsed, 2)
+
+class RepositoryDeletion(models.Model):
+    """Model to track background deletions of repositories too large to delete within a request"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # Cleared once the repository is gone; repository_name keeps what was deleted
+    repository = models.ForeignKey(Repository, on_delete=models.SET_NULL, null=True, blank=True, related_name='deletions')
+    repository_name = models.CharField(max_length=511)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    deleted_items = models.JSONField(encoder=ORJSONEncoder, decoder=ORJSONDecoder, null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.repository_name} - {self.status}"
@@ -0,0 +1,13 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ServiceCatalogPagination(CursorPagination):
+    """Cursor pagination for the service catalog, stable while services are added"""
+    ordering = ('service_name', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        self.page_size = settings.SERVICE_CATALOG_PAGE_SIZE
+        return super().get_page_size(request)
@@ -0,0 +1,99 @@
+"""
+Content-addressed cache of YAML parse and service extraction results
+
+Results are keyed by the SHA-256 of the file content, so unchanged files and
+templates vendored into many repositories are parsed and extracted only once.
+Recent results are kept in a bounded in-process LRU; older ones are rebuilt
+from any stored YAMLFile with the same digest and the service extracted from it.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .blobs import content_digest
+from .models import YAMLFile
+
+# (parsed documents, service_info)
+CachedParse = Tuple[List[Any], Optional[Dict[str, Any]]]
+
+
+class ParseCache:
+    """
+    Parse results keyed by content digest, shared across repositories
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        """
+        Args:
+            max_entries (int): Number of results kept in memory
+        """
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, CachedParse]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, digests: Iterable[str], max_documents: Optional[int] = None) -> Dict[str, CachedParse]:
+        """
+        Look up several digests at once.
+
+        Args:
+            digests (Iterable[str]): Content digests to look up
+            max_documents (int): Largest number of documents loaded from a stored file
+                (None for no limit); files with more are parsed again instead
+
+        Returns:
+            Dict[str, CachedParse]: (parsed documents, service_info) for every digest found
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for digest in set(digests):
+                if digest in self._entries:
+                    self._entries.move_to_end(digest)
+                    found[digest] = self._entries[digest]
+                else:
+                    missing.append(digest)
+
+        if missing:
+            stored = YAMLFile.objects.filter(blob__in=missing).filter(document_count__gt=0)
+            if max_documents is not None:
+                stored = stored.filter(document_count__lte=max_documents)
+            stored = stored.only('id', 'blob', 'parsed_data', 'document_count').prefetch_related('services', 'documents')
+            for yaml_file in stored:
+                if yaml_file.blob_id in found:
+                    continue
+                result = (yaml_file.parsed_documents(), self.stored_service_info(yaml_file))
+                found[yaml_file.blob_id] = result
+                self.set(yaml_file.blob_id, *result)
+        return found
+
+    def set(self, digest: str, documents: List[Any], service_info: Optional[Dict[str, Any]]):
+        """Remember the parsed documents and extraction result of a content digest"""
+        with self._lock:
+            self._entries[digest] = (documents, service_info)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def stored_service_info(yaml_file: YAMLFile) -> Dict[str, Any]:
+        """Rebuild extractor output from the service stored for a YAML file"""
+        services = sorted(yaml_file.services.all(), key=lambda s: s.updated_at, reverse=True)
+        if not services:
+            return {'service_name': {'value': None}}
+        service = services[0]
+        return {
+            'service_name': {'value': service.service_name},
+            'port': {'value': service.port} if service.port else None,
+            'protocol': {'value': service.protocol} if service.protocol else None,
+            'dependent_services': service.dependent_services or [],
+            'dependent_infrastructure': service.dependent_infrastructure or [],
+            'additional_data': service.additional_data or {}
+        }
+
+
+parse_cache = ParseCache()
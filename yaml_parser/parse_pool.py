@@ -0,0 +1,177 @@
+"""
+Process pool for the parse and extraction stage
+
+YAML parsing and service extraction are pure Python CPU work, so threads
+cannot run them on more than one core. When ``PARSE_WORKERS`` is set, the
+repository parser hands the files it has to parse to a pool of worker
+processes in chunks and stores the results as they come back; the fetcher
+and the database writer stay in the parent process.
+
+Workers only import this module's parsing dependencies (no Django), and
+every task carries the extraction rules so workers always extract with the
+rules of the parse that sent it.
+"""
+
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import yaml
+
+from .service_extractor import SpringBootServiceExtractor
+from .yaml_backend import DocumentStream
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a document stream
+_END = object()
+
+
+class ParseResult(NamedTuple):
+    """Picklable outcome of parsing one file"""
+    documents: List[Any]
+    service_info: Optional[Dict[str, Any]]
+    # YAML backend that parsed the file, None if the content is not valid YAML
+    backend: Optional[str]
+    # Time spent composing documents and running the extractor on them, which are interleaved
+    parse_seconds: float = 0.0
+    extract_seconds: float = 0.0
+
+
+def parse_and_extract(content: str, extractor: SpringBootServiceExtractor,
+                      stream: Optional[DocumentStream] = None, documents: Optional[List[Any]] = None) -> ParseResult:
+    """
+    Stream the documents of a file into the service extractor one at a time.
+
+    Args:
+        content (str): YAML content of the file
+        extractor (SpringBootServiceExtractor): Extractor to run over the documents
+        stream (DocumentStream): Documents of ``content`` (defaults to a new DocumentStream)
+        documents (List[Any]): Collection each document is appended to as it is parsed, e.g. a
+            repository_parser.DocumentSpool storing them without keeping them all (defaults to a new list)
+
+    Returns:
+        ParseResult: ``documents`` (kept for storage), the extracted service information
+        and the backend, or ([], None, None) if the content is not valid YAML
+    """
+    documents = [] if documents is None else documents
+    stream = stream or DocumentStream(content)
+    parse_seconds = 0.0
+
+    def collect():
+        nonlocal parse_seconds
+        iterator = iter(stream)
+        while True:
+            started = time.perf_counter()
+            try:
+                document = next(iterator, _END)
+            finally:
+                parse_seconds += time.perf_counter() - started
+            if document is _END:
+                return
+            documents.append(document)
+            yield document
+
+    started = time.perf_counter()
+    try:
+        service_info = extractor.extract_from_documents(collect())
+    except yaml.YAMLError as e:
+        logger.warning("Error parsing YAML: %s", e)
+        return ParseResult([], None, None, parse_seconds)
+    extract_seconds = time.perf_counter() - started - parse_seconds
+    return ParseResult(documents, service_info if documents else None, stream.backend, parse_seconds, extract_seconds)
+
+
+# Extractors of a worker process by rule set, compiled on first use
+_extractors: Dict[str, SpringBootServiceExtractor] = {}
+
+
+def parse_chunk(contents: List[str], extra_rules: List[Dict[str, Any]]) -> List[ParseResult]:
+    """Parse a chunk of files in a worker process"""
+    key = json.dumps(extra_rules, sort_keys=True, default=str)
+    extractor = _extractors.get(key)
+    if extractor is None:
+        extractor = _extractors[key] = SpringBootServiceExtractor(extra_rules)
+        # Workers already run in parallel; keep fuzzy matching single-threaded within each
+        extractor.workers = 1
+    return [parse_and_extract(content, extractor) for content in contents]
+
+
+class ParsePool:
+    """
+    Worker processes running parse_and_extract on chunks of files
+    """
+
+    def __init__(self, workers: int, chunk_size: int = 8):
+        """
+        Args:
+            workers (int): Number of worker processes
+            chunk_size (int): Largest number of files sent to a worker in one task
+        """
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        # Forking a threaded server process could copy held locks and open
+        # database connections into the workers, so start them fresh
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def map(self, contents: Iterable[str], extra_rules: List[Dict[str, Any]]) -> List[ParseResult]:
+        """
+        Parse and extract files on the worker processes.
+
+        Files are sent in chunks of up to ``chunk_size`` files, made smaller
+        when there are too few files to give every worker a chunk.
+
+        Args:
+            contents (Iterable[str]): YAML content of each file
+            extra_rules (List[Dict[str, Any]]): Extraction rules added to the defaults
+
+        Returns:
+            List[ParseResult]: One result per file, in the order given
+        """
+        contents = list(contents)
+        size = min(self.chunk_size, max(1, -(-len(contents) // self.workers)))
+        futures = [
+            self.executor.submit(parse_chunk, contents[start:start + size], extra_rules)
+            for start in range(0, len(contents), size)
+        ]
+        return [result for future in futures for result in future.result()]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pools: Dict[int, ParsePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_parse_pool(workers: int, chunk_size: int = 8) -> Optional[ParsePool]:
+    """
+    Return the process-wide parse pool with the given number of workers.
+
+    Args:
+        workers (int): Number of worker processes; 0 parses in the calling thread instead
+        chunk_size (int): See ParsePool, only used when the pool is created
+
+    Returns:
+        Optional[ParsePool]: The shared pool, or None when ``workers`` is 0
+    """
+    if workers <= 0:
+        return None
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ParsePool(workers, chunk_size)
+        return pool
+
+
+def discard_parse_pool(pool: ParsePool):
+    """Drop a pool whose workers died (BrokenProcessPool) so the next parse starts a new one"""
+    with _pools_lock:
+        if _pools.get(pool.workers) is pool:
+            del _pools[pool.workers]
+    pool.shutdown()
+
@@ -0,0 +1,55 @@
+"""
+REST framework renderer and parser built on orjson
+
+settings.py selects them in place of JSONRenderer and JSONParser when
+orjson is installed. Responses are the same compact UTF-8 JSON that
+JSONRenderer writes with the default COMPACT_JSON and UNICODE_JSON settings;
+only floats in exponent notation are spelled differently (1e16, not 1e+16).
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .json_backend import RENDER_OPTIONS, orjson
+
+
+def render_json(data) -> bytes:
+    """Encode data outside a DRF response with the configured renderer (ORJSONRenderer when orjson is installed)"""
+    return api_settings.DEFAULT_RENDERER_CLASSES[0]().render(data)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer writing with orjson.
+
+    Output matches JSONRenderer's compact UTF-8 form; indented output
+    (``Accept: application/json; indent=4``) and values orjson rejects are
+    left to JSONRenderer.
+    """
+    _encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is None:
+            try:
+                ret = orjson.dumps(data, default=self._encoder.default, option=RENDER_OPTIONS)
+            except orjson.JSONEncodeError:
+                pass
+            else:
+                # JSONRenderer escapes the Unicode line and paragraph separators for JavaScript; do the same
+                return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser reading with orjson"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
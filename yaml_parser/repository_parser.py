@@ -0,0 +1,793 @@
+"""
+Repository parsing pipeline
+
+Lists, fetches, parses and stores the YAML files of a Bitbucket repository.
+When a previous commit has been recorded, only the YAML files changed since
+that commit are fetched, parsed and extracted again; files whose content was
+seen before reuse the cached parse and extraction results.
+"""
+
+import logging
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .bitbucket_reader import BitbucketYAMLReader
+from .caching import bump_generation
+from .extraction_rules import configured_rules
+from .metrics import PARSE_CACHE, PROCESSED_FILES, STAGE_SECONDS
+from .models import ContentBlob, Repository, Service, YAMLDocument, YAMLFile
+from .parse_cache import content_digest, parse_cache
+from .parse_pool import ParseResult, discard_parse_pool, get_parse_pool, parse_and_extract
+from .service_extractor import SpringBootServiceExtractor
+from .yaml_backend import assemble_documents
+
+logger = logging.getLogger(__name__)
+
+
+def service_fields(service_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Map extractor output to Service model fields (other than the service name)"""
+    return {
+        'dependent_services': service_info.get('dependent_services', []),
+        'dependent_infrastructure': service_info.get('dependent_infrastructure', []),
+        'port': service_info.get('port', {}).get('value') if service_info.get('port') else None,
+        'protocol': service_info.get('protocol', {}).get('value') if service_info.get('protocol') else None,
+        'additional_data': service_info.get('additional_data', {})
+    }
+
+
+def save_service(yaml_file: YAMLFile, service_name: str, service_info: Dict[str, Any]) -> Service:
+    """Create or update the service extracted from a YAML file"""
+    service, _ = Service.objects.update_or_create(
+        yaml_file=yaml_file,
+        service_name=service_name,
+        defaults=service_fields(service_info)
+    )
+    return service
+
+
+def save_repository(workspace: str, repository: str, access_token: str) -> Repository:
+    """Create a repository or update the access token of an existing one"""
+    repo_obj, created = Repository.objects.get_or_create(
+        workspace=workspace,
+        repository=repository,
+        defaults={'access_token': access_token}
+    )
+    if not created:
+        repo_obj.access_token = access_token
+        repo_obj.save()
+    return repo_obj
+
+
+def prune_blobs(digests: Iterable[str]) -> int:
+    """Delete the content blobs among ``digests`` that no YAML file points to any more"""
+    digests = set(digests)
+    if not digests:
+        return 0
+    return ContentBlob.objects.filter(digest__in=digests, yaml_files__isnull=True).delete()[0]
+
+
+def repository_counts(repository_id: int) -> Dict[str, int]:
+    """Count a repository's files and services in one query"""
+    return YAMLFile.objects.filter(repository_id=repository_id).aggregate(
+        yaml_files=Count('id', distinct=True),
+        services=Count('services')
+    )
+
+
+def delete_repository(repository_id: int) -> Dict[str, int]:
+    """
+    Delete a repository and everything stored for it in one transaction.
+
+    Services and documents go first, each with a single DELETE, so Django's
+    cascade only has to collect the ids of the files and finds nothing left
+    pointing at them; blobs no other file uses are pruned afterwards.
+    Deleting the repository changes catalog_version, so cached catalog
+    responses are not served again.
+
+    Args:
+        repository_id (int): Repository to delete
+
+    Returns:
+        Dict[str, int]: Number of deleted repositories (0 if it was already gone), files and services
+    """
+    def delete(queryset):
+        return queryset.delete()[1].get(queryset.model._meta.label, 0)
+
+    yaml_files = YAMLFile.objects.filter(repository_id=repository_id)
+    with transaction.atomic():
+        digests = set(yaml_files.values_list('blob_id', flat=True).distinct())
+        services = delete(Service.objects.filter(yaml_file__repository_id=repository_id))
+        delete(YAMLDocument.objects.filter(yaml_file__repository_id=repository_id))
+        files = delete(yaml_files.only('pk'))
+        repository = delete(Repository.objects.filter(pk=repository_id))
+        prune_blobs(digests)
+    return {'repository': repository, 'yaml_files': files, 'services': services}
+
+
+class DocumentSpool:
+    """
+    The documents of one file, collected as they are parsed without keeping more than ``limit``.
+
+    Once a file has more than ``limit`` documents they are no longer held
+    together. With a ``parser`` to store them for, the file's YAMLFile row
+    and its documents so far are written at that point, and later documents
+    every ``write_batch_size`` documents, in one transaction ended by close().
+    Without one, documents past the limit are only counted.
+    """
+
+    def __init__(self, limit: int, parser: Optional['RepositoryParser'] = None, file_path: Optional[str] = None,
+                 content: Optional[str] = None, digest: Optional[str] = None):
+        """
+        Args:
+            limit (int): Largest number of documents kept in memory (at least 1)
+            parser (RepositoryParser): Parser whose repository the file is stored under, if it is to be stored
+            file_path (str): Path of the file
+            content (str): Content of the file, stored as its blob
+            digest (str): Digest of ``content``
+        """
+        self.limit = max(1, limit)
+        self.parser = parser
+        self.file_path = file_path
+        self.content = content
+        self.digest = digest
+        self.documents = []
+        self.count = 0
+        self.yaml_file_id = None
+        self.atomic = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the file had more documents than were kept"""
+        return self.count > self.limit
+
+    @property
+    def stored(self) -> bool:
+        """Whether the documents are being written as they are parsed"""
+        return self.yaml_file_id is not None
+
+    def append(self, document: Any):
+        self.count += 1
+        if self.count <= self.limit:
+            self.documents.append(document)
+        elif self.parser is None:
+            self.documents = []
+        else:
+            self.documents.append(document)
+            if not self.stored:
+                self.open()
+            if len(self.documents) >= self.parser.write_batch_size:
+                self.write_documents()
+
+    def open(self):
+        """Start the file's transaction and replace its stored row and documents"""
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        ContentBlob.objects.bulk_create([ContentBlob.for_content(self.content, self.digest)], ignore_conflicts=True)
+        yaml_file, _ = YAMLFile.objects.update_or_create(
+            repository=self.parser.repository, file_path=self.file_path,
+            # The document count is set once the whole file has been parsed
+            defaults={'blob_id': self.digest, 'parsed_data': None, 'document_count': 0}
+        )
+        YAMLDocument.objects.filter(yaml_file_id=yaml_file.id).delete()
+        self.yaml_file_id = yaml_file.id
+
+    def write_documents(self):
+        """Write the documents held since the last write"""
+        start = self.count - len(self.documents)
+        YAMLDocument.objects.bulk_create([
+            YAMLDocument(yaml_file_id=self.yaml_file_id, index=start + offset, parsed_data=document)
+            for offset, document in enumerate(self.documents)
+        ])
+        self.documents = []
+
+    def close(self):
+        """Write the remaining documents and commit the file's transaction"""
+        if self.atomic is not None:
+            atomic, self.atomic = self.atomic, None
+            try:
+                self.write_documents()
+            except BaseException:
+                transaction.set_rollback(True)
+                atomic.__exit__(None, None, None)
+                raise
+            atomic.__exit__(None, None, None)
+
+    def discard(self):
+        """Roll back whatever was written for the file"""
+        if self.atomic is not None:
+            atomic, self.atomic = self.atomic, None
+            transaction.set_rollback(True)
+            atomic.__exit__(None, None, None)
+        self.documents = []
+
+
+def summary_message(result: Dict[str, Any], file_count: Optional[int] = None,
+                    service_count: Optional[int] = None) -> str:
+    """Describe the outcome of RepositoryParser.parse for API responses (counts default to the result's lists)"""
+    file_count = len(result['files']) if file_count is None else file_count
+    service_count = len(result['services']) if service_count is None else service_count
+    if result['mode'] == 'incremental':
+        return (f"Re-parsed {file_count} changed YAML files since commit {result['previous_commit'][:12]}, "
+                f"removed {len(result['deleted_files'])} and extracted {service_count} services")
+    if not file_count:
+        return 'No YAML files found in the repository'
+    return f"Successfully parsed {file_count} YAML files and extracted {service_count} services"
+
+
+class RepositoryParser:
+    """
+    Parses the YAML files of one repository into YAMLFile and Service rows
+    """
+
+    def __init__(self, repository: Repository, reader: BitbucketYAMLReader, concurrency: int = 8,
+                 rate_limit: Optional[float] = None, listing_concurrency: int = 4,
+                 max_depth: Optional[int] = None, include: Optional[List[str]] = None,
+                 exclude: Optional[List[str]] = None, batch_size: int = 50, write_batch_size: int = 500,
+                 parse_workers: int = 0, parse_chunk_size: int = 8, spool_documents: int = 100,
+                 progress: Optional[Callable[[int, Optional[int]], None]] = None):
+        """
+        Initialize the parser.
+
+        Args:
+            repository (Repository): Repository the results are stored under
+            reader (BitbucketYAMLReader): Reader for the same repository (an AsyncBitbucketYAMLReader for aparse)
+            concurrency (int): Maximum number of file downloads in flight
+            rate_limit (float): Maximum requests per second against the API host (None disables)
+            listing_concurrency (int): Maximum number of listing requests in flight
+            max_depth (int): Deepest directory level scanned (None for unlimited)
+            include (List[str]): Glob patterns a file path must match
+            exclude (List[str]): Glob patterns for files and directories to skip
+            batch_size (int): Number of fetched files looked up in the parse cache together
+            write_batch_size (int): Number of changed files (counting each document of a
+                multi-document file) written to the database together
+            parse_workers (int): Worker processes parsing and extracting files (0 parses in this thread)
+            parse_chunk_size (int): Largest number of files sent to a parse worker at once
+            spool_documents (int): Documents of a file parsed in this thread kept in memory; files
+                with more are written to the database while they are parsed (see DocumentSpool)
+            progress (Callable): Called with (processed files, total files or None if still listing)
+                after each file is processed
+        """
+        self.repository = repository
+        self.reader = reader
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.listing_concurrency = listing_concurrency
+        self.max_depth = max_depth
+        self.include = include
+        self.exclude = exclude
+        self.extra_rules = configured_rules()
+        self.service_extractor = SpringBootServiceExtractor(self.extra_rules)
+        self.parse_workers = parse_workers
+        self.parse_chunk_size = parse_chunk_size
+        self.spool_documents = max(1, spool_documents)
+        self.batch_size = max(1, batch_size)
+        self.write_batch_size = max(1, write_batch_size)
+        self.pending_writes = []
+        self.pending_documents = 0
+        # Digests of content replaced by pending writes, whose blobs may be unused afterwards
+        self.replaced_digests = set()
+        self.progress = progress
+        self.use_cache = True
+        self.cache_hits = 0
+        self.yaml_backends = {}
+        self.processed_files = 0
+        self.total_files = None
+        # Paths fetched (or attempted) by this parse, and those whose download failed
+        self.fetched_paths = set()
+        self.failed_files = []
+        self.summary = None
+
+    def parse(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Parse the repository and store the results.
+
+        Args:
+            full (bool): Re-process every file even if a previous commit was recorded, re-running
+                extraction instead of reusing cached results (e.g. after the extraction rules changed)
+
+        Returns:
+            Dict[str, Any]: The parse mode ('full' or 'incremental'), the commit parsed,
+            the parsed files, the extracted services, the deleted file paths, the number of
+            cache hits and the number of files parsed by each YAML backend
+        """
+        parsed_files, extracted_services = self.collect_results(self.iter_parse(full))
+        return {**self.summary, 'files': parsed_files, 'services': extracted_services}
+
+    def iter_parse(self, full: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Parse the repository, yielding each file's result once it is processed.
+
+        Files are processed ``batch_size`` at a time, so results arrive in
+        batches, and their rows are written every ``write_batch_size`` files:
+        a yielded file may not be in the database until a later flush. With
+        both sizes set to 1 (see jobs.build_parser's ``streaming``) every file
+        is yielded as soon as it is fetched and only once it is stored.
+
+        Once exhausted, ``self.summary`` holds the parse mode, commits, deleted
+        file paths and cache and backend counters (see parse).
+
+        Args:
+            full (bool): See parse
+
+        Yields:
+            Dict[str, Any]: Per-file ``file_path``, ``parsed_data`` and extracted ``service`` (or None)
+        """
+        head = self.reader.get_head_commit()
+        since = self.repository.last_commit
+        changes = None
+        if self.start(head, full):
+            changes = ([], []) if head == since else self.changed_paths(since, head)
+
+        if changes is None:
+            mode = 'full'
+            file_paths, deleted_paths = self.reader.iter_yaml_files(
+                max_depth=self.max_depth,
+                include=self.include,
+                exclude=self.exclude,
+                max_workers=self.listing_concurrency
+            ), []
+        else:
+            mode = 'incremental'
+            file_paths, deleted_paths = changes
+            self.total_files = len(file_paths)
+
+        fetched_files = self.reader.iter_files_content(
+            file_paths,
+            max_workers=self.concurrency,
+            rate_limit=self.rate_limit
+        )
+        yield from self.iter_processed_files(fetched_files)
+        if mode == 'full':
+            deleted_paths = self.unlisted_paths()
+        self.finish(mode, head, since, deleted_paths)
+
+    async def aparse(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Parse the repository with an AsyncBitbucketYAMLReader (see parse).
+
+        Downloads run on the event loop; parsing and database writes run in
+        Django's thread-sensitive executor.
+        """
+        parsed_files, extracted_services = self.collect_results([result async for result in self.aiter_parse(full)])
+        return {**self.summary, 'files': parsed_files, 'services': extracted_services}
+
+    async def aiter_parse(self, full: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Parse the repository with an AsyncBitbucketYAMLReader, yielding each file's result once processed (see iter_parse).
+
+        Args:
+            full (bool): See parse
+
+        Yields:
+            Dict[str, Any]: Per-file ``file_path``, ``parsed_data`` and extracted ``service`` (or None)
+        """
+        head = await self.reader.aget_head_commit()
+        since = self.repository.last_commit
+        changes = None
+        if self.start(head, full):
+            changes = ([], []) if head == since else self.diff_paths(await self.reader.aget_diffstat(since, head))
+
+        if changes is None:
+            mode = 'full'
+            file_paths, deleted_paths = self.reader.aiter_yaml_files(
+                max_depth=self.max_depth,
+                include=self.include,
+                exclude=self.exclude,
+                max_workers=self.listing_concurrency
+            ), []
+        else:
+            mode = 'incremental'
+            file_paths, deleted_paths = changes
+            self.total_files = len(file_paths)
+
+        fetched_files = self.reader.aiter_files_content(
+            file_paths,
+            max_workers=self.concurrency,
+            rate_limit=self.rate_limit
+        )
+        process_batch = sync_to_async(lambda batch: list(self.process_batch(batch)))
+        batch = []
+        async for file_path, content in fetched_files:
+            if not self.record_fetch(file_path, content):
+                continue
+            batch.append((file_path, content))
+            if len(batch) >= self.batch_size:
+                for result in await process_batch(batch):
+                    yield result
+                batch = []
+        if batch:
+            for result in await process_batch(batch):
+                yield result
+        await sync_to_async(self.flush_writes)()
+        if mode == 'full':
+            deleted_paths = await sync_to_async(self.unlisted_paths)()
+        await sync_to_async(self.finish)(mode, head, since, deleted_paths)
+
+    def start(self, head: Optional[str], full: bool) -> bool:
+        """Pin the reader to the head commit; returns True if only changes since the last parse are needed"""
+        self.use_cache = not full
+        if head:
+            # Read every file at the same commit so the snapshot is consistent
+            self.reader.ref = head
+        return bool(head and self.repository.last_commit and not full)
+
+    def finish(self, mode: str, head: Optional[str], since: Optional[str], deleted_paths: List[str]):
+        """
+        Drop deleted files, record the commit parsed and fill in ``self.summary``.
+
+        The commit is only recorded when every file was fetched and the whole
+        tree listed; otherwise the next incremental parse diffs from the
+        previous commit again, so the changes missed this time are retried.
+        """
+        deleted_files = self.delete_files(deleted_paths)
+        self.total_files = self.processed_files
+
+        if head and not self.failed_files and not self.reader.listing_errors:
+            self.repository.last_commit = head
+            self.repository.save(update_fields=['last_commit', 'updated_at'])
+        elif head:
+            logger.warning("Keeping last commit of %s: %d files and %d listing pages could not be fetched",
+                           self.repository, len(self.failed_files), self.reader.listing_errors)
+        bump_generation(self.repository)
+
+        self.summary = {
+            'mode': mode,
+            'commit': head,
+            'previous_commit': since or None,
+            'deleted_files': deleted_files,
+            'failed_files': self.failed_files,
+            'cache_hits': self.cache_hits,
+            'yaml_backends': self.yaml_backends
+        }
+
+    def unlisted_paths(self) -> List[str]:
+        """
+        Stored paths a complete full walk did not list, i.e. files removed upstream.
+
+        Only paths the walk's filters select are considered, so narrowing
+        ``include`` or ``max_depth`` does not drop files parsed earlier, and
+        nothing is returned when a listing page failed.
+        """
+        if self.reader.listing_errors:
+            return []
+        stored = YAMLFile.objects.filter(repository=self.repository).values_list('file_path', flat=True)
+        return [
+            path for path in stored.iterator()
+            if path not in self.fetched_paths
+            and self.reader.path_selected(path, self.max_depth, self.include, self.exclude)
+        ]
+
+    def changed_paths(self, since: str, until: str) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Work out which YAML files to re-process and which to drop between two commits.
+
+        Args:
+            since (str): Last commit parsed
+            until (str): Commit being parsed now
+
+        Returns:
+            Optional[Tuple[List[str], List[str]]]: (added or modified paths, removed paths),
+            or None if the diff is unavailable and a full parse is needed
+        """
+        return self.diff_paths(self.reader.get_diffstat(since, until))
+
+    def diff_paths(self, diffstat: Optional[List[Dict[str, Any]]]) -> Optional[Tuple[List[str], List[str]]]:
+        """Select the paths to re-process and to drop from diffstat entries (see changed_paths)"""
+        if diffstat is None:
+            return None
+
+        changed, removed = [], []
+        for entry in diffstat:
+            old_path = (entry.get('old') or {}).get('path')
+            new_path = (entry.get('new') or {}).get('path')
+            # Renames drop the old path and re-process the new one
+            if old_path and old_path != new_path:
+                removed.append(old_path)
+            if new_path and self.reader.path_selected(new_path, self.max_depth, self.include, self.exclude):
+                changed.append(new_path)
+        return changed, [path for path in removed if path not in changed]
+
+    def process_files(self, fetched_files: Iterable[Tuple[str, Optional[str]]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Parse, extract and store fetched files.
+
+        Args:
+            fetched_files: (file_path, content) pairs; files without content are skipped
+
+        Returns:
+            Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: Parsed file summaries and extracted services
+        """
+        return self.collect_results(self.iter_processed_files(fetched_files))
+
+    def collect_results(self, results: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Gather per-file results into parsed file summaries and extracted services"""
+        parsed_files = []
+        extracted_services = []
+        for result in results:
+            if result['service']:
+                extracted_services.append(result['service'])
+            parsed_files.append({
+                'file_path': result['file_path'],
+                'parsed_data': result['parsed_data'],
+                'services_extracted': 0
+            })
+        if parsed_files:
+            parsed_files[-1]['services_extracted'] = len(extracted_services)
+        return parsed_files, extracted_services
+
+    def iter_processed_files(self, fetched_files: Iterable[Tuple[str, Optional[str]]]) -> Iterator[Dict[str, Any]]:
+        """
+        Parse, extract and store fetched files in batches as they arrive.
+
+        Cache lookups are made per ``batch_size`` files; the resulting rows are
+        queued and written in bulk every ``write_batch_size`` files and once
+        the input is exhausted. The documents of each file are streamed into
+        the extractor one at a time as they are parsed; past ``spool_documents``
+        they are written to the database as they come instead of being queued
+        (see DocumentSpool).
+
+        Args:
+            fetched_files: (file_path, content) pairs, possibly still being fetched
+
+        Yields:
+            Dict[str, Any]: Per-file ``file_path``, ``parsed_data`` and extracted ``service`` (or None)
+        """
+        batch = []
+        for file_path, content in fetched_files:
+            if not self.record_fetch(file_path, content):
+                continue
+            batch.append((file_path, content))
+            if len(batch) >= self.batch_size:
+                yield from self.process_batch(batch)
+                batch = []
+        if batch:
+            yield from self.process_batch(batch)
+        self.flush_writes()
+
+    def record_fetch(self, file_path: str, content: Optional[str]) -> bool:
+        """Note a fetched path and whether its download failed; returns True if there is content to process"""
+        self.fetched_paths.add(file_path)
+        if content is None:
+            self.failed_files.append(file_path)
+        return bool(content)
+
+    def process_batch(self, batch: List[Tuple[str, str]]) -> Iterator[Dict[str, Any]]:
+        """Parse and extract one batch of fetched files, queuing the rows that changed"""
+        digests = {path: content_digest(content) for path, content in batch}
+        cached = parse_cache.get_many(digests.values(), self.spool_documents) if self.use_cache else {}
+        if self.use_cache:
+            PARSE_CACHE.inc(len(cached), result='hit')
+            PARSE_CACHE.inc(len(set(digests.values())) - len(cached), result='miss')
+        stored = {
+            file_path: (digest, document_count)
+            for file_path, digest, document_count in (
+                YAMLFile.objects
+                .filter(repository=self.repository, file_path__in=list(digests))
+                .values_list('file_path', 'blob_id', 'document_count')
+            )
+        }
+        # Content not seen before is parsed once per batch, on the parse workers if configured
+        misses = {}
+        for file_path, content in batch:
+            if digests[file_path] not in cached:
+                misses.setdefault(digests[file_path], content)
+        parsed = dict(zip(misses, self.parse_contents(list(misses.values())) or []))
+
+        for file_path, content in batch:
+            digest = digests[file_path]
+            # Files whose stored content is identical need no writes, unless extraction was re-run
+            stored_digest, stored_documents = stored.get(file_path, (None, 0))
+            write = not self.use_cache or stored_digest != digest
+            if digest in cached:
+                # Unchanged or duplicated content: reuse the earlier parse and extraction
+                documents, service_info = cached[digest]
+                self.cache_hits += 1
+            else:
+                if digest in parsed:
+                    documents, service_info = parsed[digest]
+                else:
+                    spool = DocumentSpool(self.spool_documents, self if write else None, file_path, content, digest)
+                    documents, service_info = self.parse_documents(content, spool)
+                if not isinstance(documents, DocumentSpool):
+                    cached[digest] = (documents, service_info)
+                    parse_cache.set(digest, documents, service_info)
+
+            has_service = bool(documents and service_info and service_info.get('service_name')
+                               and service_info['service_name'].get('value'))
+
+            if write:
+                if stored_digest and stored_digest != digest:
+                    self.replaced_digests.add(stored_digest)
+                self.pending_writes.append((file_path, content, digest, documents,
+                                            service_info if has_service else None, stored_documents > 1))
+                if isinstance(documents, DocumentSpool):
+                    # Its documents are written; store the file and its service in the same transaction
+                    try:
+                        self.flush_writes()
+                    except BaseException:
+                        documents.discard()
+                        raise
+                    documents.close()
+                elif len(documents) > 1:
+                    self.pending_documents += len(documents)
+                if len(self.pending_writes) + self.pending_documents >= self.write_batch_size:
+                    self.flush_writes()
+
+            service = None
+            if has_service:
+                fields = service_fields(service_info)
+                service = {
+                    'service_name': service_info['service_name']['value'],
+                    'port': fields['port'],
+                    'protocol': fields['protocol'],
+                    'dependent_services': fields['dependent_services'],
+                    'dependent_infrastructure': fields['dependent_infrastructure'],
+                    'extraction_confidence': service_info['service_name'].get('confidence', 0)
+                }
+
+            self.processed_files += 1
+            PROCESSED_FILES.inc()
+            if self.progress:
+                self.progress(self.processed_files, self.total_files)
+            # Files with more documents than are kept in memory are only readable from the database
+            parsed_data = None if isinstance(documents, DocumentSpool) else assemble_documents(documents)
+            yield {'file_path': file_path, 'parsed_data': parsed_data, 'service': service}
+
+    def parse_contents(self, contents: List[str]) -> Optional[List[Tuple[List[Any], Optional[Dict[str, Any]]]]]:
+        """
+        Parse and extract several files on the parse worker processes when ``parse_workers`` is set.
+
+        Workers send every document of a file back at once; files parsed in
+        this thread instead go through parse_documents one at a time.
+
+        Returns:
+            Optional[List[Tuple[List[Any], Optional[Dict[str, Any]]]]]: (documents, service information)
+            per file, in the order given, or None if the files are to be parsed in this thread
+        """
+        pool = get_parse_pool(self.parse_workers, self.parse_chunk_size) if len(contents) > 1 else None
+        if pool is None:
+            return None
+        try:
+            results = pool.map(contents, self.extra_rules)
+        except BrokenProcessPool:
+            # A worker died; start a new pool next time and parse this batch here
+            discard_parse_pool(pool)
+            return None
+        return [self.record_result(result) for result in results]
+
+    def parse_documents(self, content: str, spool: DocumentSpool) -> Tuple[List[Any], Optional[Dict[str, Any]]]:
+        """
+        Stream the documents of a file into the service extractor one at a time.
+
+        Args:
+            content (str): YAML content of the file
+            spool (DocumentSpool): Collects the documents as they are parsed
+
+        Returns:
+            Tuple[List[Any], Optional[Dict[str, Any]]]: The parsed documents and the extracted service
+            information, or ([], None) if the content is not valid YAML. The documents are the spool
+            itself when it had to write or drop some of them, and a list otherwise
+        """
+        try:
+            result = parse_and_extract(content, self.service_extractor, self.reader.yaml_documents(content), spool)
+        except BaseException:
+            spool.discard()
+            raise
+        documents, service_info = self.record_result(result)
+        if documents is not spool:
+            # Invalid YAML: nothing of the file is kept
+            spool.discard()
+            return documents, service_info
+        return (spool if spool.spilled else spool.documents), service_info
+
+    def record_result(self, result: ParseResult) -> Tuple[List[Any], Optional[Dict[str, Any]]]:
+        """Record the parse and extract timings and the YAML backend of a file, then drop them from the result"""
+        STAGE_SECONDS.observe(result.parse_seconds, stage='parse')
+        STAGE_SECONDS.observe(result.extract_seconds, stage='extract')
+        if result.backend:
+            self.yaml_backends[result.backend] = self.yaml_backends.get(result.backend, 0) + 1
+        return result.documents, result.service_info
+
+    def flush_writes(self):
+        """
+        Upsert the queued YAML files, documents and services in one transaction.
+
+        Uses a fixed number of queries whatever the batch size: one insert of
+        new content blobs, one upsert of the files, one lookup of their ids, one
+        upsert of the services and one delete of services that are no longer
+        extracted from those files. Files that have or had several documents add
+        one delete and one insert of their document rows, and files whose content
+        changed one delete of the blobs nothing points to any more.
+        """
+        rows, self.pending_writes = self.pending_writes, []
+        replaced_digests, self.replaced_digests = self.replaced_digests, set()
+        self.pending_documents = 0
+        if not rows:
+            return
+
+        with STAGE_SECONDS.time(stage='db_write'), transaction.atomic():
+            # Content already stored for another file or repository is kept as it is
+            blobs = {digest: ContentBlob.for_content(content, digest) for _, content, digest, _, _, _ in rows}
+            ContentBlob.objects.bulk_create(list(blobs.values()), ignore_conflicts=True)
+            YAMLFile.objects.bulk_create(
+                [
+                    YAMLFile(repository=self.repository, file_path=file_path, blob_id=digest,
+                             document_count=len(documents),
+                             # Multi-document files keep their documents in YAMLDocument rows
+                             parsed_data=documents[0] if len(documents) == 1 else None)
+                    for file_path, _, digest, documents, _, _ in rows
+                ],
+                update_conflicts=True,
+                unique_fields=['repository', 'file_path'],
+                update_fields=['blob', 'parsed_data', 'document_count']
+            )
+            # Upserts do not return primary keys for updated rows
+            file_ids = dict(
+                YAMLFile.objects
+                .filter(repository=self.repository, file_path__in=[row[0] for row in rows])
+                .values_list('file_path', 'id')
+            )
+
+            # The documents of spooled files were written while they were parsed
+            replaced = [file_ids[row[0]] for row in rows
+                        if not isinstance(row[3], DocumentSpool) and (len(row[3]) > 1 or row[5])]
+            if replaced:
+                YAMLDocument.objects.filter(yaml_file_id__in=replaced).delete()
+                YAMLDocument.objects.bulk_create([
+                    YAMLDocument(yaml_file_id=file_ids[file_path], index=index, parsed_data=document)
+                    for file_path, _, _, documents, _, _ in rows
+                    if not isinstance(documents, DocumentSpool) and len(documents) > 1
+                    for index, document in enumerate(documents)
+                ])
+
+            services = []
+            stale = Q()
+            for file_path, _, _, _, service_info, _ in rows:
+                yaml_file_id = file_ids[file_path]
+                if service_info:
+                    service_name = service_info['service_name']['value']
+                    services.append(Service(yaml_file_id=yaml_file_id, service_name=service_name,
+                                            **service_fields(service_info)))
+                    stale |= Q(yaml_file_id=yaml_file_id) & ~Q(service_name=service_name)
+                else:
+                    stale |= Q(yaml_file_id=yaml_file_id)
+
+            if services:
+                Service.objects.bulk_create(
+                    services,
+                    update_conflicts=True,
+                    unique_fields=['yaml_file', 'service_name'],
+                    update_fields=['dependent_services', 'dependent_infrastructure', 'port', 'protocol',
+                                   'additional_data', 'updated_at']
+                )
+            Service.objects.filter(stale).delete()
+            prune_blobs(replaced_digests)
+            bump_generation(self.repository)
+
+    def delete_files(self, file_paths: List[str]) -> List[str]:
+        """
+        Delete stored files (and, by cascade, their services) that no longer exist.
+
+        Args:
+            file_paths (List[str]): Paths removed from the repository
+
+        Returns:
+            List[str]: Paths that had stored rows and were deleted
+        """
+        if not file_paths:
+            return []
+        yaml_files = YAMLFile.objects.filter(repository=self.repository, file_path__in=file_paths)
+        stored = dict(yaml_files.values_list('file_path', 'blob_id'))
+        if stored:
+            with transaction.atomic():
+                yaml_files.delete()
+                prune_blobs(stored.values())
+            bump_generation(self.repository)
+        return list(stored)
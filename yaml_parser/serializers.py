@@ -1,5 +1,8 @@
+from datetime import datetime
+
 from rest_framework import serializers
-from .models import Repository, YAMLFile, Service
+from .blobs import decompress
+from .models import Repository, YAMLFile, YAMLDocument, Service, ParseBatch, ParseJob, RepositoryDeletion
 
 class RepositorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,11 +12,19 @@ class RepositorySerializer(serializers.ModelSerializer):
 
 class YAMLFileSerializer(serializers.ModelSerializer):
     repository_info = RepositorySerializer(source='repository', read_only=True)
+    parsed_data = serializers.JSONField(source='assembled_parsed_data', read_only=True)
     
     class Meta:
         model = YAMLFile
-        fields = ['id', 'repository', 'repository_info', 'file_path', 'content', 'parsed_data', 'created_at']
-        read_only_fields = ['id', 'content', 'parsed_data', 'created_at']
+        fields = ['id', 'repository', 'repository_info', 'file_path', 'content', 'parsed_data', 'document_count', 'created_at']
+        read_only_fields = ['id', 'content', 'parsed_data', 'document_count', 'created_at']
+
+    def get_fields(self):
+        # Raw content lives in a separate blob and is only loaded when the request asks for it
+        fields = super().get_fields()
+        if not self.context.get('include_content'):
+            fields.pop('content')
+        return fields
 
 class RepositoryCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -37,4 +48,213 @@ class ServiceSerializer(serializers.ModelSerializer):
                 'workspace': obj.yaml_file.repository.workspace,
                 'repository': obj.yaml_file.repository.repository
             }
-        return None 
\ No newline at end of file
+        return None 
+
+class SparseFieldsMixin:
+    """Lets callers pick a subset of the serializer's fields with ``fields=[...]``"""
+    default_fields = None
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = fields or self.default_fields
+        if selected is not None:
+            self.check_fields(selected)
+            for name in set(self.fields) - set(selected):
+                self.fields.pop(name)
+
+    @classmethod
+    def check_fields(cls, fields):
+        """Raise a ValidationError naming any requested field the serializer does not have"""
+        unknown = set(fields) - set(cls.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+
+class ServiceCatalogSerializer(SparseFieldsMixin, ServiceSerializer):
+    """Service catalog entries; file content is only included when yaml_file_info is asked for"""
+    file_path = serializers.CharField(source='yaml_file.file_path', read_only=True)
+    default_fields = ['id', 'service_name', 'port', 'protocol', 'dependent_services', 'dependent_infrastructure',
+                      'additional_data', 'yaml_file', 'file_path', 'repository_info', 'created_at', 'updated_at']
+
+    class Meta(ServiceSerializer.Meta):
+        fields = ServiceSerializer.Meta.fields + ['file_path']
+
+class FlatSerializer:
+    """
+    Read-only serializer for large lists that builds plain dicts from ``values()`` rows,
+    skipping model instances and DRF's per-field serialization. The output matches the
+    ModelSerializer it stands in for, field order included.
+    """
+    serializer_class = None
+    # Output field: values() lookup, or a dict of lookups for a nested object
+    lookups = {}
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, fields=None):
+        selected = fields or getattr(self.serializer_class, 'default_fields', None) or self.lookups
+        self.fields = [name for name in self.serializer_class.Meta.fields if name in selected and name in self.lookups]
+
+    def values(self, queryset, *extra):
+        """The values() queryset of the selected fields, plus any ``extra`` lookups (e.g. the ordering)"""
+        lookups = dict.fromkeys(extra)
+        for name in self.fields:
+            lookup = self.lookups[name]
+            lookups.update(dict.fromkeys(lookup.values() if isinstance(lookup, dict) else [lookup]))
+        return queryset.prefetch_related(None).values(*lookups)
+
+    def value(self, value):
+        return self.datetime_field.to_representation(value) if isinstance(value, datetime) else value
+
+    def to_representation(self, row):
+        data = {}
+        for name in self.fields:
+            lookup = self.lookups[name]
+            if isinstance(lookup, dict):
+                data[name] = {key: self.value(row[nested]) for key, nested in lookup.items()}
+            else:
+                data[name] = self.value(row[lookup])
+        return data
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+class FlatYAMLFileSerializer(FlatSerializer):
+    """YAMLFileSerializer output; documents of multi-document files are read in one extra query"""
+    serializer_class = YAMLFileSerializer
+    lookups = {
+        'id': 'id',
+        'repository': 'repository_id',
+        'repository_info': {name: f'repository__{name}' for name in RepositorySerializer.Meta.fields},
+        'file_path': 'file_path',
+        'content': 'blob__data',
+        'parsed_data': 'parsed_data',
+        'document_count': 'document_count',
+        'created_at': 'created_at',
+    }
+
+    def __init__(self, include_content=False):
+        super().__init__([name for name in self.lookups if include_content or name != 'content'])
+
+    def values(self, queryset, *extra):
+        codec = ['blob__codec'] if 'content' in self.fields else []
+        return super().values(queryset, 'id', 'document_count', *codec, *extra)
+
+    def to_representation(self, row):
+        data = super().to_representation(row)
+        if 'content' in data:
+            data['content'] = decompress(row['blob__data'], row['blob__codec'])
+        return data
+
+    def serialize(self, rows):
+        data = super().serialize(rows)
+        multi_document = {row['id']: item for row, item in zip(rows, data) if row['document_count'] > 1}
+        if multi_document:
+            for item in multi_document.values():
+                item['parsed_data'] = {}
+            documents = YAMLDocument.objects.filter(yaml_file_id__in=multi_document).values_list(
+                'yaml_file_id', 'index', 'parsed_data')
+            for yaml_file_id, index, parsed_data in documents:
+                multi_document[yaml_file_id]['parsed_data'][f'document_{index + 1}'] = parsed_data
+        return data
+
+class FlatServiceCatalogSerializer(FlatSerializer):
+    """ServiceCatalogSerializer output for every field but yaml_file_info"""
+    serializer_class = ServiceCatalogSerializer
+    lookups = {
+        'id': 'id',
+        'yaml_file': 'yaml_file_id',
+        'repository_info': {
+            'id': 'yaml_file__repository_id',
+            'workspace': 'yaml_file__repository__workspace',
+            'repository': 'yaml_file__repository__repository',
+        },
+        'service_name': 'service_name',
+        'dependent_services': 'dependent_services',
+        'dependent_infrastructure': 'dependent_infrastructure',
+        'port': 'port',
+        'protocol': 'protocol',
+        'additional_data': 'additional_data',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+        'file_path': 'yaml_file__file_path',
+    }
+
+    @classmethod
+    def supports(cls, fields):
+        """Whether every requested field can be read from values() rows"""
+        return all(name in cls.lookups for name in fields)
+
+class ParseJobSerializer(serializers.ModelSerializer):
+    repository_info = RepositorySerializer(source='repository', read_only=True)
+    elapsed_seconds = serializers.FloatField(read_only=True)
+    files_per_second = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ParseJob
+        fields = ['id', 'repository', 'repository_info', 'status', 'options', 'processed_files', 'total_files',
+                  'elapsed_seconds', 'files_per_second', 'result', 'error', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+class ParseBatchJobSerializer(serializers.ModelSerializer):
+    repository_name = serializers.CharField(source='repository', read_only=True)
+
+    class Meta:
+        model = ParseJob
+        fields = ['id', 'repository', 'repository_name', 'status', 'processed_files', 'total_files', 'error']
+        read_only_fields = fields
+
+class ParseBatchSerializer(serializers.ModelSerializer):
+    jobs = ParseBatchJobSerializer(many=True, read_only=True)
+    processed_files = serializers.SerializerMethodField()
+    elapsed_seconds = serializers.FloatField(read_only=True)
+    files_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ParseBatch
+        fields = ['id', 'status', 'options', 'jobs', 'processed_files', 'elapsed_seconds', 'files_per_second',
+                  'result', 'error', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_processed_files(self, obj):
+        return sum(job.processed_files for job in obj.jobs.all())
+
+    def get_files_per_second(self, obj):
+        elapsed = obj.elapsed_seconds
+        if not elapsed:
+            return None
+        return round(self.get_processed_files(obj) / elapsed, 2)
+
+class RepositoryDeletionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RepositoryDeletion
+        fields = ['id', 'repository', 'repository_name', 'status', 'deleted_items', 'error',
+                  'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+class OptionsSerializer(serializers.Serializer):
+    """Base of the request option serializers"""
+
+    def first_error(self):
+        """The first validation error as a single 'field: message' string, e.g. 'include[1]: Not a valid string.'"""
+        field, errors = next(iter(self.errors.items()))
+        # List items report their errors in a dict keyed by position
+        while not isinstance(errors, str):
+            if isinstance(errors, dict):
+                index, errors = next(iter(errors.items()))
+                field = f'{field}[{index}]'
+            else:
+                errors = errors[0]
+        return f'{field}: {errors}'
+
+class ParseOptionsSerializer(OptionsSerializer):
+    """Validates the options of a parse request"""
+    concurrency = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    max_depth = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    include = serializers.ListField(child=serializers.CharField(), required=False, allow_null=True)
+    exclude = serializers.ListField(child=serializers.CharField(), required=False, allow_null=True)
+    full = serializers.BooleanField(required=False)
+
+class BatchOptionsSerializer(OptionsSerializer):
+    """Validates the request budget options of a parse batch"""
+    concurrency = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    rate_limit = serializers.FloatField(min_value=0, required=False, allow_null=True)
+    repository_concurrency = serializers.IntegerField(min_value=1, required=False, allow_null=True)
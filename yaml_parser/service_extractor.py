@@ -1,13 +1,75 @@
+import logging
+import os
 import re
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
 from rapidfuzz import fuzz, process
 
+try:
+    import numpy as np
+except ImportError:  # process.cdist needs numpy; matching falls back to extractOne
+    np = None
+
+from .extraction_rules import DEFAULT_RULES, SCALAR_FIELDS, RuleEngine, configured_rules
+
+logger = logging.getLogger(__name__)
+
+# A flattened configuration, either as a dict or streamed as (key, value) pairs
+FlatData = Union[Dict[str, Any], Iterable[Tuple[str, Any]]]
+
+
+class ListIndex(int):
+    """Position of an item in a list within a flattened path"""
+
+
+def format_path(path: tuple, sep: str = '.', parent_key: str = '') -> str:
+    """Format a path from iter_flat_items as a flattened key like ``a.b[0].c``"""
+    key = parent_key
+    for segment in path:
+        if isinstance(segment, ListIndex):
+            key = f"{key}[{segment}]"
+        else:
+            key = f"{key}{sep}{segment}" if key else segment
+    return key
+
+
+def split_documents(yaml_data: Any) -> List[Any]:
+    """Split parsed data back into its documents when it holds a ``document_N`` multi-document stream"""
+    if (isinstance(yaml_data, dict) and len(yaml_data) > 1
+            and any(isinstance(key, str) and key.startswith('document_') for key in yaml_data.keys())):
+        return [doc for key, doc in yaml_data.items() if isinstance(key, str) and key.startswith('document_')]
+    return [yaml_data]
+
+
+def flat_items(flat_data: FlatData) -> Iterable[Tuple[str, Any]]:
+    """Iterate a flattened configuration given as a dict or as (key, value) pairs"""
+    return flat_data.items() if isinstance(flat_data, dict) else flat_data
+
+
 class SpringBootServiceExtractor:
     """
     Extracts service information from Spring Boot YAML configurations using fuzzy matching
     """
     
-    def __init__(self):
+    known_fields = frozenset(SCALAR_FIELDS + ('profiles', 'dependent_services', 'dependent_infrastructure'))
+    # Fields extract_fuzzy can fill, in the order of its result
+    fuzzy_fields = ('service_name', 'port', 'protocol', 'dependent_services', 'dependent_infrastructure',
+                    'additional_data')
+    # Fields extract_from_documents fuzzy matches in Spring documents when no rule found them
+    fallback_fields = ('service_name', 'port')
+
+    def __init__(self, extra_rules: Optional[List[Dict[str, Any]]] = None):
+        """
+        Args:
+            extra_rules (List[Dict[str, Any]]): Rule specs added to DEFAULT_RULES; defaults to the
+                rules configured in the Django settings (see extraction_rules.configured_rules)
+        """
+        if extra_rules is None:
+            extra_rules = configured_rules()
+        # Compiled once; every document is then matched in a single traversal
+        self.rule_engine = RuleEngine(DEFAULT_RULES + list(extra_rules))
+        # Threads used by batched fuzzy matching
+        self.workers = min(4, os.cpu_count() or 1)
+
         # Define field patterns with synonyms for fuzzy matching
         self.field_patterns = {
             'service_name': [
@@ -70,125 +132,143 @@ class SpringBootServiceExtractor:
     
     def extract_service_info(self, yaml_data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Extract service information from Spring Boot YAML configuration (direct structure traversal)
+        Extract service information from Spring Boot YAML configuration (compiled rule engine, one pass per document)
         """
-        docs = []
-        if len(yaml_data) > 1 and any(key.startswith('document_') for key in yaml_data.keys()):
-            for key, doc in yaml_data.items():
-                if key.startswith('document_'):
-                    docs.append(doc)
-        else:
-            docs = [yaml_data]
-
-        # Aggregated results
-        service_names = set()
-        versions = set()
-        ports = []  # Use list to preserve order
-        dependent_services = []
-        dependent_infrastructure = []
-        profiles = set()
-        protocol = None
-
-        for doc in docs:
-            spring = doc.get('spring', {})
-            # Service name and version
-            app = spring.get('application', {})
-            if 'name' in app:
-                service_names.add(app['name'])
-            if 'version' in app:
-                versions.add(app['version'])
-            # Port (main service port)
-            if 'server' in spring and 'port' in spring['server']:
-                port_val = spring['server']['port']
-                port_number = self.extract_port_number(port_val)
-                if port_number and port_number not in ports:
-                    ports.append(port_number)
-                elif port_val not in ports:
-                    ports.append(port_val)
-            # Protocol: look for SSL/HTTPS config
-            if 'server' in spring and 'ssl' in spring['server']:
-                protocol = 'https'
-            elif 'server' in spring and 'servlet' in spring['server']:
-                if not protocol:
-                    protocol = 'http'
-            # Profile
-            if 'profiles' in spring and 'active' in spring['profiles']:
-                profiles.add(spring['profiles']['active'])
-            # Dependent services (external-services)
-            ext_services = spring.get('app', {}).get('external-services', {})
-            for svc_name, svc_details in ext_services.items():
-                dependent_services.append({'name': svc_name, 'details': svc_details})
-            # Kafka topics as services
-            kafka_topics = spring.get('app', {}).get('kafka-topics', {})
-            for topic_name, topic_details in kafka_topics.items():
-                dependent_services.append({'name': topic_name, 'type': 'kafka-topic', 'details': topic_details})
-            # Queues as services
-            queues = spring.get('app', {}).get('queues', {})
-            for queue_name, queue_details in queues.items():
-                dependent_services.append({'name': queue_name, 'type': 'queue', 'details': queue_details})
-            # Dependent infrastructure: datasource
-            datasource = spring.get('datasource', {})
-            for dbtype, dbval in datasource.items():
-                if isinstance(dbval, dict):
-                    dependent_infrastructure.append({'type': dbtype, 'details': dbval})
-            # Redis
-            if 'redis' in spring:
-                dependent_infrastructure.append({'type': 'redis', 'details': spring['redis']})
-            # RabbitMQ
-            if 'rabbitmq' in spring:
-                dependent_infrastructure.append({'type': 'rabbitmq', 'details': spring['rabbitmq']})
-            # Kafka
-            if 'kafka' in spring:
-                dependent_infrastructure.append({'type': 'kafka', 'details': spring['kafka']})
-            # ActiveMQ
-            if 'activemq' in spring:
-                dependent_infrastructure.append({'type': 'activemq', 'details': spring['activemq']})
-
-        # If protocol still not set, look for any SSL/HTTPS/secure keys in all docs
-        if not protocol:
-            for doc in docs:
-                spring = doc.get('spring', {})
-                if 'server' in spring and 'ssl' in spring['server']:
-                    protocol = 'https'
-                    break
-            if not protocol:
-                protocol = 'http'
+        return self.extract_from_documents(split_documents(yaml_data))
+
+    def extract_from_documents(self, documents: Iterable[Any]) -> Dict[str, Any]:
+        """
+        Extract service information from the documents of a YAML stream, consuming them one at a time
+        """
+        # Aggregated results, in rule order within a document and document order across documents
+        matches: Dict[str, List[Any]] = {}
+        # First fuzzy match of each fallback field, used when no document matched a rule for it
+        fuzzy: Dict[str, Dict[str, Any]] = {}
+        for doc in documents:
+            for field, values in self.rule_engine.match(doc).items():
+                matches.setdefault(field, []).extend(values)
+            # Only Spring documents; any other YAML with a top-level name key would match service_name
+            missing = [field for field in self.fallback_fields if field not in matches and field not in fuzzy]
+            if missing and isinstance(doc, dict) and isinstance(doc.get('spring'), dict):
+                for field, info in self.extract_fuzzy(doc, missing).items():
+                    if info and info['value'] is not None:
+                        fuzzy[field] = info
+
+        ports = self.unique(matches.get('port', []))
+        protocol = next(iter(matches.get('protocol', [])), None) or 'http'
+
+        logger.debug("Found service ports: %s", ports)
+
+        # Fields added through configured rules are reported as additional data
+        additional_data = {field: values for field, values in matches.items() if field not in self.known_fields}
 
-        # Debug: print found ports
-        print(f"[ServiceExtractor] Found service ports: {ports}")
+        if 'service_name' in matches:
+            service_name = {'value': matches['service_name'][0]}
+        else:
+            service_name = fuzzy.get('service_name', {'value': None})
 
         # Compose result
         return {
-            'service_name': {'value': next(iter(service_names), None)},
-            'version': next(iter(versions), None),
-            'port': {'value': ports[0]} if ports else None,
+            'service_name': service_name,
+            'version': next(iter(matches.get('version', [])), None),
+            'port': {'value': ports[0]} if ports else fuzzy.get('port'),
             'protocol': {'value': protocol},
-            'profiles': list(profiles),
-            'dependent_services': dependent_services,
-            'dependent_infrastructure': dependent_infrastructure,
-            'additional_data': {}
+            'profiles': self.unique(matches.get('profiles', [])),
+            'dependent_services': matches.get('dependent_services', []),
+            'dependent_infrastructure': matches.get('dependent_infrastructure', []),
+            'additional_data': additional_data
         }
+
+    @staticmethod
+    def unique(values: List[Any]) -> List[Any]:
+        """Drop repeated values, keeping the first occurrence (values may be unhashable)"""
+        unique_values = []
+        for value in values:
+            if value not in unique_values:
+                unique_values.append(value)
+        return unique_values
     
+    def iter_flat_items(self, d: Dict[str, Any]) -> Iterator[Tuple[tuple, Any]]:
+        """
+        Lazily yield (path, value) for every leaf of a nested configuration, depth first.
+
+        Uses an explicit stack instead of recursion, so deep nesting cannot hit the
+        recursion limit. Paths are tuples extending their parent's tuple: dictionary
+        keys as they are and list positions as ListIndex. Dictionaries are descended
+        into at any level, lists only when directly under a dictionary, like flatten_dict.
+        """
+        stack = [((), iter(d.items()), False)]
+        while stack:
+            prefix, items, in_list = stack[-1]
+            for key, value in items:
+                path = prefix + (key,)
+                if isinstance(value, dict):
+                    stack.append((path, iter(value.items()), False))
+                    break
+                if isinstance(value, list) and not in_list:
+                    stack.append((path, ((ListIndex(i), item) for i, item in enumerate(value)), True))
+                    break
+                yield path, value
+            else:
+                stack.pop()
+
+    def iter_flat(self, d: Dict[str, Any], sep: str = '.') -> Iterator[Tuple[str, Any]]:
+        """Lazily yield (flattened key, value) pairs in flatten_dict's key format"""
+        for path, value in self.iter_flat_items(d):
+            yield format_path(path, sep), value
+
     def flatten_dict(self, d: Dict[str, Any], parent_key: str = '', sep: str = '.') -> Dict[str, Any]:
         """Flatten nested dictionary for easier searching"""
-        items = []
-        for k, v in d.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.extend(self.flatten_dict(v, new_key, sep=sep).items())
-            elif isinstance(v, list):
-                # Handle lists by creating indexed keys
-                for i, item in enumerate(v):
-                    if isinstance(item, dict):
-                        items.extend(self.flatten_dict(item, f"{new_key}[{i}]", sep=sep).items())
-                    else:
-                        items.append((f"{new_key}[{i}]", item))
-            else:
-                items.append((new_key, v))
-        return dict(items)
+        return {format_path(path, sep, parent_key): value for path, value in self.iter_flat_items(d)}
     
+    def match_fields(self, data_keys: Iterable[str], fields: Optional[Iterable[str]] = None,
+                     threshold: int = 70) -> Dict[str, Optional[tuple]]:
+        """
+        Find the best fuzzy match of several fields in one batched call.
+
+        Every synonym of every field is scored against every key at once with
+        ``process.cdist`` on ``self.workers`` threads. Ties go to the earlier
+        synonym and then the earlier key, like successive ``extractOne`` calls would.
+
+        Args:
+            data_keys (Iterable[str]): Flattened keys to match against
+            fields (Iterable[str]): Fields to match (defaults to every field in field_patterns)
+            threshold (int): Minimum score for a match
+
+        Returns:
+            Dict[str, Optional[tuple]]: (matched key, confidence, key index) per field, or None if nothing matched
+        """
+        fields = list(self.field_patterns if fields is None else fields)
+        data_keys = list(data_keys)
+        if not data_keys or not fields:
+            return {field: None for field in fields}
+        if np is None:
+            return {field: self.best_match_per_pattern(field, data_keys, threshold) for field in fields}
+
+        patterns = []
+        rows = {}
+        for field in fields:
+            start = len(patterns)
+            patterns.extend(self.field_patterns.get(field, [field]))
+            rows[field] = (start, len(patterns))
+
+        scores = process.cdist(patterns, data_keys, scorer=fuzz.ratio, score_cutoff=threshold,
+                               dtype=np.float64, workers=self.workers)
+        matches = {}
+        for field, (start, stop) in rows.items():
+            field_scores = scores[start:stop]
+            _, key_index = np.unravel_index(int(field_scores.argmax()), field_scores.shape)
+            score = float(field_scores.max())
+            # cdist reports scores below the cutoff as 0
+            matches[field] = (data_keys[key_index], score, int(key_index)) if score and score >= threshold else None
+        return matches
+
     def find_best_match(self, target_field: str, data_keys: List[str], threshold: int = 70) -> Optional[tuple]:
         """Find the best fuzzy match for a field"""
+        return self.match_fields(data_keys, [target_field], threshold)[target_field]
+
+    def best_match_per_pattern(self, target_field: str, data_keys: List[str], threshold: int = 70) -> Optional[tuple]:
+        """Find the best fuzzy match for a field with one extractOne call per synonym (used without numpy)"""
         patterns = self.field_patterns.get(target_field, [target_field])
         
         best_match = None
@@ -207,10 +287,47 @@ class SpringBootServiceExtractor:
                 best_score = match[1]
         
         return best_match
-    
-    def extract_service_name(self, flat_data: Dict[str, Any]) -> Optional[str]:
+
+    def field_match(self, target_field: str, flat_data: Dict[str, Any],
+                    matches: Optional[Dict[str, Optional[tuple]]] = None) -> Optional[tuple]:
+        """Best match of a field, taken from precomputed match_fields results when available"""
+        if matches is not None and target_field in matches:
+            return matches[target_field]
+        return self.find_best_match(target_field, list(flat_data.keys()))
+
+    def extract_fuzzy(self, yaml_data: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Extract service information by fuzzy matching the flattened configuration.
+
+        extract_from_documents uses this for the fallback_fields of Spring
+        documents that no extraction rule filled.
+
+        Args:
+            yaml_data (Dict[str, Any]): A parsed YAML document
+            fields (Iterable[str]): Fields to extract, from fuzzy_fields (defaults to all of them)
+
+        Returns:
+            Dict[str, Any]: The result of each requested field's extract_* method
+        """
+        fields = list(self.fuzzy_fields if fields is None else fields)
+        matched_fields = [field for field in fields if field in self.field_patterns]
+        # Only fields looked up by matched key need the flattened dict; the others stream over iter_flat
+        flat_data = self.flatten_dict(yaml_data) if set(fields) - {'protocol', 'additional_data'} else {}
+        # Match every requested field against the flattened keys in a single pass
+        matches = self.match_fields(flat_data.keys(), matched_fields)
+        extractors = {
+            'service_name': lambda: self.extract_service_name(flat_data, matches),
+            'port': lambda: self.extract_port(flat_data, matches),
+            'protocol': lambda: self.extract_protocol(self.iter_flat(yaml_data)),
+            'dependent_services': lambda: self.extract_dependent_services(flat_data, matches=matches),
+            'dependent_infrastructure': lambda: self.extract_dependent_infrastructure(flat_data, field_matches=matches),
+            'additional_data': lambda: self.extract_additional_data(self.iter_flat(yaml_data)),
+        }
+        return {field: extractors[field]() for field in fields}
+
+    def extract_service_name(self, flat_data: Dict[str, Any], matches: Optional[Dict[str, Optional[tuple]]] = None) -> Optional[str]:
         """Extract service name using fuzzy matching"""
-        match = self.find_best_match('service_name', list(flat_data.keys()))
+        match = self.field_match('service_name', flat_data, matches)
         if match:
             field_name, confidence = match[:2]
             value = flat_data[field_name]
@@ -221,9 +338,9 @@ class SpringBootServiceExtractor:
             }
         return None
     
-    def extract_port(self, flat_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def extract_port(self, flat_data: Dict[str, Any], matches: Optional[Dict[str, Optional[tuple]]] = None) -> Optional[Dict[str, Any]]:
         """Extract port information"""
-        match = self.find_best_match('port', list(flat_data.keys()))
+        match = self.field_match('port', flat_data, matches)
         if match:
             field_name, confidence = match[:2]
             value = flat_data[field_name]
@@ -255,13 +372,13 @@ class SpringBootServiceExtractor:
         
         return None
     
-    def extract_protocol(self, flat_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def extract_protocol(self, flat_data: FlatData) -> Optional[Dict[str, Any]]:
         """Extract protocol information"""
         # For Spring Boot, protocol is usually HTTP/HTTPS based on context
         # Check for SSL/TLS configurations
         ssl_indicators = ['ssl', 'https', 'tls', 'security']
         
-        for key in flat_data.keys():
+        for key, _ in flat_items(flat_data):
             if any(indicator in key.lower() for indicator in ssl_indicators):
                 return {
                     'value': 'https',
@@ -277,7 +394,7 @@ class SpringBootServiceExtractor:
             'reason': 'Default protocol for Spring Boot'
         }
     
-    def extract_dependent_services(self, flat_data: Dict[str, Any], docs=None) -> List[Dict[str, Any]]:
+    def extract_dependent_services(self, flat_data: Dict[str, Any], docs=None, matches=None) -> List[Dict[str, Any]]:
         """Extract dependent services from all known keys and all documents"""
         services = []
         # Always look for external-services in all docs
@@ -299,7 +416,7 @@ class SpringBootServiceExtractor:
                         services.append({'name': name, 'type': 'kafka-topic'})
         # Fallback to fuzzy match
         if not services:
-            match = self.find_best_match('dependent_services', list(flat_data.keys()))
+            match = self.field_match('dependent_services', flat_data, matches)
             if match:
                 field_name, confidence = match[:2]
                 value = flat_data[field_name]
@@ -311,7 +428,7 @@ class SpringBootServiceExtractor:
                     services.append({'name': str(value)})
         return services
     
-    def extract_dependent_infrastructure(self, flat_data: Dict[str, Any], docs=None) -> List[Dict[str, Any]]:
+    def extract_dependent_infrastructure(self, flat_data: Dict[str, Any], docs=None, field_matches=None) -> List[Dict[str, Any]]:
         """Extract dependent infrastructure from all known keys and all documents"""
         matches = []
         # Always look for infra in all docs
@@ -337,7 +454,7 @@ class SpringBootServiceExtractor:
                     for key, value in flat_data.items():
                         if pattern in key.lower() or (isinstance(value, str) and pattern in value.lower()):
                             matches.append(self.extract_infrastructure_details(key, value, infra_type))
-            match = self.find_best_match('dependent_infrastructure', list(flat_data.keys()))
+            match = self.field_match('dependent_infrastructure', flat_data, field_matches)
             if match:
                 field_name, confidence = match[:2]
                 value = flat_data[field_name]
@@ -385,8 +502,8 @@ class SpringBootServiceExtractor:
         
         return details
     
-    def extract_additional_data(self, flat_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Extract additional service data"""
+    def extract_additional_data(self, flat_data: FlatData) -> Dict[str, Any]:
+        """Extract additional service data in a single pass over the flattened keys"""
         additional = {
             'version': None,
             'profiles': [],
@@ -395,32 +512,26 @@ class SpringBootServiceExtractor:
             'kafka_topics': []
         }
         
-        # Extract version
-        for key, value in flat_data.items():
-            if 'version' in key.lower():
+        # Later keys win, as for the per-field scans this replaces
+        for key, value in flat_items(flat_data):
+            lower_key = key.lower()
+            # Extract version
+            if 'version' in lower_key:
                 additional['version'] = value
-        
-        # Extract profiles
-        for key, value in flat_data.items():
-            if 'profiles.active' in key.lower():
+            # Extract profiles
+            if 'profiles.active' in lower_key:
                 additional['profiles'] = [value] if isinstance(value, str) else value
-        
-        # Extract management endpoints
-        for key, value in flat_data.items():
-            if 'management.endpoints.web.exposure.include' in key.lower():
+            # Extract management endpoints
+            if 'management.endpoints.web.exposure.include' in lower_key:
                 if isinstance(value, str):
                     additional['endpoints'] = [ep.strip() for ep in value.split(',')]
                 elif isinstance(value, list):
                     additional['endpoints'] = value
-        
-        # Extract queues
-        for key, value in flat_data.items():
-            if 'queues' in key.lower() and isinstance(value, dict):
+            # Extract queues
+            if 'queues' in lower_key and isinstance(value, dict):
                 additional['queues'] = list(value.keys())
-        
-        # Extract Kafka topics
-        for key, value in flat_data.items():
-            if 'kafka-topics' in key.lower() and isinstance(value, dict):
+            # Extract Kafka topics
+            if 'kafka-topics' in lower_key and isinstance(value, dict):
                 additional['kafka_topics'] = list(value.keys())
         
-        return additional 
\ No newline at end of file
+        return additional
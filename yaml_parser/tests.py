@@ -1,3 +1,1619 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import yaml
+from django.core.cache import cache
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import blobs, json_backend, yaml_backend
+from .async_reader import AsyncBitbucketYAMLReader
+from .bitbucket_reader import BitbucketYAMLReader
+from .bitbucket_stub import StubBitbucketServer
+from . import http_client
+from .http_client import AsyncBitbucketHTTPClient, BitbucketHTTPClient, get_async_client, get_client
+from .batch import FairScheduler, run_parse_batch
+from .jobs import claim_next_deletion, run_deletion_in_thread, run_parse_job, run_repository_deletion
+from .metrics import (HTTP_REQUESTS, PARSE_CACHE, PROCESSED_FILES, RESPONSE_CACHE, STAGE_SECONDS, Counter,
+                      Histogram, Registry)
+from .models import (ContentBlob, ParseBatch, ParseJob, Repository, RepositoryDeletion, Service, YAMLDocument,
+                     YAMLFile)
+from .parse_cache import parse_cache
+from .parse_pool import ParsePool, parse_and_extract
+from .renderers import ORJSONParser, ORJSONRenderer
+from .repository_parser import DocumentSpool, RepositoryParser
+from .serializers import (FlatServiceCatalogSerializer, FlatYAMLFileSerializer, ServiceCatalogSerializer,
+                          YAMLFileSerializer)
+from .service_extractor import SpringBootServiceExtractor
+from .views import parse_events
+
+
+def service_yaml(name, port=8080):
+    return f"spring:\n  application:\n    name: {name}\n  server:\n    port: {port}\n"
+
+
+class ConcurrentFetchTests(TestCase):
+    def setUp(self):
+        self.files = {f"svc-{i:02d}/application.yml": service_yaml(f"svc-{i:02d}") for i in range(12)}
+
+    def test_get_files_content_is_bounded_and_ordered(self):
+        with StubBitbucketServer(self.files, latency=0.05) as stub:
+            reader = BitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+            paths = list(reversed(list(self.files)))
+            results = reader.get_files_content(paths + ['missing.yml'], max_workers=4)
+
+        self.assertEqual([path for path, _ in results], paths + ['missing.yml'])
+        self.assertEqual(results[0][1], self.files[paths[0]])
+        self.assertIsNone(results[-1][1])
+        self.assertLessEqual(stub.max_in_flight, 4)
+        self.assertGreater(stub.max_in_flight, 1)
+
+    def test_parse_repository_against_stub_server(self):
+        with StubBitbucketServer(self.files) as stub:
+            with override_settings(BITBUCKET_API_URL=stub.base_url, BITBUCKET_RATE_LIMIT=0):
+                response = self.client.post('/api/parse-repository/', {
+                    'workspace': 'ws',
+                    'repository': 'repo',
+                    'access_token': 'token',
+                    'concurrency': 3,
+                    'sync': True,
+                }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual([f['file_path'] for f in response.json()['files']], list(self.files))
+        self.assertEqual(YAMLFile.objects.count(), 12)
+        self.assertEqual(Service.objects.count(), 12)
+
+    def test_invalid_concurrency_is_rejected(self):
+        for concurrency in ['many', 0, -2]:
+            response = self.client.post('/api/parse-repository/', {
+                'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'concurrency': concurrency
+            }, content_type='application/json')
+
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(response.json()['error'].startswith('concurrency: '))
+        self.assertFalse(Repository.objects.exists())
+
+
+class TreeWalkTests(TestCase):
+    def setUp(self):
+        self.files = {f"root-{i:02d}.yml": service_yaml(f"root-{i:02d}") for i in range(15)}
+        self.files.update({
+            'README.md': '# docs',
+            'services/orders/application.yml': service_yaml('orders'),
+            'services/orders/deep/nested/config.yaml': service_yaml('nested'),
+            'vendor/templates/application.yml': service_yaml('vendored'),
+        })
+
+    def test_walk_follows_pagination_and_directories(self):
+        with StubBitbucketServer(self.files, pagelen=4) as stub:
+            reader = BitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+            found = reader.list_yaml_files()
+
+        expected = [path for path in self.files if path != 'README.md']
+        self.assertCountEqual(found, expected)
+
+    def test_walk_honours_depth_and_globs(self):
+        with StubBitbucketServer(self.files, pagelen=4) as stub:
+            reader = BitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+            shallow = reader.list_yaml_files(max_depth=2, exclude=['vendor'])
+            only_services = reader.list_yaml_files(include=['services/*'])
+
+        self.assertIn('services/orders/application.yml', shallow)
+        self.assertNotIn('services/orders/deep/nested/config.yaml', shallow)
+        self.assertNotIn('vendor/templates/application.yml', shallow)
+        self.assertCountEqual(only_services, [
+            'services/orders/application.yml',
+            'services/orders/deep/nested/config.yaml',
+        ])
+
+
+class HTTPClientTests(TestCase):
+    def test_retries_throttled_and_failing_requests(self):
+        files = {'application.yml': service_yaml('orders')}
+        with StubBitbucketServer(files) as stub:
+            stub.failures['application.yml'] = [429, 503]
+            client = BitbucketHTTPClient('token', backoff_base=0.01)
+            response = client.get(f"{stub.base_url}/repositories/ws/repo/src/main/application.yml")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, files['application.yml'])
+        self.assertEqual(client.stats()['retries'], 2)
+
+    def test_gives_up_after_max_retries(self):
+        with StubBitbucketServer({'application.yml': ''}) as stub:
+            stub.failures['application.yml'] = [500] * 5
+            client = BitbucketHTTPClient('token', max_retries=2, backoff_base=0.01)
+            response = client.get(f"{stub.base_url}/repositories/ws/repo/src/main/application.yml")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(client.stats()['requests'], 3)
+
+    def test_connections_are_kept_alive(self):
+        files = {f"svc-{i}.yml": service_yaml(f"svc-{i}") for i in range(10)}
+        with StubBitbucketServer(files) as stub:
+            client = BitbucketHTTPClient('token')
+            for path in files:
+                client.get(f"{stub.base_url}/repositories/ws/repo/src/main/{path}").raise_for_status()
+            stats = client.stats()
+            client.close()
+
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 9)
+
+    @mock.patch.object(http_client, 'MAX_CLIENTS', 2)
+    @mock.patch.object(http_client, '_clients', OrderedDict())
+    def test_shared_clients_are_bounded_and_not_keyed_by_token(self):
+        first = get_client('token-1')
+        second = get_client('token-2')
+        self.assertIs(get_client('token-1'), first)
+
+        get_client('token-3')
+
+        self.assertNotIn('token-1', http_client._clients)
+        self.assertIs(get_client('token-1'), first)
+        self.assertIsNot(get_client('token-2'), second)
+        self.assertEqual(len(http_client._clients), 2)
+
+    @mock.patch.object(http_client, 'MAX_CLIENTS', 2)
+    @mock.patch.object(http_client, '_evicted_stats', {})
+    def test_evicted_async_clients_are_closed_once_idle(self):
+        async def clients():
+            first = get_async_client('token-1')
+            first._requests = 3
+            # A request of the first client is still running when it is evicted
+            first.in_flight = 1
+            get_async_client('token-2')
+            get_async_client('token-3')
+            again = get_async_client('token-1')
+            await asyncio.sleep(0.2)
+            closed_while_busy = first.session.is_closed
+            first.in_flight = 0
+            await asyncio.gather(*list(http_client._closing))
+            return first, again, closed_while_busy
+
+        first, again, closed_while_busy = asyncio.run(clients())
+
+        self.assertIsNot(again, first)
+        self.assertFalse(closed_while_busy)
+        self.assertTrue(first.session.is_closed)
+        self.assertEqual(http_client._evicted_stats['requests'], 3)
+
+
+class AsyncReaderTests(TestCase):
+    def setUp(self):
+        parse_cache.clear()
+        cache.clear()
+        self.files = {f"svc-{i:02d}/application.yml": service_yaml(f"svc-{i:02d}") for i in range(8)}
+
+    def test_readers_share_one_client_and_overlap_on_the_loop(self):
+        with StubBitbucketServer(self.files, latency=0.05) as stub:
+            async def fetch_both():
+                first = AsyncBitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+                second = AsyncBitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+                self.assertIs(first.aclient, second.aclient)
+                paths = list(self.files)
+                return await asyncio.gather(
+                    first.aget_files_content(paths, max_workers=2),
+                    second.aget_files_content(list(reversed(paths)) + ['missing.yml'], max_workers=2),
+                )
+
+            first, second = asyncio.run(fetch_both())
+
+        self.assertEqual([path for path, _ in first], list(self.files))
+        self.assertEqual(second[0][1], self.files[second[0][0]])
+        self.assertIsNone(second[-1][1])
+        self.assertGreater(stub.max_in_flight, 2)
+        self.assertLessEqual(stub.max_in_flight, 4)
+
+    def test_retries_throttled_requests(self):
+        files = {'application.yml': service_yaml('orders')}
+        with StubBitbucketServer(files) as stub:
+            stub.failures['application.yml'] = [429, 503]
+
+            async def fetch():
+                client = AsyncBitbucketHTTPClient('token', backoff_base=0.01)
+                response = await client.get(f"{stub.base_url}/repositories/ws/repo/src/main/application.yml")
+                await client.aclose()
+                return response, client.stats()
+
+            response, stats = asyncio.run(fetch())
+
+        self.assertEqual(response.text, files['application.yml'])
+        self.assertEqual(stats['retries'], 2)
+
+    def test_walk_matches_the_blocking_reader(self):
+        files = {**self.files, 'README.md': '# docs', 'vendor/application.yml': service_yaml('vendored')}
+        with StubBitbucketServer(files, pagelen=3) as stub:
+            reader = AsyncBitbucketYAMLReader('token', 'ws', 'repo', base_url=stub.base_url)
+            found = asyncio.run(reader.alist_yaml_files(exclude=['vendor']))
+            expected = reader.list_yaml_files(exclude=['vendor'])
+
+        self.assertCountEqual(found, expected)
+        self.assertEqual(len(found), 8)
+
+    def test_async_parse_endpoint_stores_and_reparses_incrementally(self):
+        with StubBitbucketServer(self.files) as stub:
+            stub.commit = 'a' * 40
+            with override_settings(BITBUCKET_API_URL=stub.base_url, BITBUCKET_RATE_LIMIT=5000):
+                parse = lambda: self.client.post('/api/parse-repository/async/', {
+                    'workspace': 'ws', 'repository': 'repo', 'access_token': 'token'
+                }, content_type='application/json')
+                first = parse()
+                second = parse()
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['mode'], 'full')
+        self.assertEqual(len(first.json()['services']), 8)
+        self.assertEqual(Service.objects.count(), 8)
+        self.assertEqual(Repository.objects.get().last_commit, 'a' * 40)
+        self.assertEqual(second.json()['mode'], 'incremental')
+        self.assertEqual(second.json()['files'], [])
+
+    def test_async_catalog_matches_the_sync_catalog(self):
+        with StubBitbucketServer(self.files) as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            self.client.post('/api/parse-repository/async/', {
+                'workspace': 'ws', 'repository': 'repo', 'access_token': 'token'
+            }, content_type='application/json')
+
+        sync_page = self.client.get('/api/service-catalog/?page_size=5').json()
+        async_response = self.client.get('/api/service-catalog/async/?page_size=5')
+
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.json()['services'], sync_page['services'])
+        self.assertEqual(async_response.json()['total_count'], 8)
+        self.assertEqual(self.client.get('/api/service-catalog/async/?page_size=5',
+                                         HTTP_IF_NONE_MATCH=async_response['ETag']).status_code, 304)
+
+    def test_async_views_validate_requests(self):
+        missing = self.client.post('/api/parse-repository/async/', {'workspace': 'ws'},
+                                   content_type='application/json')
+        unknown = self.client.get('/api/service-catalog/async/?fields=nope')
+
+        self.assertEqual(missing.status_code, 400)
+        self.assertIn('Missing required fields', missing.json()['error'])
+        self.assertEqual(unknown.status_code, 400)
+        self.assertEqual(self.client.get('/api/parse-repository/async/').status_code, 405)
+
+
+class IncrementalParseTests(TestCase):
+    def parse(self, stub, **extra):
+        with override_settings(BITBUCKET_API_URL=stub.base_url, BITBUCKET_RATE_LIMIT=0):
+            return self.client.post('/api/parse-repository/', {
+                'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'sync': True, **extra
+            }, content_type='application/json').json()
+
+    def test_reparse_only_touches_changed_files(self):
+        files = {
+            'orders/application.yml': service_yaml('orders'),
+            'billing/application.yml': service_yaml('billing'),
+            'legacy/application.yml': service_yaml('legacy'),
+        }
+        with StubBitbucketServer(files) as stub:
+            stub.commit = 'a' * 40
+            first = self.parse(stub)
+            self.assertEqual(first['mode'], 'full')
+            self.assertEqual(Service.objects.count(), 3)
+
+            unchanged = self.parse(stub)
+            self.assertEqual(unchanged['mode'], 'incremental')
+            self.assertEqual(unchanged['files'], [])
+
+            stub.commit = 'b' * 40
+            files['orders/application.yml'] = service_yaml('orders', port=9090)
+            files['search/application.yml'] = service_yaml('search')
+            del files['legacy/application.yml']
+            stub.diffstat = [
+                {'status': 'modified', 'old': {'path': 'orders/application.yml'}, 'new': {'path': 'orders/application.yml'}},
+                {'status': 'added', 'old': None, 'new': {'path': 'search/application.yml'}},
+                {'status': 'removed', 'old': {'path': 'legacy/application.yml'}, 'new': None},
+                {'status': 'modified', 'old': {'path': 'README.md'}, 'new': {'path': 'README.md'}},
+            ]
+            changed = self.parse(stub)
+
+        self.assertEqual(changed['mode'], 'incremental')
+        self.assertCountEqual([f['file_path'] for f in changed['files']], ['orders/application.yml', 'search/application.yml'])
+        self.assertEqual(changed['deleted_files'], ['legacy/application.yml'])
+        self.assertEqual(Service.objects.get(service_name='orders').port, '9090')
+        self.assertCountEqual(Service.objects.values_list('service_name', flat=True), ['orders', 'billing', 'search'])
+        self.assertEqual(Repository.objects.get().last_commit, 'b' * 40)
+
+    def test_failed_downloads_are_retried_by_the_next_parse(self):
+        files = {'orders/application.yml': service_yaml('orders'), 'billing/application.yml': service_yaml('billing')}
+        with StubBitbucketServer(files) as stub:
+            stub.commit = 'a' * 40
+            self.parse(stub)
+
+            stub.commit = 'b' * 40
+            files['orders/application.yml'] = service_yaml('orders', port=9090)
+            stub.diffstat = [{'status': 'modified', 'old': {'path': 'orders/application.yml'},
+                              'new': {'path': 'orders/application.yml'}}]
+            stub.failures['orders/application.yml'] = [404]
+            failed = self.parse(stub)
+            self.assertEqual(failed['failed_files'], ['orders/application.yml'])
+            self.assertEqual(Repository.objects.get().last_commit, 'a' * 40)
+
+            retried = self.parse(stub)
+
+        self.assertEqual(retried['mode'], 'incremental')
+        self.assertEqual(retried['failed_files'], [])
+        self.assertEqual(Service.objects.get(service_name='orders').port, '9090')
+        self.assertEqual(Repository.objects.get().last_commit, 'b' * 40)
+
+    def test_full_walk_drops_files_removed_upstream(self):
+        files = {
+            'orders/application.yml': service_yaml('orders'),
+            'billing/application.yml': service_yaml('billing'),
+            'legacy/application.yml': service_yaml('legacy'),
+        }
+        with StubBitbucketServer(files) as stub, \
+                mock.patch.object(BitbucketYAMLReader, 'get_diffstat', return_value=None):
+            stub.commit = 'a' * 40
+            self.parse(stub)
+
+            stub.commit = 'b' * 40
+            del files['legacy/application.yml']
+            # A listing page that fails must not be mistaken for removed files
+            stub.failures['billing/'] = [404]
+            partial = self.parse(stub)
+            self.assertEqual(partial['mode'], 'full')
+            self.assertEqual(partial['deleted_files'], [])
+            self.assertEqual(Repository.objects.get().last_commit, 'a' * 40)
+
+            # Files outside a narrower selection are not removed either
+            narrowed = self.parse(stub, include=['orders/*'])
+            self.assertEqual(narrowed['deleted_files'], [])
+
+            stub.commit = 'c' * 40
+            complete = self.parse(stub)
+
+        self.assertEqual(complete['mode'], 'full')
+        self.assertEqual(complete['deleted_files'], ['legacy/application.yml'])
+        self.assertCountEqual(Service.objects.values_list('service_name', flat=True), ['orders', 'billing'])
+        self.assertEqual(Repository.objects.get().last_commit, 'c' * 40)
+
+    def test_full_flag_forces_complete_parse(self):
+        with StubBitbucketServer({'application.yml': service_yaml('orders')}) as stub:
+            stub.commit = 'a' * 40
+            self.parse(stub)
+            result = self.parse(stub, full=True)
+
+        self.assertEqual(result['mode'], 'full')
+        self.assertEqual(len(result['files']), 1)
+
+
+class ParseCacheTests(TestCase):
+    def setUp(self):
+        parse_cache.clear()
+
+    def parse(self, stub, repository='repo'):
+        with override_settings(BITBUCKET_API_URL=stub.base_url, BITBUCKET_RATE_LIMIT=0):
+            return self.client.post('/api/parse-repository/', {
+                'workspace': 'ws', 'repository': repository, 'access_token': 'token', 'sync': True
+            }, content_type='application/json').json()
+
+    def test_duplicate_content_is_parsed_once(self):
+        template = service_yaml('shared-template')
+        files = {'a/application.yml': template, 'b/application.yml': template, 'c/application.yml': service_yaml('other')}
+        with StubBitbucketServer(files) as stub:
+            with mock.patch.object(BitbucketYAMLReader, 'yaml_documents', autospec=True,
+                                   side_effect=BitbucketYAMLReader.yaml_documents) as parse:
+                result = self.parse(stub)
+
+        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(result['cache_hits'], 1)
+        self.assertEqual(result['yaml_backends'], {yaml_backend.DEFAULT_BACKEND: 2})
+        self.assertEqual(Service.objects.filter(service_name='shared-template').count(), 2)
+        self.assertEqual(len(set(YAMLFile.objects.values_list('blob', flat=True))), 2)
+
+    def test_cache_falls_back_to_stored_rows(self):
+        files = {'application.yml': service_yaml('orders', port=9000)}
+        with StubBitbucketServer(files) as stub:
+            self.parse(stub)
+            parse_cache.clear()
+            with mock.patch.object(BitbucketYAMLReader, 'yaml_documents') as parse:
+                result = self.parse(stub)
+
+        parse.assert_not_called()
+        self.assertEqual(result['cache_hits'], 1)
+        self.assertEqual(result['services'][0]['port'], '9000')
+
+    @override_settings(SERVICE_EXTRACTION_RULES=[
+        {'field': 'dependent_infrastructure', 'path': 'spring.data.mongodb', 'item': {'type': 'mongodb'}}
+    ])
+    def test_full_parse_reruns_extraction(self):
+        files = {'application.yml': service_yaml('orders') + "  data:\n    mongodb:\n      host: db\n"}
+        with StubBitbucketServer(files) as stub:
+            with override_settings(SERVICE_EXTRACTION_RULES=[]):
+                self.parse(stub)
+            with override_settings(BITBUCKET_API_URL=stub.base_url, BITBUCKET_RATE_LIMIT=0):
+                result = self.client.post('/api/parse-repository/', {
+                    'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'sync': True, 'full': True
+                }, content_type='application/json').json()
+
+        self.assertEqual(result['cache_hits'], 0)
+        self.assertEqual(Service.objects.get().dependent_infrastructure, [{'type': 'mongodb'}])
+
+
+
+class YAMLBackendTests(TestCase):
+    def setUp(self):
+        self.reader = BitbucketYAMLReader('token', 'ws', 'repo')
+
+    def test_multi_document_stream_is_parsed_once(self):
+        content = "spring:\n  application:\n    name: orders\n---\nspring:\n  profiles:\n    active: prod\n"
+        with mock.patch('yaml.load_all', wraps=yaml.load_all) as load_all:
+            data, backend = self.reader.parse_yaml(content)
+
+        load_all.assert_called_once()
+        self.assertEqual(backend, yaml_backend.DEFAULT_BACKEND)
+        self.assertEqual(data, {
+            'document_1': {'spring': {'application': {'name': 'orders'}}},
+            'document_2': {'spring': {'profiles': {'active': 'prod'}}},
+        })
+
+    def test_backends_agree(self):
+        content = "a: 1\nb: [x, {c: true}]\nd: 2024-01-01\n"
+        results = [yaml_backend.load_documents(content, backend) for backend in yaml_backend.LOADERS]
+
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(self.reader.parse_yaml('---\na: 1\n')[0], {'a': 1})
+        self.assertIsNone(self.reader.parse_yaml_content(''))
+
+    def test_falls_back_to_pure_python_loader(self):
+        with mock.patch.object(yaml_backend, 'DEFAULT_BACKEND', yaml_backend.PURE_PYTHON):
+            self.assertEqual(yaml_backend.parse_yaml('a: 1\n'), ({'a': 1}, yaml_backend.PURE_PYTHON))
+
+    def test_invalid_yaml_returns_none(self):
+        with mock.patch('builtins.print'):
+            self.assertEqual(self.reader.parse_yaml('a: [1\n'), (None, None))
+
+
+class MultiDocumentTests(TestCase):
+    def setUp(self):
+        parse_cache.clear()
+        self.repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        self.reader = BitbucketYAMLReader('token', 'ws', 'repo')
+
+    def process(self, files, **options):
+        parser = RepositoryParser(self.repository, self.reader, **options)
+        with mock.patch('builtins.print'):
+            return parser.process_files(files.items())
+
+    def test_documents_are_stored_as_rows(self):
+        content = service_yaml('orders') + "---\nspring:\n  redis:\n    host: cache\n---\nspring:\n  profiles:\n    active: prod\n"
+        parsed_files, services = self.process({'application.yml': content})
+
+        yaml_file = YAMLFile.objects.get()
+        self.assertEqual(yaml_file.document_count, 3)
+        self.assertIsNone(yaml_file.parsed_data)
+        self.assertEqual(list(yaml_file.documents.values_list('index', flat=True)), [0, 1, 2])
+        self.assertEqual(services[0]['dependent_infrastructure'], [{'type': 'redis', 'details': {'host': 'cache'}}])
+        self.assertEqual(set(parsed_files[0]['parsed_data']), {'document_1', 'document_2', 'document_3'})
+
+        response = self.client.get(f'/api/repositories/{self.repository.id}/files/').json()
+        self.assertEqual(response['files'][0]['parsed_data']['document_3'], {'spring': {'profiles': {'active': 'prod'}}})
+
+    def test_documents_are_replaced_when_the_file_changes(self):
+        self.process({'application.yml': service_yaml('orders') + "---\na: 1\n"})
+        self.process({'application.yml': service_yaml('orders', port=9090)})
+
+        yaml_file = YAMLFile.objects.get()
+        self.assertEqual(yaml_file.document_count, 1)
+        self.assertEqual(yaml_file.documents.count(), 0)
+        self.assertEqual(yaml_file.parsed_data['spring']['server']['port'], 9090)
+
+    def test_documents_are_parsed_lazily(self):
+        stream = iter(self.reader.yaml_documents("a: 1\n---\nb: [unclosed\n"))
+
+        self.assertEqual(next(stream), {'a': 1})
+        with self.assertRaises(yaml.YAMLError):
+            next(stream)
+
+
+class ServiceCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        for i in range(5):
+            blob = ContentBlob.for_content('x' * 1000 + str(i))
+            blob.save()
+            yaml_file = YAMLFile.objects.create(repository=repository, file_path=f'svc-{i}.yml', blob=blob,
+                                                parsed_data={'big': 'y' * 1000})
+            Service.objects.create(yaml_file=yaml_file, service_name=f'svc-{i}', port='8080')
+
+    @override_settings(SERVICE_CATALOG_PAGE_SIZE=2)
+    def test_pages_follow_the_cursor(self):
+        names = []
+        url = '/api/service-catalog/'
+        while url:
+            data = self.client.get(url).json()
+            self.assertEqual(data['total_count'], 5)
+            self.assertLessEqual(len(data['services']), 2)
+            names.extend(service['service_name'] for service in data['services'])
+            url = data['next']
+
+        self.assertEqual(names, [f'svc-{i}' for i in range(5)])
+
+    def test_invalid_cursor_is_not_found(self):
+        for url in ['/api/service-catalog/', '/api/service-catalog/async/']:
+            for fields in ['', 'service_name']:
+                response = self.client.get(url, {'cursor': 'garbage', 'fields': fields})
+
+                self.assertEqual(response.status_code, 404, (url, fields))
+                self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_default_representation_leaves_out_file_content(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/service-catalog/').json()
+
+        service = data['services'][0]
+        self.assertNotIn('yaml_file_info', service)
+        self.assertEqual(service['file_path'], 'svc-0.yml')
+        self.assertEqual(service['repository_info']['repository'], 'repo')
+        self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+        self.assertTrue(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_sparse_fieldsets(self):
+        data = self.client.get('/api/service-catalog/', {'fields': 'service_name,port'}).json()
+        self.assertEqual(data['services'][0], {'service_name': 'svc-0', 'port': '8080'})
+
+        data = self.client.get('/api/service-catalog/', {'fields': 'id,yaml_file_info'}).json()
+        self.assertEqual(data['services'][0]['yaml_file_info']['parsed_data'], {'big': 'y' * 1000})
+
+        response = self.client.get('/api/service-catalog/', {'fields': 'service_name,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.json()['error'])
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        self.reader = BitbucketYAMLReader('token', 'ws', 'repo')
+
+    def get(self, url, etag=None):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag) if etag else self.client.get(url)
+
+    def test_unchanged_data_returns_not_modified(self):
+        for url in ['/api/service-catalog/', '/api/repositories/', f'/api/repositories/{self.repository.id}/files/']:
+            first = self.get(url)
+            self.assertEqual(first.status_code, 200)
+            with self.assertNumQueries(1):
+                second = self.get(url, first['ETag'])
+            self.assertEqual(second.status_code, 304, url)
+            self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_cached_body_is_served_without_serializing(self):
+        first = self.get('/api/service-catalog/')
+        with mock.patch('yaml_parser.views.FlatServiceCatalogSerializer') as serializer:
+            second = self.get('/api/service-catalog/')
+
+        serializer.assert_not_called()
+        self.assertEqual(second.content, first.content)
+
+    def test_parse_and_delete_change_the_etag(self):
+        catalog = self.get('/api/service-catalog/')
+        files = self.get(f'/api/repositories/{self.repository.id}/files/')
+
+        with mock.patch('builtins.print'):
+            RepositoryParser(self.repository, self.reader).process_files([('a.yml', service_yaml('orders'))])
+        self.repository.refresh_from_db()
+
+        updated = self.get('/api/service-catalog/', catalog['ETag'])
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(updated.json()['services'][0]['service_name'], 'orders')
+        self.assertEqual(self.get(f'/api/repositories/{self.repository.id}/files/', files['ETag']).status_code, 200)
+
+        repositories = self.get('/api/repositories/')
+        self.client.delete(f'/api/repositories/{self.repository.id}/delete/')
+        self.assertEqual(self.get('/api/repositories/', repositories['ETag']).json(), [])
+
+
+@override_settings(BITBUCKET_RATE_LIMIT=0)
+class ParseStreamTests(TestCase):
+    def setUp(self):
+        parse_cache.clear()
+
+    def stream(self, stub, **data):
+        with override_settings(BITBUCKET_API_URL=stub.base_url):
+            response = self.client.post('/api/parse-repository/stream/', {
+                'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', **data
+            }, content_type='application/json')
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_each_file_is_streamed_before_the_summary(self):
+        files = {f"svc-{i}/application.yml": service_yaml(f"svc-{i}") for i in range(3)}
+        files['README.yml'] = 'title: docs\n'
+        with StubBitbucketServer(files) as stub:
+            events = self.stream(stub)
+
+        self.assertEqual([event['event'] for event in events], ['start'] + ['file'] * 4 + ['done'])
+        file_events = events[1:-1]
+        self.assertEqual([event['processed_files'] for event in file_events], [1, 2, 3, 4])
+        self.assertCountEqual([event['service']['service_name'] for event in file_events if event['service']],
+                              ['svc-0', 'svc-1', 'svc-2'])
+        self.assertEqual(events[-1]['services_extracted'], 3)
+        self.assertEqual(events[-1]['message'], 'Successfully parsed 4 YAML files and extracted 3 services')
+        self.assertEqual(Service.objects.count(), 3)
+
+    def test_each_file_is_stored_before_its_event(self):
+        files = {f"svc-{i}/application.yml": service_yaml(f"svc-{i}") for i in range(3)}
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        options = {'concurrency': 1, 'max_depth': None, 'include': None, 'exclude': None, 'full': False}
+        with StubBitbucketServer(files) as stub, override_settings(BITBUCKET_API_URL=stub.base_url,
+                                                                   PARSE_BATCH_SIZE=50, PARSE_WRITE_BATCH_SIZE=500):
+            stored = []
+            for line in parse_events(repository, options):
+                event = json.loads(line)
+                if event['event'] == 'file':
+                    stored.append(YAMLFile.objects.filter(repository=repository, file_path=event['file_path']).exists())
+                    self.assertEqual(Service.objects.count(), event['processed_files'])
+
+        self.assertEqual(stored, [True, True, True])
+
+    def test_failures_are_reported_in_the_stream(self):
+        with StubBitbucketServer({'application.yml': service_yaml('orders')}) as stub:
+            with mock.patch.object(RepositoryParser, 'iter_processed_files', side_effect=RuntimeError('boom')):
+                events = self.stream(stub)
+
+        self.assertEqual(events[-1], {'event': 'error', 'error': 'Error parsing repository: boom'})
+
+    def test_missing_fields_are_rejected(self):
+        response = self.client.post('/api/parse-repository/stream/', {'workspace': 'ws'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Missing required fields', response.json()['error'])
+
+    def test_invalid_options_are_rejected_before_streaming(self):
+        response = self.client.post('/api/parse-repository/stream/', {
+            'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'max_depth': 'deep'
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+        self.assertTrue(response.json()['error'].startswith('max_depth: '))
+        self.assertFalse(Repository.objects.exists())
+
+class ParsePoolTests(TestCase):
+    def setUp(self):
+        parse_cache.clear()
+        self.contents = [
+            service_yaml('orders'),
+            service_yaml('billing') + "---\nspring:\n  redis:\n    host: cache\n",
+            'released: 2024-01-02\ntitle: notes\n',
+            'spring: [unclosed\n',
+        ]
+
+    def test_worker_results_match_parsing_in_process(self):
+        extractor = SpringBootServiceExtractor([])
+        expected = [parse_and_extract(content, extractor) for content in self.contents]
+        pool = ParsePool(workers=2, chunk_size=1)
+        try:
+            results = pool.map(self.contents, [])
+        finally:
+            pool.shutdown()
+
+        # Results match apart from their timings
+        self.assertEqual([result[:3] for result in results], [result[:3] for result in expected])
+        self.assertEqual(pickle.loads(pickle.dumps(results)), results)
+        self.assertEqual(results[3][:3], ([], None, None))
+
+    @override_settings(PARSE_WORKERS=2, BITBUCKET_RATE_LIMIT=0)
+    def test_parser_hands_parsing_to_the_workers(self):
+        files = {f"svc-{i}/application.yml": service_yaml(f"svc-{i}") for i in range(6)}
+        with StubBitbucketServer(files) as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            with mock.patch.object(RepositoryParser, 'parse_documents') as parse_in_process:
+                response = self.client.post('/api/parse-repository/', {
+                    'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'sync': True
+                }, content_type='application/json').json()
+
+        parse_in_process.assert_not_called()
+        self.assertEqual(response['yaml_backends'], {yaml_backend.DEFAULT_BACKEND: 6})
+        self.assertEqual(sorted(Service.objects.values_list('service_name', flat=True)),
+                         [f"svc-{i}" for i in range(6)])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        histogram = registry.register(Histogram('test_seconds', 'Test durations', ['stage'], buckets=(0.1, 1.0)))
+        counter = registry.register(Counter('test_total', 'Test events'))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, stage='fetch')
+        counter.inc(3)
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{stage="fetch"} 5.55', lines)
+        self.assertIn('test_seconds_count{stage="fetch"} 3', lines)
+        self.assertIn('test_total 3', lines)
+        with self.assertRaises(ValueError):
+            histogram.observe(1)
+
+    @override_settings(BITBUCKET_RATE_LIMIT=0)
+    def test_parse_updates_stage_and_request_metrics(self):
+        files = {f"svc-{i}/application.yml": service_yaml(f"svc-{i}") for i in range(3)}
+        stages = {stage: STAGE_SECONDS.count(stage=stage) for stage in ('listing', 'fetch', 'parse', 'extract',
+                                                                        'db_write')}
+        ok_requests = HTTP_REQUESTS.value(status='200')
+        processed = PROCESSED_FILES.value()
+        with StubBitbucketServer(files) as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            self.client.post('/api/parse-repository/', {
+                'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'sync': True
+            }, content_type='application/json')
+
+        self.assertEqual(STAGE_SECONDS.count(stage='fetch') - stages['fetch'], 3)
+        self.assertEqual(STAGE_SECONDS.count(stage='parse') - stages['parse'], 3)
+        self.assertEqual(STAGE_SECONDS.count(stage='extract') - stages['extract'], 3)
+        self.assertGreater(STAGE_SECONDS.count(stage='listing'), stages['listing'])
+        self.assertGreater(STAGE_SECONDS.count(stage='db_write'), stages['db_write'])
+        self.assertGreaterEqual(HTTP_REQUESTS.value(status='200') - ok_requests, 3)
+        self.assertEqual(PROCESSED_FILES.value() - processed, 3)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('yamlforge_stage_duration_seconds_bucket{stage="fetch",le="+Inf"}', body)
+        self.assertIn('yamlforge_bitbucket_requests_total{status="200"}', body)
+        self.assertIn('yamlforge_fetched_bytes_total', body)
+
+    def test_cache_results_are_counted(self):
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        reader = BitbucketYAMLReader('token', 'ws', 'repo')
+        hits, misses = PARSE_CACHE.value(result='hit'), PARSE_CACHE.value(result='miss')
+        content = service_yaml('metrics-orders', port=9123)
+        RepositoryParser(repository, reader).process_files([('a.yml', content), ('b.yml', content)])
+        # Identical content is parsed once and looked up once
+        self.assertEqual(PARSE_CACHE.value(result='miss') - misses, 1)
+        self.assertEqual(PARSE_CACHE.value(result='hit') - hits, 0)
+        RepositoryParser(repository, reader).process_files([('a.yml', content)])
+        self.assertEqual(PARSE_CACHE.value(result='hit') - hits, 1)
+
+        before = {result: RESPONSE_CACHE.value(result=result) for result in ('miss', 'hit', 'not_modified')}
+        first = self.client.get('/api/service-catalog/')
+        self.client.get('/api/service-catalog/')
+        self.client.get('/api/service-catalog/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual({result: RESPONSE_CACHE.value(result=result) - count for result, count in before.items()},
+                         {'miss': 1, 'hit': 1, 'not_modified': 1})
+        self.assertIn('yamlforge_response_cache_hit_ratio', self.client.get('/metrics').content.decode())
+
+
+class ExtractionRuleTests(TestCase):
+    def extract(self, data, extra_rules=()):
+        with mock.patch('builtins.print'):
+            return SpringBootServiceExtractor(extra_rules=list(extra_rules)).extract_service_info(data)
+
+    def test_default_rules_cover_every_document(self):
+        info = self.extract({
+            'document_0': {'spring': {
+                'application': {'name': 'orders', 'version': '1.0'},
+                'server': {'port': '${PORT:9090}'},
+                'app': {'external-services': {'billing': {'url': 'http://billing'}}, 'queues': {'jobs': {}}},
+                'datasource': {'primary': {'url': 'jdbc:postgresql://db'}, 'url': 'ignored'},
+            }},
+            'document_1': {'spring': {'server': {'port': 8443, 'ssl': {'enabled': True}},
+                                      'profiles': {'active': 'prod'}, 'redis': {'host': 'cache'}}},
+        })
+
+        self.assertEqual(info['service_name'], {'value': 'orders'})
+        self.assertEqual(info['version'], '1.0')
+        self.assertEqual(info['port'], {'value': '9090'})
+        self.assertEqual(info['protocol'], {'value': 'https'})
+        self.assertEqual(info['profiles'], ['prod'])
+        self.assertEqual(info['dependent_services'], [
+            {'name': 'billing', 'details': {'url': 'http://billing'}},
+            {'name': 'jobs', 'type': 'queue', 'details': {}},
+        ])
+        self.assertEqual(info['dependent_infrastructure'], [
+            {'type': 'primary', 'details': {'url': 'jdbc:postgresql://db'}},
+            {'type': 'redis', 'details': {'host': 'cache'}},
+        ])
+        self.assertEqual(info['additional_data'], {})
+
+    def test_configured_rules_extend_the_defaults(self):
+        rules = [
+            {'field': 'dependent_infrastructure', 'path': 'spring.data.*', 'item': {'type': '{key}', 'details': '{value}'}},
+            {'field': 'endpoints', 'path': 'management.endpoints.web.exposure.include'},
+        ]
+        info = self.extract({
+            'spring': {'application': {'name': 'orders'}, 'data': {'mongodb': {'host': 'db'}}},
+            'management': {'endpoints': {'web': {'exposure': {'include': 'health,info'}}}},
+        }, rules)
+
+        self.assertEqual(info['dependent_infrastructure'], [{'type': 'mongodb', 'details': {'host': 'db'}}])
+        self.assertEqual(info['additional_data'], {'endpoints': ['health,info']})
+        self.assertEqual(info['protocol'], {'value': 'http'})
+
+    def test_documents_that_are_not_mappings_match_nothing(self):
+        info = self.extract(['not', 'a', 'mapping'])
+
+        self.assertEqual(info['service_name'], {'value': None})
+        self.assertIsNone(info['port'])
+
+
+class FuzzyMatchTests(TestCase):
+    def setUp(self):
+        self.extractor = SpringBootServiceExtractor(extra_rules=[])
+        self.keys = ['spring.application.name', 'server.port', 'spring.redis.host', 'management.port', 'app.name']
+
+    def test_batched_matches_agree_with_per_pattern_matching(self):
+        matches = self.extractor.match_fields(self.keys)
+
+        self.assertEqual(set(matches), set(self.extractor.field_patterns))
+        for field, match in matches.items():
+            self.assertEqual(match, self.extractor.best_match_per_pattern(field, self.keys), field)
+        self.assertEqual(matches['service_name'], ('spring.application.name', 100.0, 0))
+
+    def test_matching_without_numpy_falls_back_to_extract_one(self):
+        with mock.patch('yaml_parser.service_extractor.np', None):
+            matches = self.extractor.match_fields(self.keys, ['port'])
+
+        self.assertEqual(matches, {'port': ('server.port', 100.0, 1)})
+
+    def test_fuzzy_extraction_matches_every_field_once(self):
+        with mock.patch.object(self.extractor, 'match_fields', wraps=self.extractor.match_fields) as match_fields, \
+                mock.patch('yaml_parser.service_extractor.process.extractOne') as extract_one:
+            info = self.extractor.extract_fuzzy({'spring': {'application': {'name': 'orders'}}, 'server': {'port': 8080}})
+
+        match_fields.assert_called_once()
+        extract_one.assert_not_called()
+        self.assertEqual(info['service_name']['value'], 'orders')
+        self.assertEqual(info['port']['value'], '8080')
+
+    def test_spring_documents_fall_back_to_fuzzy_matching(self):
+        info = self.extractor.extract_service_info({'spring': {'app': {'name': 'billing'}}, 'server': {'port': 8081}})
+
+        self.assertEqual(info['service_name']['value'], 'billing')
+        self.assertEqual(info['service_name']['matched_field'], 'spring.app.name')
+        self.assertEqual(info['port']['value'], '8081')
+        self.assertEqual(info['port']['matched_field'], 'server.port')
+
+    def test_rule_matches_win_over_fuzzy_matches(self):
+        documents = [{'spring': {'app': {'name': 'guess'}}},
+                     {'spring': {'application': {'name': 'orders'}, 'server': {'port': 8080}}}]
+
+        info = self.extractor.extract_from_documents(documents)
+
+        self.assertEqual(info['service_name'], {'value': 'orders'})
+        self.assertEqual(info['port'], {'value': '8080'})
+
+    def test_other_documents_are_not_fuzzy_matched(self):
+        with mock.patch.object(self.extractor, 'match_fields') as match_fields:
+            info = self.extractor.extract_service_info({'name': 'CI', 'on': {'push': {}}, 'port': 1})
+
+        match_fields.assert_not_called()
+        self.assertEqual(info['service_name'], {'value': None})
+        self.assertIsNone(info['port'])
+
+
+class FlattenTests(TestCase):
+    def setUp(self):
+        self.extractor = SpringBootServiceExtractor(extra_rules=[])
+
+    def test_flatten_dict_key_format(self):
+        data = {'spring': {'profiles': {'active': ['dev', 'prod']}, 'empty': {}},
+                'routes': [{'id': 'a', 'uri': 'http://a'}, ['nested', 'list']]}
+
+        self.assertEqual(self.extractor.flatten_dict(data), {
+            'spring.profiles.active[0]': 'dev',
+            'spring.profiles.active[1]': 'prod',
+            'routes[0].id': 'a',
+            'routes[0].uri': 'http://a',
+            'routes[1]': ['nested', 'list'],
+        })
+
+    def test_deep_nesting_does_not_recurse(self):
+        data = leaf = {}
+        for _ in range(5000):
+            leaf['level'] = {}
+            leaf = leaf['level']
+        leaf['port'] = 8080
+
+        (path, value), = self.extractor.iter_flat_items(data)
+
+        self.assertEqual(len(path), 5001)
+        self.assertEqual(value, 8080)
+        self.assertEqual(self.extractor.flatten_dict(data), {'level.' * 5000 + 'port': 8080})
+
+    def test_additional_data_streams_flattened_pairs(self):
+        data = {'spring': {'application': {'version': '2.1'}},
+                'management': {'endpoints': {'web': {'exposure': {'include': 'health, info'}}}}}
+
+        additional = self.extractor.extract_additional_data(self.extractor.iter_flat(data))
+
+        self.assertEqual(additional['version'], '2.1')
+        self.assertEqual(additional['endpoints'], ['health', 'info'])
+        self.assertEqual(self.extractor.extract_protocol(self.extractor.iter_flat(data))['value'], 'http')
+        self.assertEqual(additional, self.extractor.extract_additional_data(self.extractor.flatten_dict(data)))
+
+    def test_fuzzy_extraction_streams_unmatched_fields(self):
+        data = {'server': {'ssl': {'enabled': True}}, 'spring': {'profiles': {'active': 'prod'}}}
+
+        with mock.patch.object(self.extractor, 'flatten_dict') as flatten_dict:
+            info = self.extractor.extract_fuzzy(data, ['protocol', 'additional_data'])
+
+        flatten_dict.assert_not_called()
+        self.assertEqual(info['protocol']['value'], 'https')
+        self.assertEqual(info['additional_data']['profiles'], ['prod'])
+
+
+@override_settings(PARSE_JOB_RUNNER='worker', BITBUCKET_RATE_LIMIT=0)
+class ParseJobTests(TestCase):
+    def test_parse_request_returns_job_and_reports_progress(self):
+        files = {f"svc-{i}/application.yml": service_yaml(f"svc-{i}") for i in range(5)}
+        with StubBitbucketServer(files) as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            response = self.client.post('/api/parse-repository/', {
+                'workspace': 'ws', 'repository': 'repo', 'access_token': 'token'
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()['job_id']
+            self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'queued')
+
+            run_parse_job(job_id)
+
+        job = self.client.get(f'/api/parse-jobs/{job_id}/').json()
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['processed_files'], 5)
+        self.assertEqual(job['total_files'], 5)
+        self.assertIsNotNone(job['files_per_second'])
+        self.assertEqual(len(job['result']['services']), 5)
+        self.assertNotIn('parsed_data', job['result']['files'][0])
+
+    def test_invalid_options_are_rejected(self):
+        invalid = [{'max_depth': 'deep'}, {'max_depth': -1}, {'include': 'services/*'}, {'exclude': [['vendor']]}]
+        for url in ['/api/parse-repository/', '/api/parse-repository/async/', '/api/parse-batch/']:
+            for options in invalid:
+                response = self.client.post(url, {
+                    'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'sync': True, **options
+                }, content_type='application/json')
+
+                self.assertEqual(response.status_code, 400, (url, options))
+                self.assertRegex(response.json()['error'], rf'^{next(iter(options))}(\[\d+\])?: ')
+        self.assertFalse(Repository.objects.exists())
+        self.assertFalse(ParseJob.objects.exists())
+
+    def test_invalid_list_items_are_reported_by_position(self):
+        for url in ['/api/parse-repository/', '/api/parse-repository/stream/', '/api/parse-batch/']:
+            for include, error in [(['services/*', {}], 'include[1]: Not a valid string.'),
+                                   ([{}], 'include[0]: Not a valid string.')]:
+                response = self.client.post(url, {
+                    'workspace': 'ws', 'repository': 'repo', 'access_token': 'token', 'sync': True,
+                    'include': include
+                }, content_type='application/json')
+
+                self.assertEqual(response.status_code, 400, (url, include))
+                self.assertEqual(response.json()['error'], error)
+        self.assertFalse(Repository.objects.exists())
+
+    def test_non_object_bodies_are_rejected(self):
+        urls = ['/api/parse-repository/', '/api/parse-repository/stream/', '/api/parse-repository/async/',
+                '/api/parse-batch/']
+        for url in urls:
+            for body in [['ws', 'repo', 'token'], 'ws/repo', 3]:
+                response = self.client.post(url, json.dumps(body), content_type='application/json')
+
+                self.assertEqual(response.status_code, 400, (url, body))
+                self.assertEqual(response.json()['error'], 'Request body must be a JSON object')
+
+            response = self.client.post(url, '{"workspace": ', content_type='application/json')
+            self.assertEqual(response.status_code, 400, url)
+            self.assertTrue(response.json()['error'].startswith('JSON parse error'), url)
+        self.assertFalse(Repository.objects.exists())
+
+    def test_job_runs_only_once(self):
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        job = ParseJob.objects.create(repository=repository, status=ParseJob.STATUS_SUCCEEDED)
+        with mock.patch('yaml_parser.jobs.build_parser') as build_parser:
+            self.assertEqual(run_parse_job(job.id).status, ParseJob.STATUS_SUCCEEDED)
+        build_parser.assert_not_called()
+
+    def test_failures_are_recorded(self):
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        job = ParseJob.objects.create(repository=repository)
+        with mock.patch('yaml_parser.jobs.build_parser', side_effect=RuntimeError('boom')), \
+                self.assertLogs('yaml_parser.jobs', 'ERROR') as logs:
+            run_parse_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ParseJob.STATUS_FAILED)
+        self.assertIn('boom', job.error)
+        self.assertIn('Error parsing repository ws/repo', logs.output[0])
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
+
+@override_settings(PARSE_JOB_RUNNER='worker', BITBUCKET_RATE_LIMIT=0)
+class ParseWorkerCommandTests(TransactionTestCase):
+    def test_worker_drains_queue(self):
+        with StubBitbucketServer({'application.yml': service_yaml('orders')}) as stub:
+            with override_settings(BITBUCKET_API_URL=stub.base_url):
+                for name in ('repo', 'other'):
+                    repository = Repository.objects.create(workspace='ws', repository=name, access_token='token')
+                    ParseJob.objects.create(repository=repository)
+                call_command('run_parse_worker', '--once', '--workers', '1', stdout=io.StringIO())
+
+        self.assertEqual(list(ParseJob.objects.values_list('status', flat=True)), [ParseJob.STATUS_SUCCEEDED] * 2)
+        self.assertEqual(list(Service.objects.values_list('yaml_file__repository__repository', flat=True)), ['repo'])
+
+
+class FairSchedulerTests(TestCase):
+    def test_slots_rotate_between_repositories(self):
+        scheduler = FairScheduler(concurrency=1)
+        scheduler.acquire('big')
+        order = []
+
+        def request(key):
+            with scheduler.slot(key):
+                order.append(key)
+
+        threads = []
+        for key in ['big', 'big', 'big', 'small']:
+            threads.append(threading.Thread(target=request, args=(key,)))
+            threads[-1].start()
+            while sum(len(queue) for queue in scheduler._waiting.values()) < len(threads):
+                time.sleep(0.001)
+        scheduler.release('big')
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ['big', 'small', 'big', 'big'])
+        self.assertEqual(scheduler.max_in_flight, 1)
+        self.assertEqual(scheduler.requests, {'big': 4, 'small': 1})
+
+    def test_retries_wait_for_a_slot_without_holding_one(self):
+        scheduler = FairScheduler(concurrency=1)
+        finished = []
+
+        with StubBitbucketServer({'a.yml': 'a: 1\n', 'b.yml': 'b: 1\n'}) as stub:
+            stub.failures['a.yml'] = [503]
+
+            def request(key, path):
+                client = scheduler.client_for(BitbucketHTTPClient('token'), key)
+                client.get(f"{stub.base_url}/repositories/ws/repo/src/main/{path}")
+                finished.append(key)
+
+            with mock.patch.object(BitbucketHTTPClient, 'retry_after', return_value=0.3):
+                retrying = threading.Thread(target=request, args=('retrying', 'a.yml'))
+                retrying.start()
+                while stub.failures['a.yml']:
+                    time.sleep(0.001)
+                request('other', 'b.yml')
+                retrying.join()
+
+        # The other repository's request went through during the backoff
+        self.assertEqual(finished, ['other', 'retrying'])
+        self.assertEqual(scheduler.requests, {'retrying': 2, 'other': 1})
+
+
+@override_settings(PARSE_JOB_RUNNER='worker', BITBUCKET_RATE_LIMIT=0)
+class ParseBatchTests(TransactionTestCase):
+    def setUp(self):
+        parse_cache.clear()
+        cache.clear()
+
+    def stub(self):
+        stub = StubBitbucketServer({'application.yml': service_yaml('repo-service')}, latency=0.01)
+        stub.repositories['alpha'] = {f"svc-{i}/application.yml": service_yaml(f"alpha-{i}") for i in range(4)}
+        stub.repositories['beta'] = {'application.yml': service_yaml('beta')}
+        return stub
+
+    def test_workspace_batch_parses_every_repository_under_one_budget(self):
+        with self.stub() as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            response = self.client.post('/api/parse-batch/', {
+                'workspace': 'ws', 'access_token': 'token', 'concurrency': 2
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 202)
+            run_parse_batch(response.json()['batch_id'])
+
+        batch = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(batch['status'], 'succeeded')
+        self.assertEqual([job['status'] for job in batch['jobs']], ['succeeded'] * 3)
+        self.assertEqual(batch['processed_files'], 6)
+        self.assertEqual(batch['result']['services_extracted'], 6)
+        self.assertEqual(batch['result']['max_in_flight'], 2)
+        self.assertCountEqual(batch['result']['requests_per_repository'], ['ws/alpha', 'ws/beta', 'ws/repo'])
+        self.assertLessEqual(stub.max_in_flight, 3)
+        self.assertEqual(Service.objects.count(), 6)
+
+    def test_command_parses_listed_repositories(self):
+        out = io.StringIO()
+        with self.stub() as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            call_command('parse_batch', '--workspace', 'ws', '--access-token', 'token',
+                         '--repository', 'alpha', '--repository', 'beta', stdout=out)
+
+        self.assertIn('Parsed 5 files from 2/2 repositories', out.getvalue())
+        self.assertCountEqual(Repository.objects.values_list('repository', flat=True), ['alpha', 'beta'])
+        self.assertEqual(Service.objects.count(), 5)
+
+    def test_invalid_budget_options_are_rejected(self):
+        invalid = [{'rate_limit': 'fast'}, {'rate_limit': -5}, {'repository_concurrency': 'many'},
+                   {'repository_concurrency': 0}, {'concurrency': -1}]
+        for options in invalid:
+            response = self.client.post('/api/parse-batch/', {
+                'repositories': [{'workspace': 'ws', 'repository': 'repo', 'access_token': 'token'}], **options
+            }, content_type='application/json')
+
+            self.assertEqual(response.status_code, 400, options)
+            self.assertTrue(response.json()['error'].startswith(f'{next(iter(options))}: '))
+        with self.assertRaisesMessage(CommandError, 'rate_limit: '):
+            call_command('parse_batch', '--workspace', 'ws', '--access-token', 'token', '--rate-limit', '-5')
+        self.assertFalse(Repository.objects.exists())
+        self.assertFalse(ParseBatch.objects.exists())
+
+    def test_queued_batches_are_run_by_the_worker(self):
+        with self.stub() as stub, override_settings(BITBUCKET_API_URL=stub.base_url):
+            self.client.post('/api/parse-batch/', {
+                'repositories': [{'workspace': 'ws', 'repository': 'beta', 'access_token': 'token'}]
+            }, content_type='application/json')
+            call_command('run_parse_worker', '--once', stdout=io.StringIO())
+
+        self.assertEqual(ParseBatch.objects.get().status, ParseBatch.STATUS_SUCCEEDED)
+        self.assertEqual(ParseJob.objects.get().status, ParseJob.STATUS_SUCCEEDED)
+
+    def test_invalid_batches_are_rejected(self):
+        empty = self.client.post('/api/parse-batch/', {}, content_type='application/json')
+        incomplete = self.client.post('/api/parse-batch/', {
+            'repositories': [{'workspace': 'ws', 'repository': 'alpha'}]
+        }, content_type='application/json')
+
+        self.assertEqual(empty.status_code, 400)
+        self.assertIn('access_token', incomplete.json()['error'])
+        self.assertFalse(ParseBatch.objects.exists())
+
+
+class BulkPersistenceTests(TestCase):
+    def setUp(self):
+        parse_cache.clear()
+        self.repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        self.reader = BitbucketYAMLReader('token', 'ws', 'repo')
+
+    def process(self, files, **options):
+        parser = RepositoryParser(self.repository, self.reader, **options)
+        with CaptureQueriesContext(connection) as queries:
+            parser.process_files(files.items())
+        return [q['sql'] for q in queries.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+
+    def test_writes_use_a_fixed_number_of_queries(self):
+        files = {f"svc-{i:03d}/application.yml": service_yaml(f"svc-{i:03d}") for i in range(200)}
+        queries = self.process(files, batch_size=200, write_batch_size=500)
+
+        # SQLite splits each bulk insert at its 999 parameter limit
+        writes = [sql for sql in queries if sql.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertLessEqual(len(writes), 8)
+        self.assertLessEqual(len(queries), 12)
+        self.assertEqual(YAMLFile.objects.count(), 200)
+        self.assertEqual(Service.objects.count(), 200)
+
+    def test_upsert_updates_rows_and_drops_stale_services(self):
+        self.process({'a.yml': service_yaml('orders'), 'b.yml': service_yaml('billing')})
+        created_at = YAMLFile.objects.get(file_path='a.yml').created_at
+
+        self.process({'a.yml': service_yaml('orders', port=9090), 'b.yml': service_yaml('payments')})
+
+        self.assertEqual(YAMLFile.objects.count(), 2)
+        self.assertEqual(YAMLFile.objects.get(file_path='a.yml').created_at, created_at)
+        self.assertEqual(Service.objects.get(service_name='orders').port, '9090')
+        self.assertCountEqual(Service.objects.values_list('service_name', flat=True), ['orders', 'payments'])
+
+    def parse_spooled(self, files, **options):
+        held = []
+        append = DocumentSpool.append
+
+        def tracked_append(spool, document):
+            append(spool, document)
+            held.append(len(spool.documents))
+
+        parser = RepositoryParser(self.repository, self.reader, write_batch_size=10, spool_documents=5, **options)
+        with mock.patch.object(DocumentSpool, 'append', tracked_append):
+            results = list(parser.iter_processed_files(files.items()))
+        return results, max(held)
+
+    def test_large_multi_document_files_are_not_held_in_memory(self):
+        content = '---\n'.join([f"item: {i}\n" for i in range(40)] + [service_yaml('orders')])
+        results, held = self.parse_spooled({'manifest.yml': content})
+
+        self.assertLessEqual(held, 10)
+        self.assertIsNone(results[0]['parsed_data'])
+        self.assertEqual(results[0]['service']['service_name'], 'orders')
+        yaml_file = YAMLFile.objects.get()
+        self.assertEqual(yaml_file.document_count, 41)
+        self.assertEqual(yaml_file.parsed_documents(), [{'item': i} for i in range(40)] + [yaml.safe_load(service_yaml('orders'))])
+        self.assertEqual(Service.objects.get().service_name, 'orders')
+
+        # Unchanged content is parsed again for its service without keeping the documents
+        results, held = self.parse_spooled({'manifest.yml': content})
+        self.assertLessEqual(held, 5)
+        self.assertEqual(results[0]['service']['service_name'], 'orders')
+        self.assertEqual(YAMLDocument.objects.count(), 40 + 1)
+
+    def test_spooled_file_is_rolled_back_when_the_yaml_is_invalid(self):
+        self.process({'manifest.yml': service_yaml('orders')})
+        content = '---\n'.join([f"item: {i}\n" for i in range(20)] + ['a: [1\n'])
+
+        results, _ = self.parse_spooled({'manifest.yml': content})
+
+        self.assertIsNone(results[0]['service'])
+        self.assertEqual(YAMLFile.objects.get().content, content)
+        self.assertEqual(YAMLFile.objects.get().document_count, 0)
+        self.assertFalse(YAMLDocument.objects.exists())
+
+
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        parse_cache.clear()
+        self.repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        self.reader = BitbucketYAMLReader('token', 'ws', 'repo')
+
+    def process(self, files, repository=None):
+        parser = RepositoryParser(repository or self.repository, self.reader)
+        parser.process_files(files.items())
+        return parser
+
+    def test_identical_content_is_stored_once(self):
+        other = Repository.objects.create(workspace='ws', repository='other', access_token='token')
+        content = service_yaml('orders')
+        self.process({'a.yml': content, 'b.yml': content})
+        self.process({'c.yml': content}, repository=other)
+
+        blob = ContentBlob.objects.get()
+        self.assertEqual(blob.codec, blobs.DEFAULT_CODEC)
+        self.assertEqual(blob.size, len(content))
+        self.assertEqual(blob.text, content)
+        self.assertEqual(YAMLFile.objects.filter(blob=blob).count(), 3)
+        self.assertEqual(YAMLFile.objects.get(file_path='c.yml').content, content)
+
+    def test_unused_blobs_are_pruned(self):
+        self.process({'a.yml': service_yaml('orders'), 'b.yml': service_yaml('orders')})
+        self.process({'a.yml': service_yaml('orders', port=9090)})
+        self.assertEqual(ContentBlob.objects.count(), 2)
+
+        self.process({'b.yml': service_yaml('orders', port=9090)})
+        self.assertEqual(ContentBlob.objects.get().text, service_yaml('orders', port=9090))
+
+        RepositoryParser(self.repository, self.reader).delete_files(['a.yml', 'b.yml'])
+        self.assertFalse(ContentBlob.objects.exists())
+
+    def test_content_is_only_loaded_when_asked_for(self):
+        self.process({f'svc-{i}.yml': service_yaml(f'svc-{i}') for i in range(3)})
+        url = f'/api/repositories/{self.repository.id}/files/'
+
+        with CaptureQueriesContext(connection) as queries:
+            files = self.client.get(url).json()['files']
+        self.assertNotIn('content', files[0])
+        self.assertFalse(any('yaml_parser_contentblob' in query['sql'] for query in queries.captured_queries))
+
+        with CaptureQueriesContext(connection) as queries:
+            files = self.client.get(url, {'include': 'content'}).json()['files']
+        self.assertEqual([f['content'] for f in files], [service_yaml(f'svc-{i}') for i in range(3)])
+        self.assertEqual(sum('yaml_parser_contentblob' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_codecs_round_trip(self):
+        content = service_yaml('orders') * 50
+        codecs = [blobs.ZLIB] + ([blobs.ZSTD] if blobs.zstandard else [])
+        for codec in codecs:
+            data = blobs.compress(content, codec)
+            self.assertLess(len(data), len(content) / 5)
+            self.assertEqual(blobs.decompress(data, codec), content)
+        with self.assertRaises(ValueError):
+            blobs.compress(content, 'lz4')
+
+
+class QueryBudgetTests(TestCase):
+    """List endpoints run a fixed number of queries, whatever the number of rows"""
+
+    # Query count of each endpoint, version lookups included
+    BUDGETS = {
+        '/api/repositories/': 2,
+        '/api/yaml-files/': 2,
+        '/api/yaml-files/?include=content': 2,
+        '/api/repositories/{repository}/files/': 3,
+        '/api/repositories/{repository}/files/?include=content': 3,
+        '/api/service-catalog/': 3,
+        '/api/service-catalog/?fields=id,yaml_file_info': 4,
+        '/api/service-catalog/?fields=id,yaml_file_info&include=content': 4,
+        '/api/parse-batches/{batch}/': 3,
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.batch = ParseBatch.objects.create()
+        self.repository = self.add_repository()
+
+    def add_repository(self, files=3):
+        """A repository of ``files`` files, the first of them with three documents, each defining a service"""
+        repository = Repository.objects.create(workspace='ws', repository=f'repo-{Repository.objects.count()}',
+                                               access_token='token')
+        ParseJob.objects.create(repository=repository, batch=self.batch)
+        for i in range(files):
+            content = service_yaml(f'{repository.repository}-svc-{i}')
+            blob = ContentBlob.for_content(content)
+            blob.save()
+            yaml_file = YAMLFile.objects.create(repository=repository, file_path=f'svc-{i}.yml', blob=blob,
+                                                parsed_data=None if i == 0 else yaml.safe_load(content),
+                                                document_count=3 if i == 0 else 1)
+            if i == 0:
+                YAMLDocument.objects.bulk_create(
+                    YAMLDocument(yaml_file=yaml_file, index=index, parsed_data={'index': index}) for index in range(3))
+            Service.objects.create(yaml_file=yaml_file, service_name=f'{repository.repository}-svc-{i}', port='8080')
+        return repository
+
+    def query_counts(self):
+        counts = {}
+        for url in self.BUDGETS:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url.format(repository=self.repository.id, batch=self.batch.id))
+            self.assertEqual(response.status_code, 200, url)
+            counts[url] = len(queries.captured_queries)
+        return counts
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        self.assertEqual(self.query_counts(), self.BUDGETS)
+
+        for _ in range(5):
+            self.add_repository(files=10)
+        self.add_repository(files=30)
+        self.assertEqual(self.query_counts(), self.BUDGETS)
+
+    def test_flat_serializers_match_the_model_serializers(self):
+        yaml_files = YAMLFile.objects.order_by('file_path')
+        for include_content in [False, True]:
+            flat = FlatYAMLFileSerializer(include_content=include_content)
+            expected = YAMLFileSerializer(yaml_files, many=True, context={'include_content': include_content}).data
+            self.assertEqual(json.dumps(flat.serialize(flat.values(yaml_files))), json.dumps(expected))
+
+        services = Service.objects.order_by('service_name', 'id')
+        for fields in [[], ['port', 'service_name', 'repository_info']]:
+            flat = FlatServiceCatalogSerializer(fields)
+            expected = ServiceCatalogSerializer(services, many=True, fields=fields).data
+            self.assertEqual(json.dumps(flat.serialize(flat.values(services))), json.dumps(expected))
+        self.assertFalse(FlatServiceCatalogSerializer.supports(['id', 'yaml_file_info']))
+
+
+class RepositoryDeleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.repository = self.add_repository('repo', files=3)
+
+    def add_repository(self, name, files):
+        """A repository of ``files`` files sharing one blob, each with a service and the first with two documents"""
+        repository = Repository.objects.create(workspace='ws', repository=name, access_token='token')
+        ParseJob.objects.create(repository=repository)
+        blob = ContentBlob.for_content(service_yaml(name))
+        blob.save()
+        for i in range(files):
+            yaml_file = YAMLFile.objects.create(repository=repository, file_path=f'svc-{i}.yml', blob=blob,
+                                                document_count=2 if i == 0 else 1)
+            if i == 0:
+                YAMLDocument.objects.bulk_create(YAMLDocument(yaml_file=yaml_file, index=index) for index in range(2))
+            Service.objects.create(yaml_file=yaml_file, service_name=f'{name}-{i}')
+        return repository
+
+    def delete(self, repository):
+        return self.client.delete(f'/api/repositories/{repository.id}/delete/')
+
+    def test_deletion_is_set_based(self):
+        with CaptureQueriesContext(connection) as small:
+            response = self.delete(self.repository)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['deleted_items'], {'repository': 1, 'yaml_files': 3, 'services': 3})
+
+        large = self.add_repository('large', files=40)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.delete(large)
+        self.assertEqual(response.json()['deleted_items'], {'repository': 1, 'yaml_files': 40, 'services': 40})
+        self.assertEqual(len(queries.captured_queries), len(small.captured_queries))
+        for model in [Repository, YAMLFile, YAMLDocument, Service, ParseJob, ContentBlob]:
+            self.assertFalse(model.objects.exists(), model.__name__)
+
+    def test_blobs_still_in_use_are_kept(self):
+        other = Repository.objects.create(workspace='ws', repository='other', access_token='token')
+        YAMLFile.objects.create(repository=other, file_path='a.yml', blob=YAMLFile.objects.first().blob)
+
+        self.delete(self.repository)
+        self.assertEqual(ContentBlob.objects.get().yaml_files.get().repository, other)
+
+    def test_deletion_invalidates_the_catalog(self):
+        catalog = self.client.get('/api/service-catalog/')
+        self.delete(self.repository)
+
+        response = self.client.get('/api/service-catalog/', HTTP_IF_NONE_MATCH=catalog['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['services'], [])
+
+    @override_settings(REPOSITORY_DELETE_BACKGROUND_FILES=2)
+    def test_large_repositories_are_deleted_in_the_background(self):
+        with mock.patch('yaml_parser.jobs.get_executor') as get_executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.delete(self.repository)
+            # Asking again while it is queued returns the same deletion
+            self.assertEqual(self.delete(self.repository).json()['deletion_id'], response.json()['deletion_id'])
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['pending_items'], {'repository': 1, 'yaml_files': 3, 'services': 3})
+        deletion_id = response.json()['deletion_id']
+        get_executor.return_value.submit.assert_called_once_with(run_deletion_in_thread, deletion_id)
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'queued')
+        self.assertTrue(Repository.objects.exists())
+
+        self.assertEqual(run_repository_deletion(deletion_id).status, RepositoryDeletion.STATUS_SUCCEEDED)
+        deletion = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(deletion['deleted_items'], {'repository': 1, 'yaml_files': 3, 'services': 3})
+        self.assertEqual(deletion['repository_name'], 'ws/repo')
+        self.assertIsNone(deletion['repository'])
+        self.assertFalse(Repository.objects.exists())
+        self.assertFalse(Service.objects.exists())
+        # A deletion only runs once
+        with mock.patch('yaml_parser.jobs.delete_repository') as delete_repository:
+            run_repository_deletion(deletion_id)
+        delete_repository.assert_not_called()
+
+    @override_settings(REPOSITORY_DELETE_BACKGROUND_FILES=2, PARSE_JOB_RUNNER='worker')
+    def test_failed_deletions_are_recorded_and_retried(self):
+        response = self.delete(self.repository)
+        with mock.patch('yaml_parser.jobs.delete_repository', side_effect=RuntimeError('locked')), \
+                self.assertLogs('yaml_parser.jobs', 'ERROR'):
+            run_repository_deletion(claim_next_deletion(), claimed=True)
+
+        deletion = RepositoryDeletion.objects.get(pk=response.json()['deletion_id'])
+        self.assertEqual(deletion.status, RepositoryDeletion.STATUS_FAILED)
+        self.assertEqual(deletion.error, 'Error deleting repository: locked')
+        self.assertTrue(Service.objects.exists())
+
+        retry = self.delete(self.repository)
+        self.assertNotEqual(retry.json()['deletion_id'], deletion.id)
+        self.assertEqual(claim_next_deletion(), retry.json()['deletion_id'])
+        run_repository_deletion(retry.json()['deletion_id'], claimed=True)
+
+        self.assertEqual(RepositoryDeletion.objects.get(pk=retry.json()['deletion_id']).status,
+                         RepositoryDeletion.STATUS_SUCCEEDED)
+        self.assertFalse(Repository.objects.exists())
+
+
+@skipUnless(json_backend.orjson, 'orjson is not installed')
+class ORJSONTests(TestCase):
+    data = {
+        'created_at': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'port': Decimal('8080'),
+        'mapping': {200: 'ok', 1.5: 'half', True: 'yes', None: 'none'},
+        'text': 'caf\u00e9 \u2028 \U0001f680',
+        'nested': [{'a': [1, 2.5, None, False]}],
+    }
+
+    def test_renderer_matches_json_renderer(self):
+        self.assertIs(api_settings.DEFAULT_RENDERER_CLASSES[0], ORJSONRenderer)
+        self.assertEqual(ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_renderer_falls_back_for_what_orjson_cannot_write(self):
+        for data, media_type in [({'big': 2 ** 70}, None), (self.data, 'application/json; indent=2')]:
+            self.assertEqual(ORJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+    def test_parser(self):
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(b'{"a": [1, "\xc3\xa9"]}')), {'a': [1, '\u00e9']})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"a":'))
+
+    def test_json_fields_round_trip(self):
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        blob = ContentBlob.for_content('a: 1\n')
+        blob.save()
+        YAMLFile.objects.create(repository=repository, file_path='a.yml', blob=blob,
+                                parsed_data={'status': {200: 'ok'}, 'name': 'caf\u00e9'})
+        # Written by the json fallback
+        YAMLFile.objects.create(repository=repository, file_path='b.yml', blob=blob, parsed_data={'big': 2 ** 70})
+
+        self.assertEqual(YAMLFile.objects.get(file_path='a.yml').parsed_data,
+                         {'status': {'200': 'ok'}, 'name': 'caf\u00e9'})
+        self.assertEqual(YAMLFile.objects.get(file_path='b.yml').parsed_data, {'big': 2 ** 70})
+        self.assertTrue(YAMLFile.objects.filter(parsed_data__name='caf\u00e9').exists())
+
+    def test_values_orjson_cannot_read_round_trip(self):
+        repository = Repository.objects.create(workspace='ws', repository='repo', access_token='token')
+        content = 'big: 123456789012345678901234567890\na: .inf\nb: .nan\nc: -.inf\n'
+        blob = ContentBlob.for_content(content)
+        blob.save()
+        YAMLFile.objects.create(repository=repository, file_path='a.yml', blob=blob, parsed_data=yaml.safe_load(content))
+
+        # Written by the json fallback because of the long integer; non-finite floats become null as with orjson
+        self.assertEqual(YAMLFile.objects.get().parsed_data,
+                         {'big': 123456789012345678901234567890, 'a': None, 'b': None, 'c': None})
+
+        # Tokens json writes with its defaults
+        decoded = json.loads('{"big": 123456789012345678901234567890, "a": Infinity, "b": NaN, "n": 18446744073709551615}',
+                             cls=json_backend.ORJSONDecoder)
+        self.assertEqual(decoded['big'], 123456789012345678901234567890)
+        self.assertEqual(decoded['a'], float('inf'))
+        self.assertTrue(math.isnan(decoded['b']))
+        self.assertEqual(decoded['n'], 18446744073709551615)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are read with SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTests(TestCase):
+    """Catalog and file listing queries stay index-backed with 100k files and services"""
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000)
+                INSERT INTO yaml_parser_repository
+                    (workspace, repository, access_token, last_commit, generation, created_at, updated_at)
+                SELECT 'ws', 'repo-' || i, 'token', '', 0, datetime('now'), datetime('now') FROM n
+            """)
+            blob = ContentBlob.for_content(service_yaml('svc'))
+            blob.save()
+            cursor.execute("""
+                WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < 99999)
+                INSERT INTO yaml_parser_yamlfile
+                    (repository_id, file_path, content_digest, parsed_data, document_count, created_at)
+                SELECT (SELECT MIN(id) FROM yaml_parser_repository) + i % 1000, 'svc-' || i || '/application.yml',
+                       %s, '{}', 1, datetime('now')
+                FROM n
+            """, [blob.digest])
+            cursor.execute("""
+                INSERT INTO yaml_parser_service (yaml_file_id, service_name, port, protocol, created_at, updated_at)
+                SELECT id, 'svc-' || id, '8080', 'http', datetime('now'), datetime('now') FROM yaml_parser_yamlfile
+            """)
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_index_backed(self, url):
+        """Request ``url``, failing if any of its queries scans a large table or sorts without an index"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertNotIn('TEMP B-TREE', step, f"{query['sql']}\n{plan}")
+                scan = re.match(r'SCAN (\w+)$', step)
+                # Catalog versions read every repository row by design
+                if scan and scan.group(1) != 'yaml_parser_repository':
+                    self.fail(f"Full scan of {scan.group(1)}: {query['sql']}\n{plan}")
+        return response
+
+    def test_catalog_pages_walk_the_name_index(self):
+        first = self.get_index_backed('/api/service-catalog/').json()
+        second = self.get_index_backed(first['next']).json()
+        with_files = self.get_index_backed('/api/service-catalog/?fields=yaml_file_info').json()
+
+        self.assertEqual(first['total_count'], 100000)
+        names = [service['service_name'] for service in first['services'] + second['services']]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(set(names)), 200)
+        self.assertEqual(len(with_files['services']), 100)
+
+    def test_file_listing_uses_the_repository_index(self):
+        repository = Repository.objects.get(repository='repo-7')
+        data = self.get_index_backed(f'/api/repositories/{repository.id}/files/').json()
+        paths = [yaml_file['file_path'] for yaml_file in data['files']]
+        self.assertEqual(len(paths), 100)
+        self.assertEqual(paths, sorted(paths))
@@ -5,9 +5,16 @@ urlpatterns = [
     path('repositories/', views.RepositoryListCreateView.as_view(), name='repository-list-create'),
     path('repositories/<int:pk>/', views.RepositoryDetailView.as_view(), name='repository-detail'),
     path('repositories/<int:pk>/delete/', views.RepositoryDeleteView.as_view(), name='repository-delete'),
+    path('repository-deletions/<int:pk>/', views.RepositoryDeletionDetailView.as_view(), name='repository-deletion-detail'),
     path('repositories/<int:repository_id>/files/', views.get_repository_files, name='repository-files'),
     path('parse-repository/', views.parse_repository, name='parse-repository'),
+    path('parse-repository/stream/', views.parse_repository_stream, name='parse-repository-stream'),
+    path('parse-repository/async/', views.aparse_repository, name='parse-repository-async'),
+    path('parse-jobs/<int:pk>/', views.ParseJobDetailView.as_view(), name='parse-job-detail'),
+    path('parse-batch/', views.parse_batch, name='parse-batch'),
+    path('parse-batches/<int:pk>/', views.ParseBatchDetailView.as_view(), name='parse-batch-detail'),
     path('yaml-files/', views.YAMLFileListView.as_view(), name='yaml-file-list'),
     path('service-catalog/', views.get_service_catalog, name='service-catalog'),
+    path('service-catalog/async/', views.aget_service_catalog, name='service-catalog-async'),
     path('extract-services/', views.extract_services_from_yaml, name='extract-services'),
 ] 
\ No newline at end of file
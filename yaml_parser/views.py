@@ -1,15 +1,31 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import NotFound, ParseError, ValidationError
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.generics import ListCreateAPIView, RetrieveAPIView, DestroyAPIView
 from django.shortcuts import get_object_or_404
-from .models import Repository, YAMLFile, Service
-from .serializers import RepositorySerializer, YAMLFileSerializer, RepositoryCreateSerializer, ServiceSerializer
-from .bitbucket_reader import BitbucketYAMLReader
+from django.urls import reverse
+from .models import Repository, YAMLFile, Service, ParseBatch, ParseJob, RepositoryDeletion
+from .serializers import RepositorySerializer, YAMLFileSerializer, RepositoryCreateSerializer, ServiceSerializer, ServiceCatalogSerializer, ParseJobSerializer, ParseBatchSerializer, FlatServiceCatalogSerializer, FlatYAMLFileSerializer, ParseOptionsSerializer, RepositoryDeletionSerializer, BatchOptionsSerializer
+from .pagination import ServiceCatalogPagination
 from .service_extractor import SpringBootServiceExtractor
-import json
+from .repository_parser import delete_repository, repository_counts, save_repository, save_service, summary_message
+from .jobs import build_parser, enqueue_parse_job, enqueue_repository_deletion
+from .async_reader import AsyncBitbucketYAMLReader
+from .batch import batch_options, batch_repositories, create_parse_batch
+from .caching import bump_generation, cached_response, catalog_version, repository_version
+from .metrics import CONTENT_TYPE, REGISTRY
+from .renderers import render_json
+import time
 
 # Create your views here.
 
@@ -23,6 +39,10 @@ class RepositoryListCreateView(ListCreateAPIView):
             return RepositoryCreateSerializer
         return RepositorySerializer
 
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, catalog_version(),
+                               lambda: RepositorySerializer(self.get_queryset(), many=True).data)
+
 class RepositoryDetailView(RetrieveAPIView):
     """API view for retrieving repository details"""
     queryset = Repository.objects.all()
@@ -35,154 +55,149 @@ class RepositoryDeleteView(DestroyAPIView):
 
     def destroy(self, request, *args, **kwargs):
         repository = self.get_object()
-        
-        # Delete all related services first
-        services_deleted = 0
-        for yaml_file in repository.yaml_files.all():
-            services_deleted += yaml_file.services.count()
-            yaml_file.services.all().delete()
-        
-        # Delete all YAML files
-        yaml_files_deleted = repository.yaml_files.count()
-        repository.yaml_files.all().delete()
-        
-        # Delete the repository
         repository_name = f"{repository.workspace}/{repository.repository}"
-        repository.delete()
-        
+        counts = repository_counts(repository.pk)
+
+        if counts['yaml_files'] > settings.REPOSITORY_DELETE_BACKGROUND_FILES:
+            # Too large to delete within the request; the repository stays listed until it is gone
+            deletion = enqueue_repository_deletion(repository)
+            return Response({
+                'message': f'Deletion of repository {repository_name} queued',
+                'deletion_id': deletion.id,
+                'status': deletion.status,
+                'status_url': reverse('repository-deletion-detail', args=[deletion.id]),
+                'pending_items': {
+                    'repository': 1,
+                    **counts
+                }
+            }, status=status.HTTP_202_ACCEPTED)
+
+        deleted_items = delete_repository(repository.pk)
         return Response({
             'message': f'Successfully deleted repository {repository_name}',
-            'deleted_items': {
-                'repository': 1,
-                'yaml_files': yaml_files_deleted,
-                'services': services_deleted
-            }
+            'deleted_items': deleted_items
         }, status=status.HTTP_200_OK)
 
 class YAMLFileListView(ListCreateAPIView):
     """API view for listing YAML files"""
-    queryset = YAMLFile.objects.all()
+    queryset = YAMLFile.objects.order_by('repository', 'file_path').select_related('repository').prefetch_related('documents')
     serializer_class = YAMLFileSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.select_related('blob') if include_content(self.request) else queryset
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'include_content': include_content(self.request)}
+
+    def list(self, request, *args, **kwargs):
+        serializer = FlatYAMLFileSerializer(include_content=include_content(request))
+        return Response(serializer.serialize(serializer.values(self.filter_queryset(self.get_queryset()))))
+
 class ServiceListView(ListCreateAPIView):
     """API view for listing services"""
-    queryset = Service.objects.all()
+    queryset = Service.objects.order_by('service_name', 'id').select_related(
+        'yaml_file__repository').prefetch_related('yaml_file__documents')
     serializer_class = ServiceSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.select_related('yaml_file__blob') if include_content(self.request) else queryset
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'include_content': include_content(self.request)}
+
+class RepositoryDeletionDetailView(RetrieveAPIView):
+    """API view for polling a background repository deletion"""
+    queryset = RepositoryDeletion.objects.all()
+    serializer_class = RepositoryDeletionSerializer
+
+class ParseJobDetailView(RetrieveAPIView):
+    """API view for polling the progress and result of a parse job"""
+    queryset = ParseJob.objects.select_related('repository')
+    serializer_class = ParseJobSerializer
+
+def include_content(request):
+    """Whether the request asks for raw file content with ?include=content"""
+    return 'content' in request.query_params.get('include', '').split(',')
+
+def request_object(request):
+    """The body of a request, raising ValidationError unless it is a JSON object"""
+    try:
+        data = request.data
+    except ParseError as e:
+        raise ValidationError(str(e.detail))
+    if not isinstance(data, dict):
+        raise ValidationError('Request body must be a JSON object')
+    return data
+
+def validated_options(data, serializer_class=ParseOptionsSerializer):
+    """Validate the options of a parse request, raising ValidationError with the first problem"""
+    requested = serializer_class(data=data)
+    if not requested.is_valid():
+        raise ValidationError(requested.first_error())
+    return requested.validated_data
+
+def parse_options(options):
+    """Read the per-repository parse options from a parse request's validated options"""
+    return {
+        'max_depth': options.get('max_depth', settings.BITBUCKET_TREE_MAX_DEPTH),
+        'include': options.get('include'),
+        'exclude': options.get('exclude'),
+        'full': options.get('full', False)
+    }
+
+def repository_and_options(request):
+    """Create or update the repository named in a parse request and read its parse options"""
+    data = request_object(request)
+    workspace = data.get('workspace')
+    repository = data.get('repository')
+    access_token = data.get('access_token')
+
+    if not all([workspace, repository, access_token]):
+        raise ValidationError('Missing required fields: workspace, repository, access_token')
+
+    options = validated_options(data)
+
+    # Create or get repository
+    repo_obj = save_repository(workspace, repository, access_token)
+
+    # The client may only lower the configured concurrency limit
+    concurrency = settings.BITBUCKET_FETCH_CONCURRENCY
+    if options.get('concurrency'):
+        concurrency = min(options['concurrency'], concurrency)
+    return repo_obj, {'concurrency': concurrency, **parse_options(options)}
+
 @api_view(['POST'])
 def parse_repository(request):
-    """API endpoint to parse YAML files from a repository"""
+    """API endpoint to parse YAML files from a repository (queued as a job unless 'sync' is set)"""
     try:
-        # Get repository data from request
-        workspace = request.data.get('workspace')
-        repository = request.data.get('repository')
-        access_token = request.data.get('access_token')
-
-        if not all([workspace, repository, access_token]):
+        try:
+            repo_obj, options = repository_and_options(request)
+        except ValidationError as e:
             return Response({
-                'error': 'Missing required fields: workspace, repository, access_token'
+                'error': e.detail[0]
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create or get repository
-        repo_obj, created = Repository.objects.get_or_create(
-            workspace=workspace,
-            repository=repository,
-            defaults={'access_token': access_token}
-        )
-        
-        if not created:
-            repo_obj.access_token = access_token
-            repo_obj.save()
-
-        # Initialize Bitbucket reader
-        reader = BitbucketYAMLReader(access_token, workspace, repository)
-        
-        # Get YAML files
-        yaml_files = reader.list_yaml_files()
-        
-        if not yaml_files:
+        if not request.data.get('sync'):
+            # Parse in the background and let the client poll for progress
+            job = enqueue_parse_job(repo_obj, options)
             return Response({
-                'message': 'No YAML files found in the repository',
-                'repository_id': repo_obj.id
-            }, status=status.HTTP_200_OK)
+                'message': 'Parse job queued',
+                'job_id': job.id,
+                'status': job.status,
+                'repository_id': repo_obj.id,
+                'status_url': reverse('parse-job-detail', args=[job.id])
+            }, status=status.HTTP_202_ACCEPTED)
 
-        parsed_files = []
-        extracted_services = []
-        
-        # Initialize service extractor
-        service_extractor = SpringBootServiceExtractor()
-        
-        # Parse each YAML file
-        for file_path in yaml_files:
-            content = reader.get_file_content(file_path)
-            if content:
-                parsed_data = reader.parse_yaml_content(content)
-                
-                # Create or update YAML file record
-                yaml_file, created = YAMLFile.objects.get_or_create(
-                    repository=repo_obj,
-                    file_path=file_path,
-                    defaults={
-                        'content': content,
-                        'parsed_data': parsed_data
-                    }
-                )
-                
-                if not created:
-                    yaml_file.content = content
-                    yaml_file.parsed_data = parsed_data
-                    yaml_file.save()
-
-                # Extract services from the YAML data
-                if parsed_data:
-                    service_info = service_extractor.extract_service_info(parsed_data)
-                    
-                    # Create service record if service name is found
-                    if service_info.get('service_name') and service_info['service_name'].get('value'):
-                        service_name = service_info['service_name']['value']
-                        
-                        # Create or update service
-                        service, service_created = Service.objects.get_or_create(
-                            yaml_file=yaml_file,
-                            service_name=service_name,
-                            defaults={
-                                'dependent_services': service_info.get('dependent_services', []),
-                                'dependent_infrastructure': service_info.get('dependent_infrastructure', []),
-                                'port': service_info.get('port', {}).get('value') if service_info.get('port') else None,
-                                'protocol': service_info.get('protocol', {}).get('value') if service_info.get('protocol') else None,
-                                'additional_data': service_info.get('additional_data', {})
-                            }
-                        )
-                        
-                        if not service_created:
-                            # Update existing service
-                            service.dependent_services = service_info.get('dependent_services', [])
-                            service.dependent_infrastructure = service_info.get('dependent_infrastructure', [])
-                            service.port = service_info.get('port', {}).get('value') if service_info.get('port') else None
-                            service.protocol = service_info.get('protocol', {}).get('value') if service_info.get('protocol') else None
-                            service.additional_data = service_info.get('additional_data', {})
-                            service.save()
-                        
-                        extracted_services.append({
-                            'service_name': service_name,
-                            'port': service.port,
-                            'protocol': service.protocol,
-                            'dependent_services': service.dependent_services,
-                            'dependent_infrastructure': service.dependent_infrastructure,
-                            'extraction_confidence': service_info['service_name'].get('confidence', 0)
-                        })
-
-                parsed_files.append({
-                    'file_path': file_path,
-                    'parsed_data': parsed_data,
-                    'services_extracted': len(extracted_services) if file_path == yaml_files[-1] else 0
-                })
+        parser = build_parser(repo_obj, options)
+        result = parser.parse(full=options['full'])
 
         return Response({
-            'message': f'Successfully parsed {len(parsed_files)} YAML files and extracted {len(extracted_services)} services',
+            'message': summary_message(result),
             'repository_id': repo_obj.id,
-            'files': parsed_files,
-            'services': extracted_services
+            **result,
+            'http_stats': parser.reader.client.stats()
         }, status=status.HTTP_200_OK)
 
     except Exception as e:
@@ -190,41 +205,231 @@ def parse_repository(request):
             'error': f'Error parsing repository: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def parse_events(repository, options):
+    """Run a parse, yielding NDJSON lines: 'start', one 'file' per stored file, then 'done' or 'error'"""
+    def line(event):
+        return render_json(event) + b'\n'
+
+    started = time.monotonic()
+    yield line({'event': 'start', 'repository_id': repository.id})
+    services = 0
+    try:
+        parser = build_parser(repository, options, streaming=True)
+        for result in parser.iter_parse(full=options['full']):
+            services += 1 if result['service'] else 0
+            elapsed = time.monotonic() - started
+            yield line({
+                'event': 'file',
+                **result,
+                'processed_files': parser.processed_files,
+                'total_files': parser.total_files,
+                'files_per_second': round(parser.processed_files / elapsed, 2) if elapsed > 0 else None
+            })
+        yield line({
+            'event': 'done',
+            'message': summary_message(parser.summary, parser.processed_files, services),
+            'repository_id': repository.id,
+            **parser.summary,
+            'processed_files': parser.processed_files,
+            'services_extracted': services,
+            'http_stats': parser.reader.client.stats()
+        })
+    except Exception as e:
+        yield line({'event': 'error', 'error': f'Error parsing repository: {str(e)}'})
+
+@api_view(['POST'])
+def parse_repository_stream(request):
+    """API endpoint to parse a repository, streaming each file's result as NDJSON as soon as it is stored"""
+    # Validate before the stream starts, while a 400 can still be returned
+    try:
+        repo_obj, options = repository_and_options(request)
+    except ValidationError as e:
+        return Response({
+            'error': e.detail[0]
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(parse_events(repo_obj, options), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    # Ask reverse proxies not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['POST'])
+def parse_batch(request):
+    """API endpoint to queue a parse of many repositories, or of every repository in a workspace"""
+    try:
+        data = request_object(request)
+        repository_options = parse_options(validated_options(data))
+        budget = validated_options(data, BatchOptionsSerializer)
+    except ValidationError as e:
+        return Response({
+            'error': e.detail[0]
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        repositories = batch_repositories(
+            data.get('repositories'),
+            workspace=data.get('workspace'),
+            access_token=data.get('access_token')
+        )
+    except (TypeError, ValueError) as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    options = batch_options(budget.get('concurrency'), budget.get('rate_limit'), budget.get('repository_concurrency'))
+    batch = create_parse_batch(repositories, repository_options, options)
+    return Response({
+        'message': f'Parse batch of {len(repositories)} repositories queued',
+        'batch_id': batch.id,
+        'status': batch.status,
+        'repository_ids': [repository.id for repository in repositories],
+        'status_url': reverse('parse-batch-detail', args=[batch.id])
+    }, status=status.HTTP_202_ACCEPTED)
+
+class ParseBatchDetailView(RetrieveAPIView):
+    """API view for polling the progress and aggregate throughput of a parse batch"""
+    queryset = ParseBatch.objects.prefetch_related('jobs__repository')
+    serializer_class = ParseBatchSerializer
+
 @api_view(['GET'])
 def get_repository_files(request, repository_id):
     """API endpoint to get all YAML files for a specific repository"""
     try:
         repository = get_object_or_404(Repository, id=repository_id)
-        yaml_files = YAMLFile.objects.filter(repository=repository)
-        serializer = YAMLFileSerializer(yaml_files, many=True)
-        
-        return Response({
-            'repository': RepositorySerializer(repository).data,
-            'files': serializer.data
-        }, status=status.HTTP_200_OK)
+
+        def build():
+            yaml_files = YAMLFile.objects.filter(repository=repository).order_by('file_path')
+            serializer = FlatYAMLFileSerializer(include_content=include_content(request))
+            return {
+                'repository': RepositorySerializer(repository).data,
+                'files': serializer.serialize(serializer.values(yaml_files))
+            }
+
+        return cached_response(request, repository_version(repository), build)
         
     except Exception as e:
         return Response({
             'error': f'Error retrieving files: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def catalog_fields(request):
+    """Fields requested with ?fields=, raising ValidationError for unknown ones"""
+    fields = [name.strip() for name in request.query_params.get('fields', '').split(',') if name.strip()]
+    ServiceCatalogSerializer.check_fields(fields)
+    return fields
+
+def service_catalog_page(request, fields):
+    """Build one cursor page of the service catalog"""
+    services = Service.objects.all()
+    paginator = ServiceCatalogPagination()
+    if FlatServiceCatalogSerializer.supports(fields):
+        # Plain columns only: read them as values() rows and skip building model instances
+        serializer = FlatServiceCatalogSerializer(fields)
+        page = paginator.paginate_queryset(serializer.values(services, *paginator.ordering), request)
+        data = serializer.serialize(page)
+    else:
+        services = services.select_related('yaml_file__repository').prefetch_related('yaml_file__documents')
+        if include_content(request):
+            services = services.select_related('yaml_file__blob')
+        page = paginator.paginate_queryset(services, request)
+        data = ServiceCatalogSerializer(page, many=True, fields=fields,
+                                        context={'include_content': include_content(request)}).data
+    return {
+        'services': data,
+        'total_count': services.count(),
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link()
+    }
+
 @api_view(['GET'])
 def get_service_catalog(request):
-    """API endpoint to get all services for the service catalog"""
+    """API endpoint to get a page of services for the service catalog"""
     try:
-        services = Service.objects.all().select_related('yaml_file__repository')
-        serializer = ServiceSerializer(services, many=True)
-        
+        try:
+            fields = catalog_fields(request)
+        except ValidationError as e:
+            return Response({
+                'error': e.detail['fields']
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return cached_response(request, catalog_version(), lambda: service_catalog_page(request, fields))
+
+    except NotFound as e:
+        # Raised by the paginator for an unknown cursor
         return Response({
-            'services': serializer.data,
-            'total_count': len(services)
-        }, status=status.HTTP_200_OK)
-        
+            'error': str(e.detail)
+        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({
             'error': f'Error retrieving services: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def async_api_view(methods):
+    """
+    Async counterpart of DRF's api_view for coroutine views: CSRF exempt, other methods
+    answered with 405, and the request wrapped in a DRF Request for ``data``/``query_params``
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+@async_api_view(['POST'])
+async def aparse_repository(request):
+    """Async API endpoint to parse a repository inline, serving other requests while waiting on Bitbucket"""
+    try:
+        try:
+            repo_obj, options = await sync_to_async(repository_and_options)(request)
+        except ValidationError as e:
+            return JsonResponse({
+                'error': e.detail[0]
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        parser = build_parser(repo_obj, options, reader_class=AsyncBitbucketYAMLReader)
+        result = await parser.aparse(full=options['full'])
+
+        return HttpResponse(render_json({
+            'message': summary_message(result),
+            'repository_id': repo_obj.id,
+            **result,
+            'http_stats': parser.reader.aclient.stats()
+        }), content_type='application/json', status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Error parsing repository: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@async_api_view(['GET'])
+async def aget_service_catalog(request):
+    """Async API endpoint to get a page of services for the service catalog"""
+    try:
+        fields = catalog_fields(request)
+    except ValidationError as e:
+        return JsonResponse({
+            'error': e.detail['fields']
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        return await sync_to_async(
+            lambda: cached_response(request, catalog_version(), lambda: service_catalog_page(request, fields))
+        )()
+    except NotFound as e:
+        return JsonResponse({
+            'error': str(e.detail)
+        }, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Error retrieving services: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['POST'])
 def extract_services_from_yaml(request):
     """API endpoint to extract services from existing YAML files"""
@@ -238,7 +443,7 @@ def extract_services_from_yaml(request):
         
         yaml_file = get_object_or_404(YAMLFile, id=yaml_file_id)
         
-        if not yaml_file.parsed_data:
+        if not yaml_file.has_parsed_data:
             return Response({
                 'error': 'YAML file has no parsed data'
             }, status=status.HTTP_400_BAD_REQUEST)
@@ -247,32 +452,14 @@ def extract_services_from_yaml(request):
         service_extractor = SpringBootServiceExtractor()
         
         # Extract services
-        service_info = service_extractor.extract_service_info(yaml_file.parsed_data)
+        service_info = service_extractor.extract_from_documents(yaml_file.parsed_documents())
         
         # Create service record if service name is found
         if service_info.get('service_name') and service_info['service_name'].get('value'):
             service_name = service_info['service_name']['value']
             
-            service, created = Service.objects.get_or_create(
-                yaml_file=yaml_file,
-                service_name=service_name,
-                defaults={
-                    'dependent_services': service_info.get('dependent_services', []),
-                    'dependent_infrastructure': service_info.get('dependent_infrastructure', []),
-                    'port': service_info.get('port', {}).get('value') if service_info.get('port') else None,
-                    'protocol': service_info.get('protocol', {}).get('value') if service_info.get('protocol') else None,
-                    'additional_data': service_info.get('additional_data', {})
-                }
-            )
-            
-            if not created:
-                # Update existing service
-                service.dependent_services = service_info.get('dependent_services', [])
-                service.dependent_infrastructure = service_info.get('dependent_infrastructure', [])
-                service.port = service_info.get('port', {}).get('value') if service_info.get('port') else None
-                service.protocol = service_info.get('protocol', {}).get('value') if service_info.get('protocol') else None
-                service.additional_data = service_info.get('additional_data', {})
-                service.save()
+            service = save_service(yaml_file, service_name, service_info)
+            bump_generation(yaml_file.repository_id)
             
             serializer = ServiceSerializer(service)
             
@@ -291,3 +478,8 @@ def extract_services_from_yaml(request):
         return Response({
             'error': f'Error extracting services: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def metrics(request):
+    """Prometheus scrape endpoint with the parse pipeline metrics of this process"""
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,115 @@
+"""
+YAML parser backends
+
+Uses PyYAML's LibYAML bindings (``CSafeLoader``) when PyYAML was built with
+them and the pure-Python ``SafeLoader`` otherwise. Both are safe loaders, so
+the parsed data is the same whichever backend runs.
+"""
+
+from typing import Any, Iterator, List, Optional, Tuple
+
+import yaml
+
+try:
+    from yaml import CSafeLoader
+except ImportError:  # PyYAML built without libyaml
+    CSafeLoader = None
+
+LIBYAML = 'libyaml'
+PURE_PYTHON = 'python'
+
+# Backend used for every parse unless libyaml rejects the content
+DEFAULT_BACKEND = LIBYAML if CSafeLoader is not None else PURE_PYTHON
+
+LOADERS = {PURE_PYTHON: yaml.SafeLoader}
+if CSafeLoader is not None:
+    LOADERS[LIBYAML] = CSafeLoader
+
+
+class DocumentStream:
+    """
+    The documents of a YAML stream, parsed one at a time while iterating.
+
+    Only the document being composed is held in memory by the parser, so
+    manifests with hundreds of documents can be consumed incrementally.
+    If libyaml rejects the content, iteration continues with the pure-Python
+    loader from the first document not yet produced.
+    """
+
+    def __init__(self, content: str, backend: Optional[str] = None):
+        """
+        Args:
+            content (str): YAML content
+            backend (str): Backend to start with (defaults to DEFAULT_BACKEND)
+        """
+        self.content = content
+        self.backend = backend or DEFAULT_BACKEND
+        self.count = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            for document in yaml.load_all(self.content, Loader=LOADERS[self.backend]):
+                self.count += 1
+                yield document
+        except yaml.YAMLError:
+            if self.backend == PURE_PYTHON:
+                raise
+            skip, self.backend = self.count, PURE_PYTHON
+            for index, document in enumerate(yaml.load_all(self.content, Loader=LOADERS[PURE_PYTHON])):
+                if index >= skip:
+                    self.count += 1
+                    yield document
+
+
+def assemble_documents(documents: List[Any]) -> Any:
+    """
+    Combine parsed documents the way a whole YAML stream is reported.
+
+    Returns:
+        Any: The document of a single-document stream, None for an empty stream,
+        or ``{'document_1': ..., 'document_2': ...}`` for a multi-document stream
+    """
+    if not documents:
+        return None
+    if len(documents) == 1:
+        return documents[0]
+    # Return a dictionary with numbered documents
+    return {f"document_{i+1}": doc for i, doc in enumerate(documents)}
+
+
+def load_documents(content: str, backend: str = DEFAULT_BACKEND) -> Any:
+    """
+    Parse a whole YAML stream in a single pass with one backend.
+
+    Args:
+        content (str): YAML content
+        backend (str): Backend to use (LIBYAML or PURE_PYTHON)
+
+    Returns:
+        Any: The parsed stream (see assemble_documents)
+
+    Raises:
+        yaml.YAMLError: If the content is not valid YAML
+    """
+    return assemble_documents(list(yaml.load_all(content, Loader=LOADERS[backend])))
+
+
+def parse_yaml(content: str) -> Tuple[Any, str]:
+    """
+    Parse YAML content with the fastest available backend.
+
+    Content libyaml rejects is parsed again with the pure-Python loader, so
+    the result never depends on which backend is installed.
+
+    Args:
+        content (str): YAML content
+
+    Returns:
+        Tuple[Any, str]: The parsed data (see assemble_documents) and the backend that produced it
+
+    Raises:
+        yaml.YAMLError: If the content is not valid YAML
+    """
+    stream = DocumentStream(content)
+    documents = list(stream)
+    return assemble_documents(documents), stream.backend
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import os
 
@@ -82,6 +83,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Threaded tests (parse jobs and batches) need a file database: SQLite's
+        # shared in-memory mode fails with "table is locked" instead of waiting
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
@@ -136,8 +140,14 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # orjson renders and parses large parsed_data trees several times faster when installed
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'yaml_parser.renderers.ORJSONRenderer' if find_spec('orjson') else 'rest_framework.renderers.JSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'yaml_parser.renderers.ORJSONParser' if find_spec('orjson') else 'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
 }
 
@@ -148,3 +158,76 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Bitbucket client settings
+BITBUCKET_API_URL = os.environ.get('BITBUCKET_API_URL', 'https://api.bitbucket.org/2.0')
+# Maximum number of file downloads in flight per parse request
+BITBUCKET_FETCH_CONCURRENCY = int(os.environ.get('BITBUCKET_FETCH_CONCURRENCY', 8))
+# Maximum number of directory listing requests in flight while walking the repository tree
+BITBUCKET_LISTING_CONCURRENCY = int(os.environ.get('BITBUCKET_LISTING_CONCURRENCY', 4))
+# Deepest directory level scanned for YAML files (None scans the whole tree)
+BITBUCKET_TREE_MAX_DEPTH = None
+# Maximum requests per second against the Bitbucket host (0 disables rate limiting)
+BITBUCKET_RATE_LIMIT = float(os.environ.get('BITBUCKET_RATE_LIMIT', 10))
+
+# Parse job settings
+# 'thread' runs parse jobs on an in-process thread pool; 'worker' leaves them
+# queued for `python manage.py run_parse_worker`
+PARSE_JOB_RUNNER = os.environ.get('PARSE_JOB_RUNNER', 'thread')
+# Number of parse jobs run at once by the in-process runner
+PARSE_JOB_WORKERS = int(os.environ.get('PARSE_JOB_WORKERS', 2))
+# Repositories with more stored files than this are deleted in the background
+REPOSITORY_DELETE_BACKGROUND_FILES = int(os.environ.get('REPOSITORY_DELETE_BACKGROUND_FILES', 5000))
+# Number of fetched files looked up in the parse cache together
+PARSE_BATCH_SIZE = 50
+# Number of changed files upserted to the database in one transaction
+PARSE_WRITE_BATCH_SIZE = 500
+# Worker processes parsing YAML and extracting services (0 parses in the requesting thread)
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 0))
+# Largest number of files handed to a parse worker at once
+PARSE_CHUNK_SIZE = 8
+# Documents of a file kept in memory while it is parsed; files with more are written as they are parsed
+PARSE_SPOOL_DOCUMENTS = 100
+# Bitbucket requests in flight across all repositories of a batch parse
+PARSE_BATCH_CONCURRENCY = int(os.environ.get('PARSE_BATCH_CONCURRENCY', 16))
+# Repositories of a batch parse processed at the same time
+PARSE_BATCH_REPOSITORY_CONCURRENCY = int(os.environ.get('PARSE_BATCH_REPOSITORY_CONCURRENCY', 4))
+
+# Service extraction rules added to the built-in Spring Boot rules, e.g.
+# {'field': 'dependent_infrastructure', 'path': 'spring.data.mongodb',
+#  'item': {'type': 'mongodb', 'details': '{value}'}}
+SERVICE_EXTRACTION_RULES = []
+# Optional YAML file with a list of further extraction rules
+SERVICE_EXTRACTION_RULES_FILE = os.environ.get('SERVICE_EXTRACTION_RULES_FILE')
+
+# Services returned per service catalog page (clients may ask for up to 1000 with ?page_size=)
+SERVICE_CATALOG_PAGE_SIZE = 100
+
+# Rendered responses of the read endpoints, keyed by ETag (see yaml_parser/caching.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yaml-parser',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Pipeline warnings (failed fetches, invalid YAML) and per-file debug output of
+# the yaml_parser modules; set YAML_PARSER_LOG_LEVEL=DEBUG to see the latter
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'yaml_parser': {
+            'handlers': ['console'],
+            'level': os.environ.get('YAML_PARSER_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
@@ -19,8 +19,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
 
+from yaml_parser.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('yaml_parser.urls')),
+    path('metrics', metrics, name='metrics'),
     path('', TemplateView.as_view(template_name='index.html'), name='home'),
 ]